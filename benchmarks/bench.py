@@ -0,0 +1,311 @@
+### SPDX-License-Identifier: GPL-2.0-or-later
+
+"""Benchmark testdrive hot paths"""
+
+from argparse import ArgumentParser
+from contextlib import redirect_stdout
+import io
+import json
+import os
+import platform
+import stat
+import subprocess
+import sys
+from tempfile import TemporaryDirectory
+from time import perf_counter
+import tracemalloc
+
+from testdrive.__main__ import COMMANDS
+from testdrive.asciidoc import (Config, TestSuites)
+from testdrive.cases import summarize
+from testdrive.junit.create import junit
+from testdrive.junit.merge import merge
+from testdrive.run import drive
+
+BASEURL = 'https://github.com/redhat-partner-solutions/testdrive/'
+
+def gen_results(cases, payload, images=0, imagedir=None, offset=0):
+    """Return a tuple of synthetic test results.
+
+    `cases` is the number of results; `payload` the number of bytes of data in
+    each result; `images` the number of plot images in each result, which are
+    created in `imagedir`; `offset` the index of the first result.
+    """
+    results = []
+    for idx in range(offset, offset + cases):
+        result = (True, False, 'error')[idx % 3]
+        (mins, secs) = divmod(idx % 3600, 60)
+        dct = {
+            'result': result,
+            'reason': None if result is True else f'reason {idx}',
+            'data': {'payload': 'x' * payload},
+            'argv': [],
+            'id': f'{BASEURL}case/{idx}/',
+            'timestamp': f'2023-08-25T07:{mins:02}:{secs:02}.000000+00:00',
+            'duration': 0.5,
+        }
+        if images:
+            dct['plot'] = []
+            for num in range(images):
+                path = os.path.join(imagedir, f'{idx}_{num}.png')
+                with open(path, 'wb') as fid:
+                    fid.write(b'\x89PNG' + bytes(payload))
+                dct['plot'].append({'path': path, 'title': f'plot {num}'})
+        results.append(dct)
+    return tuple(results)
+
+def gen_test(dirname, payload):
+    """Return the path to a synthetic test implementation in `dirname`.
+
+    The test outputs a successful result with `payload` bytes of data.
+    """
+    path = os.path.join(dirname, 'testimpl.sh')
+    result = json.dumps({'result': True, 'reason': None, 'data': 'x' * payload})
+    with open(path, 'w', encoding='utf-8') as fid:
+        fid.write(f"#!/bin/sh\ncat <<'EOF'\n{result}\nEOF\n")
+    os.chmod(path, stat.S_IRWXU)
+    return path
+
+def gen_junit(dirname, suites, cases, payload):
+    """Return a list of paths to synthetic JUnit files in `dirname`.
+
+    Generate a file for each of `suites`, each with `cases` test results.
+    """
+    paths = []
+    for num in range(suites):
+        path = os.path.join(dirname, f'suite{num}.xml')
+        results = gen_results(cases, payload, offset=num * cases)
+        with open(path, 'w', encoding='utf-8') as fid:
+            fid.write(junit(f'suite{num}', results, hostname='localhost'))
+        paths.append(path)
+    return paths
+
+def bench_drive(args, tmpdir):
+    """Return (func, cases) to benchmark drive() on a synthetic test."""
+    test = gen_test(tmpdir, args.payload)
+    def func():
+        for _ in range(args.drive_cases):
+            drive(test)
+    return (func, args.drive_cases)
+
+def bench_spawn(args, tmpdir):
+    """Return (func, cases) to benchmark spawning a synthetic test.
+
+    This is the baseline for drive() overhead per case.
+    """
+    test = gen_test(tmpdir, args.payload)
+    def func():
+        for _ in range(args.drive_cases):
+            subprocess.run((test,), capture_output=True, check=False)
+    return (func, args.drive_cases)
+
+def bench_python(args, tmpdir): # pylint: disable=unused-argument
+    """Return (func, cases) to benchmark starting the Python interpreter.
+
+    This is the baseline for testdrive command startup.
+    """
+    def func():
+        for _ in range(args.startup_runs):
+            subprocess.run((sys.executable, '-c', 'pass'), check=True)
+    return (func, args.startup_runs)
+
+def bench_startup(args, tmpdir): # pylint: disable=unused-argument
+    """Return (func, cases) to benchmark starting each testdrive command.
+
+    Each command is started via `python3 -m testdrive` with option --help,
+    so that the time measured is dominated by importing the command.
+    """
+    argv = tuple(
+        (sys.executable, '-m', 'testdrive', command, '--help')
+        for command in COMMANDS
+    )
+    def func():
+        for _ in range(args.startup_runs):
+            for args_ in argv:
+                subprocess.run(args_, capture_output=True, check=True)
+    return (func, args.startup_runs * len(argv))
+
+def bench_junit(args, tmpdir): # pylint: disable=unused-argument
+    """Return (func, cases) to benchmark junit() generation."""
+    results = gen_results(args.cases, args.payload)
+    return (lambda: junit('suite', results, hostname='localhost'), args.cases)
+
+def bench_summarize(args, tmpdir): # pylint: disable=unused-argument
+    """Return (func, cases) to benchmark summarize()."""
+    results = gen_results(args.cases, args.payload)
+    return (lambda: summarize(results), args.cases)
+
+def bench_merge(args, tmpdir):
+    """Return (func, cases) to benchmark merging many JUnit files."""
+    per_suite = args.cases // args.suites
+    paths = gen_junit(tmpdir, args.suites, per_suite, args.payload)
+    return (lambda: merge(paths), args.suites * per_suite)
+
+def bench_asciidoc(args, tmpdir):
+    """Return (func, cases) to benchmark asciidoc rendering."""
+    imagedir = os.path.join(tmpdir, 'plots')
+    objdir = os.path.join(tmpdir, 'objdir')
+    os.makedirs(imagedir)
+    os.makedirs(os.path.join(objdir, 'pdf-assets/images'))
+    per_suite = args.cases // args.suites
+    config = Config({'repositories': {}, 'suites': {}})
+    paths = []
+    for num in range(args.suites):
+        path = os.path.join(tmpdir, f'asciidoc{num}.xml')
+        results = gen_results(
+            per_suite, args.payload, args.images, imagedir, num * per_suite,
+        )
+        with open(path, 'w', encoding='utf-8') as fid:
+            fid.write(junit(f'suite{num}', results, hostname='localhost'))
+        paths.append(path)
+    def func():
+        suites = TestSuites()
+        for path in paths:
+            suites.include(path)
+        with redirect_stdout(io.StringIO()):
+            print(*suites.summary('==='), sep='\n')
+            print(*suites.results(objdir, config, '==='), sep='\n')
+            print(*suites.specs(objdir, config, '==='), sep='\n')
+    return (func, args.suites * per_suite)
+
+BENCHMARKS = {
+    'spawn': bench_spawn,
+    'drive': bench_drive,
+    'junit': bench_junit,
+    'summarize': bench_summarize,
+    'merge': bench_merge,
+    'asciidoc': bench_asciidoc,
+    'python': bench_python,
+    'startup': bench_startup,
+}
+
+def measure(setup, args):
+    """Return a dict of measurements for benchmark `setup`.
+
+    Time the benchmark `args.repeat` times, then measure its peak memory
+    allocation (separately, since tracing memory allocation slows execution).
+    """
+    times = []
+    with TemporaryDirectory() as tmpdir:
+        (func, cases) = setup(args, tmpdir)
+        for _ in range(args.repeat):
+            start = perf_counter()
+            func()
+            times.append(perf_counter() - start)
+        tracemalloc.start()
+        func()
+        (_, peak) = tracemalloc.get_traced_memory()
+        tracemalloc.stop()
+    best = min(times)
+    return {
+        'cases': cases,
+        'seconds': round(best, 6),
+        'seconds_mean': round(sum(times) / len(times), 6),
+        'us_per_case': round(best * 1e6 / cases, 3),
+        'cases_per_second': round(cases / best, 3),
+        'peak_bytes': peak,
+    }
+
+def compare(results, baseline, threshold):
+    """Return a list of names of benchmarks in `results` which regressed.
+
+    A benchmark regressed if it is more than `threshold` (a fraction) slower
+    than in `baseline`.
+    """
+    regressed = []
+    for (name, dct) in results.items():
+        try:
+            before = baseline['results'][name]['us_per_case']
+        except KeyError:
+            continue
+        if dct['us_per_case'] > before * (1 + threshold):
+            regressed.append(name)
+    return regressed
+
+def main():
+    """Benchmark testdrive, printing results as a JSON object to stdout"""
+    aparser = ArgumentParser(description=main.__doc__)
+    aparser.add_argument(
+        '--cases', type=int, default=10000,
+        help="number of test cases in synthetic test results",
+    )
+    aparser.add_argument(
+        '--drive-cases', type=int, default=100,
+        help="number of test cases to run when benchmarking drive()",
+    )
+    aparser.add_argument(
+        '--startup-runs', type=int, default=5,
+        help="number of times to start each command when benchmarking startup",
+    )
+    aparser.add_argument(
+        '--payload', type=int, default=256,
+        help="number of bytes of data in each test result",
+    )
+    aparser.add_argument(
+        '--images', type=int, default=1,
+        help="number of plot images in each test result for asciidoc",
+    )
+    aparser.add_argument(
+        '--suites', type=int, default=10,
+        help="number of test suites (JUnit files) for merge and asciidoc",
+    )
+    aparser.add_argument(
+        '--repeat', type=int, default=3,
+        help="number of times to time each benchmark (best time is used)",
+    )
+    aparser.add_argument(
+        '--baseline',
+        help=' '.join((
+            "JSON output of a previous benchmark to compare with;",
+            "exit with error if any benchmark regressed",
+        )),
+    )
+    aparser.add_argument(
+        '--threshold', type=float, default=0.1,
+        help="fraction slower than baseline which is a regression",
+    )
+    aparser.add_argument(
+        'benchmarks', nargs='*',
+        help=' '.join((
+            f"benchmarks to run, from: {', '.join(BENCHMARKS)};",
+            "if not supplied then run all benchmarks",
+        )),
+    )
+    args = aparser.parse_args()
+    names = args.benchmarks or tuple(BENCHMARKS)
+    for name in names:
+        if name not in BENCHMARKS:
+            aparser.error(f'unknown benchmark {name}')
+    results = {name: measure(BENCHMARKS[name], args) for name in names}
+    if 'drive' in results and 'spawn' in results:
+        results['drive']['us_overhead_per_case'] = round(
+            results['drive']['us_per_case'] - results['spawn']['us_per_case'],
+            3,
+        )
+    if 'startup' in results and 'python' in results:
+        results['startup']['us_overhead_per_case'] = round(
+            results['startup']['us_per_case']
+            - results['python']['us_per_case'],
+            3,
+        )
+    output = {
+        'python': platform.python_version(),
+        'platform': platform.platform(),
+        'params': {
+            k: getattr(args, k)
+            for k in (
+                'cases', 'drive_cases', 'startup_runs',
+                'payload', 'images', 'suites',
+            )
+        },
+        'results': results,
+    }
+    print(json.dumps(output, indent=4))
+    if args.baseline:
+        with open(args.baseline, encoding='utf-8') as fid:
+            regressed = compare(results, json.load(fid), args.threshold)
+        if regressed:
+            sys.exit(f"regressed: {' '.join(regressed)}")
+
+if __name__ == '__main__':
+    main()
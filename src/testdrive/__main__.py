@@ -0,0 +1,56 @@
+### SPDX-License-Identifier: GPL-2.0-or-later
+
+"""Run a testdrive command: python3 -m testdrive COMMAND [ARGS...]
+
+Only the module implementing COMMAND is imported, so that each invocation
+starts quickly.
+"""
+
+from importlib import import_module
+import sys
+
+# map of command name to (module, description)
+COMMANDS = {
+    'run': ('testdrive.run', "run tests"),
+    'junit': ('testdrive.junit.create', "generate JUnit output"),
+    'merge': ('testdrive.junit.merge', "merge JUnit files"),
+    'split': ('testdrive.junit.split', "split JUnit output into shards"),
+    'xml': ('testdrive.xml', "validate and pretty print XML"),
+    'asciidoc': ('testdrive.asciidoc', "generate asciidoc"),
+    'history': ('testdrive.history', "query test result history"),
+    'compare': ('testdrive.compare', "compare test results between runs"),
+    'watch': ('testdrive.watch', "follow test results as they are written"),
+    'artifacts': ('testdrive.artifacts', "manage an artifact store"),
+}
+
+def usage():
+    """Return a usage message listing commands."""
+    width = max(len(name) for name in COMMANDS)
+    return '\n'.join((
+        'usage: testdrive COMMAND [ARGS...]',
+        '',
+        'commands:',
+        *(
+            f'  {name:{width}}  {description}'
+            for (name, (_, description)) in COMMANDS.items()
+        ),
+        '',
+        "Use 'testdrive COMMAND --help' for help on COMMAND.",
+    ))
+
+def main():
+    """Run the command named by the first arg with the remaining args."""
+    if len(sys.argv) < 2 or sys.argv[1] in ('-h', '--help'):
+        print(usage())
+        return
+    command = sys.argv[1]
+    try:
+        (module, _) = COMMANDS[command]
+    except KeyError:
+        sys.exit(f'testdrive: unknown command "{command}"\n\n{usage()}')
+    # argparse uses argv[0] as the program name in usage messages
+    sys.argv = [f'testdrive {command}', *sys.argv[2:]]
+    import_module(module).main()
+
+if __name__ == '__main__':
+    main()
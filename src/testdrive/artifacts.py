@@ -0,0 +1,242 @@
+### SPDX-License-Identifier: GPL-2.0-or-later
+
+"""A content-addressed store of test artifacts, such as plot images"""
+
+from argparse import ArgumentParser
+import hashlib
+import json
+import os
+import re
+from shutil import copyfile
+import threading
+from time import (monotonic, time)
+from uuid import uuid4
+
+from .common import (timenow, timestamp)
+
+# a blob name: the hex SHA-256 digest of its content, plus any file extension
+BLOB = re.compile(r'^[0-9a-f]{64}(\.[^/]*)?$')
+
+def digest(path):
+    """Return the hex SHA-256 digest of the content of file `path`."""
+    sha = hashlib.sha256()
+    with open(path, 'rb') as fid:
+        for chunk in iter(lambda: fid.read(1 << 16), b''):
+            sha.update(chunk)
+    return sha.hexdigest()
+
+def blob_name(path):
+    """Return the blob name for the content of file `path`.
+
+    If `path` is already a blob, then its name is returned without reading it.
+    """
+    basename = os.path.basename(path)
+    if BLOB.match(basename):
+        return basename
+    return digest(path) + os.path.splitext(path)[1]
+
+def link(src, dst):
+    """Create file `dst` with the content of `src`.
+
+    Hard link `dst` to `src` if possible, else copy `src` to `dst`.
+    """
+    try:
+        os.link(src, dst)
+    except OSError:
+        copyfile(src, dst)
+
+class ArtifactStore:
+    """A content-addressed store of artifact files in directory `root`.
+
+    Each distinct artifact content is stored once, as a blob named per
+    blob_name(), under `root`/blobs. Manifests under `root`/manifests record the
+    blobs referenced by each run: blobs not referenced by any manifest are
+    removed by gc(). Directory `root`/tmp is for files to be stored.
+    """
+    def __init__(self, root):
+        self.root = os.path.abspath(root)
+        self._blobs = os.path.join(self.root, 'blobs')
+        self._manifests = os.path.join(self.root, 'manifests')
+        self.tmpdir = os.path.join(self.root, 'tmp')
+        for dirname in (self._blobs, self._manifests, self.tmpdir):
+            os.makedirs(dirname, exist_ok=True)
+    def blob_path(self, name):
+        """Return the path to the blob `name`."""
+        return os.path.join(self._blobs, name[:2], name)
+    def put(self, path, remove=False):
+        """Store the content of file `path` and return the path to its blob.
+
+        If `remove` is True then `path` is removed once stored.
+        """
+        name = blob_name(path)
+        blob = self.blob_path(name)
+        if os.path.abspath(path) == blob:
+            return blob
+        if os.path.exists(blob):
+            # refresh the blob, so that gc() grace applies from now
+            os.utime(blob)
+            if remove:
+                os.unlink(path)
+            return blob
+        os.makedirs(os.path.dirname(blob), exist_ok=True)
+        tmpname = os.path.join(self.tmpdir, f'{uuid4()}.blob')
+        if remove:
+            try:
+                os.replace(path, tmpname)
+            except OSError:
+                copyfile(path, tmpname)
+                os.unlink(path)
+        else:
+            copyfile(path, tmpname)
+        os.replace(tmpname, blob)
+        return blob
+    def manifests(self):
+        """Return a list of manifest dicts, oldest first.
+
+        Each dict gives the manifest name, the timestamp it was created and a
+        list of the names of blobs it references.
+        """
+        dcts = []
+        for filename in os.listdir(self._manifests):
+            if filename.endswith('.json'):
+                path = os.path.join(self._manifests, filename)
+                with open(path, encoding='utf-8') as fid:
+                    dcts.append({'name': filename[:-5], **json.load(fid)})
+        return sorted(dcts, key=lambda dct: dct['created'])
+    def write_manifest(self, name, blobs, created=None):
+        """Write manifest `name` referencing blob names in `blobs`.
+
+        `created` is the timestamp the manifest was created, if not now.
+        """
+        tmpname = os.path.join(self.tmpdir, f'{uuid4()}.json')
+        with open(tmpname, 'w', encoding='utf-8') as fid:
+            json.dump(
+                {
+                    'created': created or timestamp(timenow()),
+                    'blobs': sorted(blobs),
+                },
+                fid,
+            )
+        os.replace(tmpname, os.path.join(self._manifests, f'{name}.json'))
+    def remove_manifest(self, name):
+        """Remove manifest `name`."""
+        os.unlink(os.path.join(self._manifests, f'{name}.json'))
+    def gc(self, grace=3600):
+        """Remove blobs not referenced by any manifest, and stale tmp files.
+
+        Files modified less than `grace` seconds ago are not removed, so that
+        blobs being stored by a run which has not yet updated its manifest
+        survive.
+        Return (count, size), the number and total size of files removed.
+        """
+        referenced = set()
+        for dct in self.manifests():
+            referenced.update(dct['blobs'])
+        cutoff = time() - grace
+        (count, size) = (0, 0)
+        for (dirpath, _, filenames) in os.walk(self._blobs):
+            for filename in filenames:
+                if filename in referenced:
+                    continue
+                path = os.path.join(dirpath, filename)
+                stat = os.stat(path)
+                if stat.st_mtime < cutoff:
+                    os.unlink(path)
+                    count += 1
+                    size += stat.st_size
+        for filename in os.listdir(self.tmpdir):
+            path = os.path.join(self.tmpdir, filename)
+            stat = os.stat(path)
+            if stat.st_mtime < cutoff:
+                os.unlink(path)
+                count += 1
+                size += stat.st_size
+        return (count, size)
+
+class Manifest:
+    """The blobs in ArtifactStore `store` referenced by a run, as `name`.
+
+    Files can be stored from multiple threads. The manifest is saved in `store`
+    when created, when closed and, while blobs are added to it, at most every
+    `interval` seconds. Blobs added since it was last saved were stored or
+    refreshed less than `interval` seconds ago, so gc() with a longer grace
+    period never removes blobs referenced by a run in progress, however long it
+    runs.
+    """
+    def __init__(self, store, name, interval=60.0):
+        self.store = store
+        self.name = name
+        self._interval = interval
+        self._lock = threading.Lock()
+        self._blobs = set()
+        self._created = timestamp(timenow())
+        self._unsaved = False
+        self._saved = monotonic()
+        self.write()
+    def put(self, path, remove=False):
+        """Store file `path` per ArtifactStore.put(), referencing its blob."""
+        blob = self.store.put(path, remove)
+        name = os.path.basename(blob)
+        with self._lock:
+            if name not in self._blobs:
+                self._blobs.add(name)
+                self._unsaved = True
+            if self._unsaved and monotonic() - self._saved >= self._interval:
+                self._write()
+        return blob
+    def write(self):
+        """Save this manifest in the store."""
+        with self._lock:
+            self._write()
+    def close(self):
+        """Save this manifest in the store, if blobs were added since saved."""
+        with self._lock:
+            if self._unsaved:
+                self._write()
+    def _write(self):
+        """Save this manifest in the store, with the lock held."""
+        self.store.write_manifest(self.name, self._blobs, self._created)
+        self._unsaved = False
+        self._saved = monotonic()
+
+def main():
+    """Manage a content-addressed store of test artifacts"""
+    aparser = ArgumentParser(description=main.__doc__)
+    aparser.add_argument('store', help="artifact store directory")
+    subparsers = aparser.add_subparsers(dest='command', required=True)
+    subparsers.add_parser('list', help="list manifests")
+    a_remove = subparsers.add_parser('remove', help="remove manifests")
+    a_remove.add_argument('names', nargs='+', help="manifest names")
+    a_gc = subparsers.add_parser(
+        'gc', help="remove blobs not referenced by any manifest",
+    )
+    a_gc.add_argument(
+        '--keep', type=int,
+        help="First remove all but this number of the latest manifests.",
+    )
+    a_gc.add_argument(
+        '--grace', type=float, default=3600,
+        help="Do not remove files modified less than this many seconds ago.",
+    )
+    args = aparser.parse_args()
+    store = ArtifactStore(args.store)
+    if args.command == 'list':
+        for dct in store.manifests():
+            print(json.dumps({
+                'name': dct['name'],
+                'created': dct['created'],
+                'blobs': len(dct['blobs']),
+            }))
+    elif args.command == 'remove':
+        for name in args.names:
+            store.remove_manifest(name)
+    else:
+        if args.keep is not None:
+            manifests = store.manifests()
+            for dct in manifests[:max(len(manifests) - args.keep, 0)]:
+                store.remove_manifest(dct['name'])
+        (count, size) = store.gc(args.grace)
+        print(json.dumps({'removed': count, 'bytes': size}))
+
+if __name__ == '__main__':
+    main()
@@ -3,14 +3,22 @@
 """Generate asciidoc output from JUnit inputs"""
 
 from argparse import ArgumentParser
+from array import array
 from collections import OrderedDict
+from collections.abc import Mapping
+from math import (isnan, nan)
 import os
 from shutil import copyfile
 import json
-from uuid import uuid4
+from sys import intern
+from uuid import (NAMESPACE_URL, uuid5)
 from decimal import Decimal
 from xml.etree import ElementTree as ET
 
+from .artifacts import (blob_name, link)
+from .cases import Summary
+from .common import (open_input, open_output)
+
 class Config(dict):
     """Configuration of asciidoc generation."""
     def case_path(self, case):
@@ -63,6 +71,9 @@ class Config(dict):
         with open(filename, encoding=encoding) as fid:
             return cls(json.load(fid))
 
+# JUnit elements for unsuccessful attempts to run a test case which was rerun
+RERUNS = ('rerunFailure', 'rerunError', 'flakyFailure', 'flakyError')
+
 NOT_RECORDED = '[.deemphasize]_not recorded_'
 EMPTY = '[.deemphasize]#-#'
 
@@ -78,10 +89,18 @@ def a_test_error(val):
     """Return asciidoc marking `val` as test error."""
     return f'[.test-error]#{val}#'
 
+def a_test_skipped(val):
+    """Return asciidoc marking `val` as test skipped."""
+    return f'[.test-skipped]#{val}#'
+
 def literal_block(val):
     """Return asciidoc marking `val` as a literal block."""
     return '\n'.join(('', '....', val, '....'))
 
+def first_line(val):
+    """Return the first line of string `val`, as per JUnit messages."""
+    return (val or '').split('\n', 1)[0]
+
 def row(*cells):
     """Return a string for an asciidoc table row with `cells`."""
     return '\n|\n' + '\n|\n'.join((str(c) for c in cells))
@@ -112,25 +131,126 @@ def indent_titles(filename, level):
                 line = prefix + line
             print(line, file=fod, end='')
 
-class TestCase(dict):
-    """A test case."""
-    def __init__(self, elem):
-        super().__init__()
-        self._uuid = uuid4()
-        self._name = elem.get('name')
-        self._suite = elem.get('classname')
-        self._timestamp = elem.get('timestamp')
-        time = elem.get('time')
-        self._duration = Decimal(time) if time is not None else time
-        (self._result, self._reason) = self._result_reason_from_elem(elem)
-        self._stdout = self._stdout_from_elem(elem)
-        # put each property pair into this test case as a dict
+# test case results, in order of their codes in TestCases
+RESULTS = (True, False, 'error', 'skipped')
+
+# namespace for test case uuids
+NAMESPACE = uuid5(NAMESPACE_URL, 'https://github.com/redhat-partner-solutions/')
+
+def _duration(value):
+    """Return (float, integral) for duration `value`, a number or a string.
+
+    `integral` is 1 if `value` is an integer, so that it is presented as such.
+    A duration of None is represented as NaN.
+    """
+    if value is None:
+        return (nan, 0)
+    if isinstance(value, str):
+        try:
+            return (float(int(value)), 1)
+        except ValueError:
+            return (float(value), 0)
+    return (float(value), int(isinstance(value, int)))
+
+class TestCases:
+    """Test cases stored in columns, for compact storage of many test cases.
+
+    `name` is combined with the name of each test case to derive its uuid.
+    Each column is a list or an array, with an item for each row: suite and
+    property names are interned, and properties are stored as a flat tuple of
+    names and values; reasons are shared between test cases;
+    durations, results (as indices in RESULTS) and numbers of attempts are
+    stored in arrays. Each row is presented by a TestCase.
+    """
+    def __init__(self, name=None):
+        self.name = name
+        self.names = []
+        self.suites = []
+        self.timestamps = []
+        self.durations = array('d')
+        self.integral = bytearray()
+        self.results = array('b')
+        self.reasons = []
+        self.attempts = array('I')
+        self.properties = []
+        self.outputs = []
+        self._shared = {}
+    def __len__(self):
+        return len(self.names)
+    def append(
+            self, name, suite, timestamp, duration, result, reason,
+            attempts=1, properties=(), output=None,
+        ): # pylint: disable=too-many-arguments
+        """Append a test case, returning its row.
+
+        `duration` is per _duration(); `properties` is a sequence of (name,
+        value) pairs; `output` is the test case output, as a string or as a
+        dict to be JSON-encoded on demand.
+        """
+        (duration, integral) = _duration(duration)
+        self.names.append(name)
+        self.suites.append(None if suite is None else intern(suite))
+        self.timestamps.append(timestamp)
+        self.durations.append(duration)
+        self.integral.append(integral)
+        self.results.append(RESULTS.index(result))
+        self.reasons.append(self._shared.setdefault(reason, reason))
+        self.attempts.append(attempts)
+        flat = []
+        for (key, val) in properties:
+            # share property values which are the same as the name
+            flat += (intern(key), name if val == name else val)
+        self.properties.append(tuple(flat))
+        self.outputs.append(output)
+        return len(self.names) - 1
+    def append_elem(self, elem):
+        """Append a test case from JUnit testcase `elem`, returning its row."""
+        timestamp = elem.get('timestamp')
+        duration = elem.get('time')
+        (result, reason) = self._result_reason_from_elem(elem)
+        child = elem.find('system-out')
+        stdout = child.text if child is not None else None
+        if not timestamp or duration is None:
+            try:
+                dct = json.loads(stdout)
+                if dct.get('timestamp'):
+                    (timestamp, duration) = (dct['timestamp'], dct['duration'])
+            except (TypeError, json.JSONDecodeError, AttributeError):
+                pass
         properties = elem.find('properties')
-        if properties is not None:
-            for child in properties.findall('property'):
-                self[child.get('name')] = child.get('value')
-        if not self._timestamp or self._duration is None:
-            self._use_timing_from_stdout()
+        return self.append(
+            elem.get('name'), elem.get('classname'), timestamp, duration,
+            result, reason,
+            1 + sum(1 for child in elem if child.tag in RERUNS),
+            () if properties is None else (
+                (child.get('name'), child.get('value'))
+                for child in properties.findall('property')
+            ),
+            stdout,
+        )
+    def append_result(self, suite, case, exclude=('id',)):
+        """Append test `case` in `suite`, returning its row.
+
+        Arguments are per TestCase.from_result().
+        """
+        result = case['result']
+        return self.append(
+            case['id'], suite,
+            case.get('timestamp') or None, case.get('duration'),
+            result, None if result is True else first_line(case['reason']),
+            len(case.get('attempts', ())) or 1,
+            (('test_id', case['id']),),
+            {k: v for (k, v) in case.items() if k not in exclude},
+        )
+    def fields(self, idx):
+        """Return a tuple of the arguments to append() for row `idx`."""
+        return (
+            self.names[idx], self.suites[idx], self.timestamps[idx],
+            self.duration(idx), RESULTS[self.results[idx]],
+            self.reasons[idx], self.attempts[idx],
+            tuple(zip(self.properties[idx][0::2], self.properties[idx][1::2])),
+            self.outputs[idx],
+        )
     @staticmethod
     def _result_reason_from_elem(elem):
         """Return test case (result, reason) from `elem`."""
@@ -140,46 +260,92 @@ class TestCase(dict):
         child = elem.find('error')
         if child is not None:
             return ('error', child.get('message'))
+        child = elem.find('skipped')
+        if child is not None:
+            return ('skipped', child.get('message'))
         return (True, None)
-    @staticmethod
-    def _stdout_from_elem(elem):
-        """Return test case output from `elem`."""
-        child = elem.find('system-out')
-        return child.text if child is not None else None
-    def _use_timing_from_stdout(self):
-        """Set timestamp and duration from JSON object in stdout."""
-        try:
-            dct = json.loads(self.stdout)
-            timestamp = dct.get('timestamp')
-        except (TypeError, json.JSONDecodeError, AttributeError):
-            return
-        if timestamp:
-            self._timestamp = timestamp
-            self._duration = dct['duration']
+    def duration(self, idx):
+        """Return the duration of row `idx`, or None."""
+        value = self.durations[idx]
+        if isnan(value):
+            return None
+        return int(value) if self.integral[idx] else value
+
+class TestCase(Mapping):
+    """A test case, from JUnit testcase `elem`: a view of a row in TestCases.
+
+    The test case maps each of its property names to value. If `elem` is None,
+    then the test case has no name, result or output: use from_result() to
+    create a test case from a result dict.
+    """
+    __slots__ = ('_cases', '_row')
+    def __init__(self, elem=None):
+        self._cases = TestCases()
+        if elem is None:
+            self._row = self._cases.append(None, None, None, None, True, None)
+        else:
+            self._row = self._cases.append_elem(elem)
+            self._cases.name = self.suite
+    @classmethod
+    def view(cls, cases, idx):
+        """Return a new instance presenting row `idx` in TestCases `cases`."""
+        obj = cls.__new__(cls)
+        obj._cases = cases
+        obj._row = idx
+        return obj
+    @classmethod
+    def from_result(cls, suite, case, exclude=('id',)):
+        """Return a new instance for test `case` in `suite`.
+
+        `suite` is the string name of the test suite; `case` is a result dict,
+        as output by testdrive.run; `exclude` is a sequence of keys to omit
+        from the output of the test case. The new instance is the same as if
+        created from the JUnit testcase for `case`, per testdrive.junit.create,
+        without encoding or parsing XML or JSON.
+        """
+        cases = TestCases(suite)
+        return cls.view(cases, cases.append_result(suite, case, exclude))
+    def fields(self):
+        """Return a tuple of the arguments to TestCases.append() for this."""
+        return self._cases.fields(self._row)
+    def __getitem__(self, key):
+        properties = self._cases.properties[self._row]
+        for idx in range(0, len(properties), 2):
+            if properties[idx] == key:
+                return properties[idx + 1]
+        raise KeyError(key)
+    def __iter__(self):
+        return iter(self._cases.properties[self._row][0::2])
+    def __len__(self):
+        return len(self._cases.properties[self._row]) // 2
     @property
     def uuid(self):
-        """A uuid for this test case."""
-        return self._uuid
+        """A uuid for this test case, derived from its name and test suite."""
+        return uuid5(NAMESPACE, f'{self._cases.name}\n{self.name}')
     @property
     def name(self):
         """The name of this test case."""
-        return self._name
+        return self._cases.names[self._row]
     @property
     def suite(self):
         """The test suite name of this test case."""
-        return self._suite
+        return self._cases.suites[self._row]
     @property
     def timestamp(self):
         """The timestamp of this test case."""
-        return self._timestamp
+        return self._cases.timestamps[self._row]
     @property
     def duration(self):
         """The duration of this test case."""
-        return self._duration
+        return self._cases.duration(self._row)
     @property
     def result(self):
         """The result of this test case."""
-        return self._result
+        return RESULTS[self._cases.results[self._row]]
+    @property
+    def attempts(self):
+        """The number of attempts to run this test case."""
+        return self._cases.attempts[self._row]
     @property
     def a_result(self):
         """The result of this test case as asciidoc."""
@@ -187,15 +353,27 @@ class TestCase(dict):
             return a_test_success('success')
         if self.result is False:
             return a_test_failure('failure')
+        if self.result == 'skipped':
+            return a_test_skipped('skipped')
         return a_test_error(self.result)
     @property
     def reason(self):
         """The reason of this test case."""
-        return self._reason
+        return self._cases.reasons[self._row]
     @property
     def stdout(self):
         """The output of this test case."""
-        return self._stdout
+        output = self._cases.outputs[self._row]
+        if isinstance(output, dict):
+            return json.dumps(output, sort_keys=True, indent=4)
+        return output
+    @property
+    def detail(self):
+        """The TestDetail for this test case, or None."""
+        output = self._cases.outputs[self._row]
+        if isinstance(output, dict):
+            return TestDetail.from_dict(output)
+        return TestDetail.from_output(output)
     @property
     def anchor_result(self):
         """Return an anchor for this test case result."""
@@ -221,11 +399,15 @@ class TestDetail:
     def to_asciidoc(self, objdir):
         """Generate asciidoc for this test detail.
 
-        Any image files will be copied to a unique filename in `objdir`/images.
+        Any image files will be linked or copied to `objdir`/pdf-assets/images,
+        named per testdrive.artifacts.blob_name(): an image is stored there only
+        once, however many test cases reference the same content.
         """
         for (title, path) in self._images:
-            filename = f'{uuid4()}{os.path.splitext(path)[1]}'
-            copyfile(path, os.path.join(objdir, 'pdf-assets/images', filename))
+            filename = blob_name(path)
+            target = os.path.join(objdir, 'pdf-assets/images', filename)
+            if not os.path.exists(target):
+                link(path, target)
             yield ''
             yield f'.{title or os.path.basename(path)}'
             yield f'image::{filename}[]'
@@ -258,12 +440,23 @@ class TestDetail:
         Return None if `output` is not a JSON-encoded object or does not contain
         test detail (as understood by this class).
         """
-        required = {'result', 'reason'}
         try:
             obj = json.loads(output)
+        except (TypeError, json.JSONDecodeError):
+            return None
+        return cls.from_dict(obj)
+    @classmethod
+    def from_dict(cls, obj):
+        """Return an instance of `cls` if `obj` is a dict of test detail.
+
+        Return None if `obj` is not a dict or does not contain test detail (as
+        understood by this class).
+        """
+        required = {'result', 'reason'}
+        try:
             if frozenset(obj.keys()).intersection(required) != required:
                 return None
-        except (TypeError, json.JSONDecodeError, AttributeError):
+        except AttributeError:
             return None
         images = []
         for item in obj.get('plot', ()):
@@ -292,30 +485,86 @@ class TestDetail:
                 tables.insert(0, ('analysis', analysis))
         return cls(images, tables)
 
-class TestSuite(OrderedDict):
-    """A test suite with sequence order of test cases preserved."""
-    def __init__(self, elem):
-        super().__init__()
-        self._name = elem.get('name')
+class TestSuite(Mapping):
+    """A test suite with sequence order of test cases preserved.
+
+    The test suite is from JUnit testsuite `elem`. If `elem` is None, then the
+    test suite is empty: use from_results() to create a test suite from result
+    dicts. The test suite maps each test case name to a TestCase, a view of a
+    row in its TestCases.
+    """
+    def __init__(self, elem=None):
+        self._name = None
+        self._metadata = None
+        self._cases = TestCases()
+        self._rows = {}
+        if elem is not None:
+            self._name = self._cases.name = elem.get('name')
+            self._metadata = self._metadata_from_elem(elem)
+            for child in elem.findall('testcase'):
+                self._add_row(self._cases.append_elem(child))
+    @classmethod
+    def from_results(cls, name, cases, hostname=None, exclude=('id',)):
+        """Return a new instance for test `cases` in suite `name`.
+
+        `cases` is an iterable of result dicts, as output by testdrive.run;
+        `hostname` is the name of the host which ran the tests; `exclude` is as
+        per TestCase.from_result(). The new instance is the same as if created
+        from the JUnit testsuite for `cases`, per testdrive.junit.create.
+        """
+        obj = cls()
+        obj._name = obj._cases.name = name
+        summary = Summary()
+        for case in cases:
+            summary.add(case)
+            obj._add_row(obj._cases.append_result(name, case, exclude))
+        dct = summary.value()
+        duration = dct['duration']
+        obj._metadata = {
+            'tests': dct['total'],
+            'errors': dct['error'],
+            'failures': dct['failure'],
+            'success': dct['success'],
+            'skipped': dct['skipped'],
+            'hostname': hostname,
+            'timestamp': dct['timestamp'],
+            'duration': None if duration is None else Decimal(str(duration)),
+        }
+        return obj
+    def __getitem__(self, name):
+        return TestCase.view(self._cases, self._rows[name])
+    def __iter__(self):
+        return iter(self._rows)
+    def __len__(self):
+        return len(self._rows)
+    def _add_row(self, idx):
+        """Add the test case at row `idx` of this test suite's TestCases."""
+        name = self._cases.names[idx]
+        if name in self._rows:
+            raise KeyError(f'duplicate test case "{name}"')
+        self._rows[name] = idx
+    def add(self, case):
+        """Add test `case` to this test suite."""
+        if case.name in self._rows:
+            raise KeyError(f'duplicate test case "{case.name}"')
+        self._add_row(self._cases.append(*case.fields()))
+    def set_metadata(self, elem):
+        """Set test suite metadata from testsuite `elem`."""
         self._metadata = self._metadata_from_elem(elem)
-        for child in elem.findall('testcase'):
-            case = TestCase(child)
-            if case.name in self:
-                raise KeyError(f'duplicate test case "{case.name}"')
-            self[case.name] = case
     @staticmethod
     def _metadata_from_elem(elem):
         """Return a dict of test suite metadata from `elem`."""
         tests = int(elem.get('tests'))
         errors = int(elem.get('errors'))
         failures = int(elem.get('failures'))
+        skipped = int(elem.get('skipped', 0))
         time = elem.get('time')
         return {
             'tests': tests,
             'errors': errors,
             'failures': failures,
-            'success': tests - (errors + failures),
-            'skipped': int(elem.get('skipped')),
+            'success': tests - (errors + failures + skipped),
+            'skipped': skipped,
             'hostname': elem.get('hostname'),
             'timestamp': elem.get('timestamp'),
             'duration': Decimal(time) if time is not None else time,
@@ -337,6 +586,8 @@ class TestSuite(OrderedDict):
         yield row('*test error*', self._metadata['errors'])
         yield row('*test failure*', self._metadata['failures'])
         yield row('*test success*', self._metadata['success'])
+        if self._metadata['skipped']:
+            yield row('*test skipped*', self._metadata['skipped'])
         yield ''
         yield '|==='
         yield ''
@@ -348,56 +599,75 @@ class TestSuite(OrderedDict):
     def results(self, objdir, config, level):
         """Generate asciidoc results for this test suite."""
         for case in self.values():
-            test_id = case.get('test_id')
-            yield ''
-            yield case.anchor_result
-            yield f'{level} {config.case_title(case)}'
-            yield ''
-            yield '[cols="1,4"]'
-            yield '|==='
-            yield ''
-            yield row('*test specification*', case.xref_spec)
-            yield row('*test identifier*', test_id or NOT_RECORDED)
-            yield row('*timestamp*', case.timestamp or NOT_RECORDED)
-            duration = NOT_RECORDED if case.duration is None else case.duration
-            yield row('*duration (s)*', duration)
-            yield row('*result*', case.a_result)
-            yield row('*reason*', case.reason or EMPTY)
-            yield '|==='
-            detail = TestDetail.from_output(case.stdout)
-            if detail:
-                yield from detail.to_asciidoc(objdir)
-            elif case.stdout:
-                yield literal_block(case.stdout)
-            yield ''
-            yield '<<<'
+            yield from self.case_results(case, objdir, config, level)
+    def case_results(self, case, objdir, config, level):
+        """Generate asciidoc results for test `case` in this test suite."""
+        test_id = case.get('test_id')
+        yield ''
+        yield case.anchor_result
+        yield f'{level} {config.case_title(case)}'
+        yield ''
+        yield '[cols="1,4"]'
+        yield '|==='
+        yield ''
+        yield row('*test specification*', case.xref_spec)
+        yield row('*test identifier*', test_id or NOT_RECORDED)
+        yield row('*timestamp*', case.timestamp or NOT_RECORDED)
+        duration = NOT_RECORDED if case.duration is None else case.duration
+        yield row('*duration (s)*', duration)
+        yield row('*result*', case.a_result)
+        yield row('*reason*', case.reason or EMPTY)
+        if case.attempts > 1:
+            yield row('*attempts*', case.attempts)
+        yield '|==='
+        detail = case.detail
+        if detail:
+            yield from detail.to_asciidoc(objdir)
+        elif case.stdout:
+            yield literal_block(case.stdout)
+        yield ''
+        yield '<<<'
     def specs(self, objdir, config, level):
         """Generate asciidoc test specs for this test suite."""
         for case in self.values():
-            path = config.case_path_testspec(case)
-            yield ''
-            yield case.anchor_spec
-            if path:
-                filename = f'{case.uuid}.adoc'
-                target = os.path.join(objdir, filename)
-                copyfile(path, target)
-                indent_titles(target, level)
-                yield f'include::{filename}[]'
-            else:
-                yield f'_(No test specification for {config.case_title(case)})_'
-            yield ''
-            yield '<<<'
+            yield from self.case_spec(case, objdir, config, level)
+    def case_spec(self, case, objdir, config, level):
+        """Generate asciidoc test spec for test `case` in this test suite."""
+        path = config.case_path_testspec(case)
+        yield ''
+        yield case.anchor_spec
+        if path:
+            filename = f'{case.uuid}.adoc'
+            target = os.path.join(objdir, filename)
+            copyfile(path, target)
+            indent_titles(target, level)
+            yield f'include::{filename}[]'
+        else:
+            yield f'_(No test specification for {config.case_title(case)})_'
+        yield ''
+        yield '<<<'
 
 class TestSuites(OrderedDict):
     """Test suites with sequence order of inclusion preserved."""
     def include(self, filename):
         """Include test suites from JUnit XML in `filename`."""
-        root = ET.parse(filename).getroot()
+        with open_input(filename, encoding=None) as fid:
+            root = ET.parse(fid).getroot()
         for elem in root.findall('testsuite'):
-            suite = TestSuite(elem)
-            if suite.name in self:
-                raise KeyError(f'duplicate test suite "{suite.name}"')
-            self[suite.name] = suite
+            self.add(TestSuite(elem))
+    def include_results(self, name, filename, hostname=None):
+        """Include test suite `name` from JSON-lines test results in `filename`.
+
+        `hostname` is the name of the host which ran the tests.
+        """
+        with open_input(filename) as fid:
+            cases = (json.loads(line) for line in fid if line.strip())
+            self.add(TestSuite.from_results(name, cases, hostname))
+    def add(self, suite):
+        """Add test `suite`."""
+        if suite.name in self:
+            raise KeyError(f'duplicate test suite "{suite.name}"')
+        self[suite.name] = suite
     def summary(self, level):
         """Generate asciidoc summary in test suite order."""
         for suite in self.values():
@@ -423,8 +693,26 @@ class TestSuites(OrderedDict):
             yield ''
             yield '<<<'
 
+def document(suites, objdir, config):
+    """Generate asciidoc lines for a document presenting test `suites`.
+
+    `objdir` is the target directory to copy included asciidoc and image files
+    to; `config` is the configuration of asciidoc generation.
+    """
+    level_suite = '==='
+    yield ''
+    yield '== Summary'
+    yield from suites.summary(level_suite)
+    yield ''
+    yield '== Test Results'
+    yield from suites.results(objdir, config, level_suite)
+    yield ''
+    yield '[appendix]'
+    yield '== Test Specifications'
+    yield from suites.specs(objdir, config, level_suite)
+
 def main():
-    """Generate asciidoc from JUnit XML files.
+    """Generate asciidoc from JUnit XML files and JSON-lines test results.
 
     Each input file must conform to XML Schema `junit/schema/testdrive.xsd`.
     """
@@ -450,9 +738,30 @@ def main():
             "gives the relative path into the repository for testspec.adoc)",
         )),
     )
+    aparser.add_argument(
+        '--output', default='-',
+        help=' '.join((
+            "write asciidoc to this file instead of stdout, compressed if the",
+            "filename ends '.gz', '.xz', '.bz2' or '.zst'",
+        )),
+    )
+    aparser.add_argument(
+        '--results', nargs=2, action='append', default=[],
+        metavar=('SUITE', 'FILE'),
+        help=' '.join((
+            "include test suite SUITE from FILE of JSON-lines test results,",
+            "as output by testdrive.run, which may be compressed, or '-' to",
+            "read from stdin; test suites from `--results` follow test suites",
+            "from `input` files",
+        )),
+    )
+    aparser.add_argument(
+        '--hostname',
+        help="the name of the host which ran the tests in `--results` files",
+    )
     aparser.add_argument(
         'input', nargs='*',
-        help="input files, or '-' to read from stdin",
+        help="input files, which may be compressed, or '-' to read from stdin",
     )
     args = aparser.parse_args()
     objdir = args.objdir
@@ -460,17 +769,10 @@ def main():
     suites = TestSuites()
     for input_ in args.input:
         suites.include(input_)
-    level_suite = '==='
-    print('')
-    print('== Summary')
-    print(*suites.summary(level_suite), sep='\n')
-    print('')
-    print('== Test Results')
-    print(*suites.results(objdir, config, level_suite), sep='\n')
-    print('')
-    print('[appendix]')
-    print('== Test Specifications')
-    print(*suites.specs(objdir, config, level_suite), sep='\n')
+    for (name, filename) in args.results:
+        suites.include_results(name, filename, args.hostname)
+    with open_output(args.output) as fout:
+        print(*document(suites, objdir, config), sep='\n', file=fout)
 
 if __name__ == '__main__':
     main()
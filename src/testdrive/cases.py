@@ -2,7 +2,68 @@
 
 """Test case analysis"""
 
-from .run import timevalue
+from .common import timevalue
+
+def category(result):
+    """Return the summary statistics category for test case `result`.
+
+    Return 'success' for a True result; 'failure' for a False result; 'error'
+    for an 'error' result; 'skipped' for a 'skipped' result (a test which was
+    not run). Raise ValueError for any other result.
+    """
+    if result is True:
+        return 'success'
+    if result is False:
+        return 'failure'
+    if result == 'error':
+        return 'error'
+    if result == 'skipped':
+        return 'skipped'
+    raise ValueError(f'bad result "{result}"')
+
+def percentile(values, pct):
+    """Return the `pct` percentile of sorted sequence `values`.
+
+    Use the nearest-rank method. Return None if `values` is empty.
+    """
+    if not values:
+        return None
+    rank = max(1, -(-len(values) * pct // 100))
+    return values[min(int(rank), len(values)) - 1]
+
+class Timing:
+    """Timing information for test cases, updated incrementally."""
+    def __init__(self):
+        # result variables
+        self._timestamp = None
+        # working variables
+        self._tv_start = self._tv_end = self._duration_last = None
+    def add(self, case):
+        """Update timing information with test `case`."""
+        if 'timestamp' in case:
+            try:
+                tv_case = timevalue(case['timestamp'])
+            except TypeError:
+                # timestamp is not an ISO format string
+                # skip decimal relative timestamps
+                return
+            if self._tv_start is None:
+                self._timestamp = case['timestamp']
+                self._tv_start = self._tv_end = tv_case
+                self._duration_last = case['duration']
+            elif tv_case < self._tv_start:
+                self._timestamp = case['timestamp']
+                self._tv_start = tv_case
+            elif self._tv_end < tv_case:
+                self._tv_end = tv_case
+                self._duration_last = case['duration']
+    def value(self):
+        """Return (timestamp, duration) for test cases, per timing()."""
+        duration = None
+        if self._tv_start is not None:
+            duration = (self._tv_end - self._tv_start).total_seconds()
+            duration = round(duration + self._duration_last, 6)
+        return (self._timestamp, duration)
 
 def timing(cases):
     """Return (timestamp, duration) for test `cases`.
@@ -12,44 +73,43 @@ def timing(cases):
     `timestamp`; the total number of seconds from this timestamp to the end of
     test execution for `duration`.
     """
-    # result variables
-    timestamp = duration = None
-    # working variables
-    tv_start = tv_end = duration_last = None
+    timing_ = Timing()
     for case in cases:
-        if 'timestamp' in case:
-            try:
-                tv_case = timevalue(case['timestamp'])
-            except TypeError:
-                # timestamp is not an ISO format string
-                # skip decimal relative timestamps
-                continue
-            if tv_start is None:
-                timestamp = case['timestamp']
-                tv_start = tv_end = tv_case
-                duration_last = case['duration']
-            elif tv_case < tv_start:
-                timestamp = case['timestamp']
-                tv_start = tv_case
-            elif tv_end < tv_case:
-                tv_end = tv_case
-                duration_last = case['duration']
-    if tv_start is not None:
-        duration = (tv_end - tv_start).total_seconds() + duration_last
-        duration = round(duration, 6)
-    return (timestamp, duration)
+        timing_.add(case)
+    return timing_.value()
+
+class Summary:
+    """Summary statistics counters for test `cases`, updated incrementally."""
+    def __init__(self, cases=()):
+        self._total = self._errors = self._failures = self._skipped = 0
+        self._timing = Timing()
+        for case in cases:
+            self.add(case)
+    def add(self, case):
+        """Update summary statistics counters with test `case`."""
+        self._total += 1
+        if case['result'] == 'error':
+            self._errors += 1
+        elif case['result'] is False:
+            self._failures += 1
+        elif case['result'] == 'skipped':
+            self._skipped += 1
+        self._timing.add(case)
+    def value(self):
+        """Return a dict of summary statistics counters, per summarize()."""
+        (timestamp, duration) = self._timing.value()
+        return {
+            'total': self._total,
+            'success': self._total - (
+                self._errors + self._failures + self._skipped
+            ),
+            'failure': self._failures,
+            'error': self._errors,
+            'skipped': self._skipped,
+            'timestamp': timestamp,
+            'duration': duration,
+        }
 
 def summarize(cases):
     """Return a dict of summary statistics counters for test `cases`."""
-    total = len(cases)
-    errors = sum(1 for case in cases if case['result'] == 'error')
-    failures = sum(1 for case in cases if case['result'] is False)
-    (timestamp, duration) = timing(cases)
-    return {
-        'total': total,
-        'success': total - (errors + failures),
-        'failure': failures,
-        'error': errors,
-        'timestamp': timestamp,
-        'duration': duration,
-    }
+    return Summary(cases).value()
@@ -2,17 +2,92 @@
 
 """Common code for command line tools"""
 
+import bz2
+import gzip
+from io import TextIOWrapper
+import lzma
+import os
 import sys
-from contextlib import nullcontext
+from contextlib import (contextmanager, nullcontext)
+from datetime import (datetime, timezone)
+import threading
+from time import monotonic
+
+try:
+    import zstandard
+except ImportError:
+    zstandard = None
+
+def _zstd_open(filename, mode, **kwargs):
+    """Return zstandard.open(`filename`, `mode`, **`kwargs`)."""
+    if zstandard is None:
+        raise ValueError(f'{filename}: zstandard is not installed')
+    return zstandard.open(filename, mode, **kwargs)
+
+# open functions for compressed files, by filename extension
+CODECS = {
+    '.gz': gzip.open,
+    '.xz': lzma.open,
+    '.bz2': bz2.open,
+    '.zst': _zstd_open,
+}
+
+# magic bytes at the start of compressed files, with filename extension
+MAGIC = (
+    (b'\x1f\x8b', '.gz'),
+    (b'\xfd7zXZ\x00', '.xz'),
+    (b'BZh', '.bz2'),
+    (b'\x28\xb5\x2f\xfd', '.zst'),
+)
+
+def compression(filename, magic=b''):
+    """Return the extension for compression of `filename`, or None.
+
+    Compression is detected from the extension of `filename`, if in CODECS,
+    else from `magic`, the bytes at the start of the file.
+    """
+    ext = os.path.splitext(filename)[1]
+    if ext in CODECS:
+        return ext
+    for (prefix, ext) in MAGIC:
+        if magic.startswith(prefix):
+            return ext
+    return None
+
+@contextmanager
+def _decompress(fid, ext, mode, encoding, **kwargs):
+    """Yield a file object decompressing `fid` per `ext`, then close `fid`."""
+    with fid, CODECS[ext](fid, mode, encoding=encoding, **kwargs) as stream:
+        yield stream
 
 def open_input(filename, encoding='utf-8', **kwargs):
     """Return a context manager for reading from `filename`.
 
-    If `filename` is '-' then read from stdin instead of `filename`.
+    If `filename` is '-' then read from stdin instead of `filename`. If
+    `encoding` is None then read bytes instead of text. Compressed input, per
+    compression(), is decompressed as it is read.
+
+    `filename` is opened only once, and its magic bytes are peeked rather than
+    read, so that it may be a pipe.
     """
+    mode = 'rb' if encoding is None else 'rt'
     if filename == '-':
-        return nullcontext(sys.stdin)
-    return open(filename, encoding=encoding, **kwargs)
+        fid = sys.stdin.buffer
+        magic = fid.peek(8)[:8] if hasattr(fid, 'peek') else b''
+        ext = compression('', magic)
+        if ext is None:
+            return nullcontext(fid if encoding is None else sys.stdin)
+        return CODECS[ext](fid, mode, encoding=encoding, **kwargs)
+    ext = compression(filename)
+    if ext is not None:
+        return CODECS[ext](filename, mode, encoding=encoding, **kwargs)
+    fid = open(filename, 'rb') # pylint: disable=consider-using-with
+    ext = compression('', fid.peek(8)[:8])
+    if ext is not None:
+        return _decompress(fid, ext, mode, encoding, **kwargs)
+    if encoding is None:
+        return fid
+    return TextIOWrapper(fid, encoding=encoding, **kwargs)
 
 def print_line(line, flush=True):
     """Print `line` and, optionally, `flush` stdout.
@@ -33,3 +108,110 @@ def print_line(line, flush=True):
     except BrokenPipeError:
         sys.stdout = None
         return False
+
+def open_output(filename, encoding='utf-8'):
+    """Return a context manager for writing to `filename`.
+
+    If `filename` is '-' then write to stdout instead of `filename`. If
+    `encoding` is None then write bytes instead of text. If the extension of
+    `filename` is in CODECS then output is compressed as it is written.
+    """
+    if filename == '-':
+        return nullcontext(sys.stdout if encoding else sys.stdout.buffer)
+    mode = 'wb' if encoding is None else 'wt'
+    ext = os.path.splitext(filename)[1]
+    if ext in CODECS:
+        return CODECS[ext](filename, mode, encoding=encoding)
+    return open(filename, mode, encoding=encoding)
+
+class OutputSink:
+    """A sink for lines of output to `fid`, which defaults to stdout.
+
+    Lines are buffered and written to `fid` in batches: a batch is written and
+    `fid` flushed when `lines` lines are buffered, or `interval` seconds after
+    the first line was buffered, whichever is sooner. By default each line is
+    written and flushed immediately. If `interval` is supplied, then a
+    background thread writes a batch which is due when no more lines arrive.
+
+    If SIGPIPE is received when writing to stdout then set `sys.stdout` to None,
+    as per print_line(). Once writing fails, all subsequent writes fail.
+    """
+    def __init__(self, fid=None, lines=1, interval=None):
+        self._fid = sys.stdout if fid is None else fid
+        self._lines = max(lines, 1)
+        self._interval = interval
+        self._lock = threading.Lock()
+        self._batch = []
+        self._due = None
+        self._ok = True
+        self._stop = threading.Event()
+        if interval:
+            threading.Thread(target=self._timer, daemon=True).start()
+    def write_line(self, line):
+        """Write `line` to this sink, per the flush policy.
+
+        Return False if writing failed: otherwise return True.
+        """
+        with self._lock:
+            if not self._ok:
+                return False
+            self._batch.append(line + '\n')
+            if len(self._batch) == 1 and self._interval:
+                self._due = monotonic() + self._interval
+            if len(self._batch) >= self._lines or (
+                    self._due is not None and monotonic() >= self._due
+                ):
+                return self._write()
+            return True
+    def flush(self):
+        """Write all buffered lines and flush.
+
+        Return False if writing failed: otherwise return True.
+        """
+        with self._lock:
+            return self._write()
+    def close(self):
+        """Write all buffered lines and stop writing batches when due.
+
+        Return False if writing failed: otherwise return True.
+        """
+        self._stop.set()
+        return self.flush()
+    def __enter__(self):
+        return self
+    def __exit__(self, *exc_info):
+        self.close()
+    def _write(self):
+        """Write the current batch and flush `fid`, with the lock held."""
+        if not self._ok:
+            return False
+        self._due = None
+        if self._batch:
+            data = ''.join(self._batch)
+            self._batch.clear()
+            try:
+                self._fid.write(data)
+                self._fid.flush()
+            except BrokenPipeError:
+                self._ok = False
+                if self._fid is sys.stdout:
+                    sys.stdout = None
+        return self._ok
+    def _timer(self):
+        """Write batches when due until stopped."""
+        while not self._stop.wait(self._interval / 4):
+            with self._lock:
+                if self._due is not None and monotonic() >= self._due:
+                    self._write()
+
+def timenow():
+    """Return a datetime value for UTC time now."""
+    return datetime.now(timezone.utc)
+
+def timestamp(dtv):
+    """Return an ISO 8601 string for datetime value `dtv`."""
+    return datetime.isoformat(dtv)
+
+def timevalue(string):
+    """Return a datetime value for ISO 8601 `string`."""
+    return datetime.fromisoformat(string)
@@ -0,0 +1,275 @@
+### SPDX-License-Identifier: GPL-2.0-or-later
+
+"""Compare test results between runs"""
+
+from argparse import ArgumentParser
+import json
+from math import sqrt
+import os
+
+from .asciidoc import (EMPTY, TestSuites, a_test_failure, a_test_success, row)
+from .cases import category
+from .common import (compression, open_input, open_output)
+
+# test case categories in order of increasing severity
+SEVERITY = ('success', 'skipped', 'failure', 'error')
+
+# test case categories which are failing
+FAILING = ('failure', 'error')
+
+class Run:
+    """Test results for a run, keyed by test id.
+
+    For each test id, `results` maps to the most severe category of its test
+    cases, per SEVERITY, and `durations` maps to a list of the durations of its
+    test cases (a test id can have many test cases, with different args) which
+    were not skipped.
+    """
+    def __init__(self, name):
+        self.name = name
+        self.results = {}
+        self.durations = {}
+    def add(self, test_id, result, duration):
+        """Add a test case with `test_id`, `result` and `duration`."""
+        cat = category(result)
+        prev = self.results.get(test_id)
+        if prev is None or SEVERITY.index(cat) > SEVERITY.index(prev):
+            self.results[test_id] = cat
+        if duration is not None and cat != 'skipped':
+            self.durations.setdefault(test_id, []).append(float(duration))
+    @classmethod
+    def from_results(cls, filename):
+        """Return a new instance from JSON-lines test results in `filename`."""
+        run = cls(filename)
+        with open_input(filename) as fid:
+            for line in fid:
+                if line.strip():
+                    dct = json.loads(line)
+                    run.add(dct['id'], dct['result'], dct.get('duration'))
+        return run
+    @classmethod
+    def from_junit(cls, filename):
+        """Return a new instance from JUnit XML test results in `filename`."""
+        run = cls(filename)
+        suites = TestSuites()
+        suites.include(filename)
+        for suite in suites.values():
+            for case in suite.values():
+                test_id = case.get('test_id', case.name)
+                run.add(test_id, case.result, case.duration)
+        return run
+    @classmethod
+    def load(cls, filename):
+        """Return a new instance from test results in `filename`.
+
+        Files ending '.xml', before any compression extension, are read as JUnit
+        XML: other files are read as JSON-lines.
+        """
+        name = filename
+        if compression(name):
+            name = os.path.splitext(name)[0]
+        if os.path.splitext(name)[1] == '.xml':
+            return cls.from_junit(filename)
+        return cls.from_results(filename)
+
+def _mean_stdev(values):
+    """Return (mean, sample standard deviation) of `values`.
+
+    The standard deviation is None if there are fewer than two values.
+    """
+    mean = sum(values) / len(values)
+    if len(values) < 2:
+        return (mean, None)
+    var = sum((val - mean) ** 2 for val in values) / (len(values) - 1)
+    return (mean, sqrt(var))
+
+def compare(
+        baselines, current,
+        ratio=1.2, min_delta=0.1, sigma=3.0, min_samples=3,
+    ): # pylint: disable=too-many-arguments,too-many-locals
+    """Return a dict comparing Run `current` with Runs `baselines`.
+
+    Result changes are relative to the latest baseline, the last in
+    `baselines`. Durations are compared with all durations in `baselines`: a
+    test is slower if there are at least `min_samples` baseline durations, its
+    mean duration in `current` is at least `ratio` times and at least
+    `min_delta` seconds more than its mean baseline duration and, if there are
+    at least two baseline durations, more than `sigma` standard deviations
+    above the mean baseline duration.
+
+    The dict has lists of dicts at keys 'new_failures' (tests which did not fail
+    and now do), 'fixed' (tests which failed and now do not, or were skipped
+    and now succeed), 'added' and 'removed' (tests only in `current` or only in
+    the latest baseline) and 'slower'; and a dict of counts at key 'summary'.
+    """
+    latest = baselines[-1].results
+    (new_failures, fixed, added, removed, slower) = ([], [], [], [], [])
+    for (test_id, after) in current.results.items():
+        before = latest.get(test_id)
+        if before is None:
+            added.append({'test_id': test_id, 'result': after})
+        elif before not in FAILING and after in FAILING:
+            new_failures.append(
+                {'test_id': test_id, 'before': before, 'after': after},
+            )
+        elif (before in FAILING and after not in FAILING) or (
+                before == 'skipped' and after == 'success'
+            ):
+            fixed.append({'test_id': test_id, 'before': before, 'after': after})
+    for (test_id, before) in latest.items():
+        if test_id not in current.results:
+            removed.append({'test_id': test_id, 'result': before})
+    for (test_id, durations) in current.durations.items():
+        samples = [
+            val for run in baselines for val in run.durations.get(test_id, ())
+        ]
+        if not samples or len(samples) < min_samples:
+            continue
+        (mean, stdev) = _mean_stdev(samples)
+        (now, _) = _mean_stdev(durations)
+        if now < mean * ratio or now - mean < min_delta:
+            continue
+        score = None
+        if stdev is not None:
+            score = (now - mean) / stdev if stdev else float('inf')
+            if score <= sigma:
+                continue
+        slower.append({
+            'test_id': test_id,
+            'baseline': round(mean, 6),
+            'duration': round(now, 6),
+            'ratio': round(now / mean, 3) if mean else None,
+            'sigma': None if score is None else round(score, 3),
+            'samples': len(samples),
+        })
+    slower.sort(key=lambda dct: dct['duration'] - dct['baseline'], reverse=True)
+    return {
+        'baselines': [run.name for run in baselines],
+        'current': current.name,
+        'summary': {
+            'tests': len(current.results),
+            'new_failures': len(new_failures),
+            'fixed': len(fixed),
+            'added': len(added),
+            'removed': len(removed),
+            'slower': len(slower),
+        },
+        'new_failures': new_failures,
+        'fixed': fixed,
+        'added': added,
+        'removed': removed,
+        'slower': slower,
+    }
+
+def to_asciidoc(comparison, level='=='):
+    """Generate asciidoc lines for a section presenting `comparison`.
+
+    `comparison` is as returned by compare(); `level` is the section level.
+    """
+    summary = comparison['summary']
+    yield ''
+    yield f'{level} Comparison with Previous Results'
+    yield ''
+    yield '[cols="1,3"]'
+    yield '|==='
+    yield ''
+    yield row('*baseline*', ' +\n'.join(comparison['baselines']))
+    yield row('*current*', comparison['current'])
+    yield row('*test cases*', summary['tests'])
+    yield row('*new failures*', a_test_failure(summary['new_failures']))
+    yield row('*fixed*', a_test_success(summary['fixed']))
+    yield row('*added*', summary['added'])
+    yield row('*removed*', summary['removed'])
+    yield row('*slower*', summary['slower'])
+    yield ''
+    yield '|==='
+    tables = (
+        ('New Failures', 'new_failures', ('test_id', 'before', 'after')),
+        ('Fixed', 'fixed', ('test_id', 'before', 'after')),
+        ('Added', 'added', ('test_id', 'result')),
+        ('Removed', 'removed', ('test_id', 'result')),
+        ('Slower', 'slower', ('test_id', 'baseline', 'duration', 'ratio')),
+    )
+    for (title, key, columns) in tables:
+        if not comparison[key]:
+            continue
+        yield ''
+        yield f'.{title}'
+        cols = ','.join(('4',) + ('1',) * (len(columns) - 1))
+        yield f'[%header,cols="{cols}"]'
+        yield '|==='
+        yield '|' + '|'.join(col.replace('_', ' ') for col in columns)
+        for dct in comparison[key]:
+            yield row(*(
+                EMPTY if dct[col] is None else dct[col] for col in columns
+            ))
+        yield '|==='
+
+def main():
+    """Compare test results between runs.
+
+    Compare the last input with the previous inputs, joined on test id: report
+    new failures, fixes, added and removed tests (relative to the previous
+    input) and significant duration regressions (relative to all previous
+    inputs).
+    """
+    aparser = ArgumentParser(description=main.__doc__)
+    aparser.add_argument(
+        '--format', choices=('json', 'asciidoc'), default='json',
+        help="output a JSON object or an asciidoc section",
+    )
+    aparser.add_argument(
+        '--level', default='==',
+        help="the asciidoc section level",
+    )
+    aparser.add_argument(
+        '--ratio', type=float, default=1.2,
+        help="the minimum ratio of current to baseline duration for slower",
+    )
+    aparser.add_argument(
+        '--min-delta', type=float, default=0.1,
+        help="the minimum increase in duration, in seconds, for slower",
+    )
+    aparser.add_argument(
+        '--sigma', type=float, default=3.0,
+        help=' '.join((
+            "the minimum number of standard deviations above the baseline",
+            "duration for slower, when there are at least two baseline",
+            "durations",
+        )),
+    )
+    aparser.add_argument(
+        '--min-samples', type=int, default=3,
+        help="the minimum number of baseline durations for slower",
+    )
+    aparser.add_argument(
+        '--output', default='-',
+        help=' '.join((
+            "write output to this file instead of stdout, compressed if the",
+            "filename ends '.gz', '.xz', '.bz2' or '.zst'",
+        )),
+    )
+    aparser.add_argument(
+        'inputs', nargs='+',
+        help=' '.join((
+            "input files of JSON-lines or JUnit XML test results (files",
+            "ending '.xml' are read as JUnit XML), which may be compressed,",
+            "oldest first; the last input is compared with the others",
+        )),
+    )
+    args = aparser.parse_args()
+    if len(args.inputs) < 2:
+        aparser.error('at least two inputs are required')
+    runs = [Run.load(filename) for filename in args.inputs]
+    comparison = compare(
+        runs[:-1], runs[-1],
+        args.ratio, args.min_delta, args.sigma, args.min_samples,
+    )
+    with open_output(args.output) as fout:
+        if args.format == 'json':
+            print(json.dumps(comparison), file=fout)
+        else:
+            print(*to_asciidoc(comparison, args.level), sep='\n', file=fout)
+
+if __name__ == '__main__':
+    main()
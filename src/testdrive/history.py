@@ -0,0 +1,346 @@
+### SPDX-License-Identifier: GPL-2.0-or-later
+
+"""Test result history"""
+
+from argparse import ArgumentParser
+from contextlib import closing
+from datetime import (datetime, timezone)
+import hashlib
+import json
+import os
+import sqlite3
+import sys
+
+from .asciidoc import TestSuites
+from .cases import (category, percentile, timing)
+from .common import (compression, open_input, print_line)
+
+SCHEMA = '''
+CREATE TABLE IF NOT EXISTS runs (
+    run INTEGER PRIMARY KEY,
+    source TEXT NOT NULL,
+    digest TEXT NOT NULL UNIQUE,
+    timestamp TEXT,
+    ingested TEXT NOT NULL
+);
+CREATE TABLE IF NOT EXISTS cases (
+    run INTEGER NOT NULL REFERENCES runs (run),
+    suite TEXT,
+    test_id TEXT NOT NULL,
+    result TEXT NOT NULL,
+    reason TEXT,
+    timestamp TEXT,
+    duration REAL
+);
+CREATE INDEX IF NOT EXISTS cases_test_id ON cases (test_id, run);
+CREATE INDEX IF NOT EXISTS cases_run ON cases (run);
+CREATE INDEX IF NOT EXISTS runs_timestamp ON runs (timestamp, run);
+'''
+
+# the maximum number of test ids in a query, within SQLite's limit on the
+# number of parameters in a statement
+QUERY_IDS = 500
+
+def _rows(cases):
+    """Generate a database row for each of test `cases`, per History.ingest()
+
+    Skip test cases which were not run.
+    """
+    for case in cases:
+        if case['result'] == 'skipped':
+            continue
+        timestamp = case['timestamp']
+        if not isinstance(timestamp, str):
+            # skip decimal relative timestamps
+            timestamp = None
+        yield (
+            case['suite'],
+            case['test_id'],
+            category(case['result']),
+            case['reason'],
+            timestamp,
+            case['duration'],
+        )
+
+class History:
+    """A history of test results, indexed in SQLite database `filename`.
+
+    Each ingested source of test results (a file of JSON-lines or JUnit XML) is
+    recorded as a run, identified by a digest of its test cases, so that a
+    source written to the same file each time is ingested as a new run whenever
+    its content changes. Runs are ordered by the earliest timestamp of their
+    test cases, then by order of ingestion.
+    """
+    def __init__(self, filename):
+        self._db = sqlite3.connect(filename)
+        self._db.executescript(SCHEMA)
+    def close(self):
+        """Close the database."""
+        self._db.close()
+    def ingest(self, source, cases):
+        """Ingest test `cases` from `source` as a new run.
+
+        `cases` is a sequence of dict, each with values for keys 'suite',
+        'test_id', 'result', 'reason', 'timestamp' and 'duration', where
+        'result' is a boolean test result, "error" or "skipped". Test cases
+        which were skipped are not recorded.
+
+        Return the run id, or None if the same `cases` have already been
+        ingested, from any source.
+        """
+        (timestamp, _) = timing(cases)
+        digest = hashlib.sha256(
+            json.dumps(cases, sort_keys=True, default=str).encode(),
+        ).hexdigest()
+        with self._db:
+            try:
+                cursor = self._db.execute(
+                    'INSERT INTO runs (source, digest, timestamp, ingested)'
+                    ' VALUES (?, ?, ?, ?)',
+                    (
+                        source, digest, timestamp,
+                        datetime.now(timezone.utc).isoformat(),
+                    ),
+                )
+            except sqlite3.IntegrityError:
+                return None
+            run = cursor.lastrowid
+            self._db.executemany(
+                'INSERT INTO cases'
+                ' (run, suite, test_id, result, reason, timestamp, duration)'
+                f' VALUES ({run}, ?, ?, ?, ?, ?, ?)',
+                _rows(cases),
+            )
+        return run
+    def ingest_results(self, filename, suite=None):
+        """Ingest JSON-lines test results from `filename` in `suite`.
+
+        Return the run id, or None if these results have already been ingested.
+        """
+        with open_input(filename) as fid:
+            cases = tuple(
+                {
+                    'suite': suite,
+                    'test_id': dct['id'],
+                    'result': dct['result'],
+                    'reason': dct.get('reason'),
+                    'timestamp': dct.get('timestamp'),
+                    'duration': dct.get('duration'),
+                }
+                for dct in (json.loads(line) for line in fid)
+            )
+        return self.ingest(filename, cases)
+    def ingest_junit(self, filename):
+        """Ingest JUnit XML test results from `filename`.
+
+        Return the run id, or None if these results have already been ingested.
+        """
+        suites = TestSuites()
+        suites.include(filename)
+        cases = tuple(
+            {
+                'suite': suite.name,
+                'test_id': case.get('test_id', case.name),
+                'result': case.result,
+                'reason': case.reason,
+                'timestamp': case.timestamp,
+                'duration': (
+                    None if case.duration is None else float(case.duration)
+                ),
+            }
+            for suite in suites.values()
+            for case in suite.values()
+        )
+        return self.ingest(filename, cases)
+    def _runs_clause(self, last):
+        """Return SQL restricting run to the `last` runs, if `last`."""
+        if not last:
+            return ''
+        return (
+            'WHERE run IN (SELECT run FROM runs'
+            f' ORDER BY timestamp DESC, run DESC LIMIT {int(last)})'
+        )
+    def flaky(self, last=None, min_runs=2):
+        """Generate a dict for each flaky test.
+
+        A test is flaky if it has both succeeded and not succeeded in the `last`
+        runs (or all runs, if `last` is not supplied) and has at least
+        `min_runs` results. Tests are generated in descending order of the
+        number of changes in result between consecutive runs.
+        """
+        cursor = self._db.execute(f'''
+            SELECT test_id, COUNT(*), SUM(result = 'success'), SUM(flip)
+            FROM (
+                SELECT cases.test_id, cases.result,
+                    cases.result != LAG(cases.result) OVER (
+                        PARTITION BY cases.test_id
+                        ORDER BY runs.timestamp, runs.run
+                    ) AS flip
+                FROM cases JOIN runs USING (run)
+                {self._runs_clause(last)}
+            )
+            GROUP BY test_id
+            HAVING SUM(result = 'success') BETWEEN 1 AND COUNT(*) - 1
+                AND COUNT(*) >= ?
+            ORDER BY SUM(flip) DESC, test_id
+        ''', (min_runs,))
+        for (test_id, runs, success, flips) in cursor:
+            yield {
+                'test_id': test_id,
+                'runs': runs,
+                'success': success,
+                'flips': flips,
+                'flip_rate': round(flips / (runs - 1), 6),
+            }
+    def durations(self, test_ids=(), percentiles=(50, 95)):
+        """Generate a dict of duration statistics for each test.
+
+        Include tests in `test_ids` or, if `test_ids` is empty, all tests. Each
+        dict has the number of recorded durations, the minimum and maximum
+        duration and the duration at each of `percentiles`.
+        """
+        sql = 'SELECT test_id, duration FROM cases WHERE duration IS NOT NULL'
+        chunks = [()]
+        if test_ids:
+            # query sorted ids in chunks, so that tests are still in order
+            ids = sorted(set(test_ids))
+            chunks = [
+                ids[idx:idx + QUERY_IDS]
+                for idx in range(0, len(ids), QUERY_IDS)
+            ]
+        current = None
+        values = []
+        for chunk in chunks:
+            query = sql
+            if chunk:
+                query += f" AND test_id IN ({', '.join('?' * len(chunk))})"
+            query += ' ORDER BY test_id, duration'
+            for (test_id, duration) in self._db.execute(query, chunk):
+                if test_id != current:
+                    if values:
+                        yield self._duration_stats(
+                            current, values, percentiles,
+                        )
+                    current = test_id
+                    values = []
+                values.append(duration)
+        if values:
+            yield self._duration_stats(current, values, percentiles)
+    @staticmethod
+    def _duration_stats(test_id, values, percentiles):
+        """Return a dict of duration statistics for sorted `values`."""
+        dct = {
+            'test_id': test_id,
+            'count': len(values),
+            'min': values[0],
+            'max': values[-1],
+        }
+        for pct in percentiles:
+            dct[f'p{pct:g}'] = percentile(values, pct)
+        return dct
+    def bisect(self, test_id):
+        """Return a dict locating the first failure of `test_id`.
+
+        The first failure is the earliest run in the latest unbroken sequence
+        of runs where `test_id` did not succeed. Return None if `test_id` has no
+        history or succeeded in its latest run.
+        """
+        cursor = self._db.execute('''
+            SELECT runs.source, runs.timestamp, cases.result, cases.reason
+            FROM cases JOIN runs USING (run)
+            WHERE cases.test_id = ?
+            ORDER BY runs.timestamp DESC, runs.run DESC
+        ''', (test_id,))
+        first = good = None
+        for (source, timestamp, result, reason) in cursor:
+            if result == 'success':
+                good = {'source': source, 'timestamp': timestamp}
+                break
+            first = {
+                'source': source,
+                'timestamp': timestamp,
+                'result': result,
+                'reason': reason,
+            }
+        if first is None:
+            return None
+        return {
+            'test_id': test_id,
+            'first_failure': first,
+            'last_success': good,
+        }
+
+def main():
+    """Index test results in a SQLite database and query result history"""
+    aparser = ArgumentParser(description=main.__doc__)
+    aparser.add_argument('database', help="SQLite database file")
+    subparsers = aparser.add_subparsers(dest='command', required=True)
+    a_ingest = subparsers.add_parser(
+        'ingest',
+        help=' '.join((
+            "ingest test results, which may be compressed;",
+            "files ending '.xml' are read as JUnit XML",
+        )),
+    )
+    a_ingest.add_argument(
+        '--suite',
+        help="The name of the test suite for JSON-lines test results.",
+    )
+    a_ingest.add_argument(
+        'inputs', nargs='+',
+        help="input files of JSON-lines or JUnit XML test results",
+    )
+    a_flaky = subparsers.add_parser('flaky', help="list flaky tests")
+    a_flaky.add_argument(
+        '--last', type=int,
+        help="Only consider this number of the latest runs.",
+    )
+    a_flaky.add_argument(
+        '--min-runs', type=int, default=2,
+        help="Only list tests with at least this number of results.",
+    )
+    a_durations = subparsers.add_parser(
+        'durations', help="list test duration percentiles",
+    )
+    a_durations.add_argument(
+        '--percentiles', nargs='+', type=float, default=(50, 95),
+        help="The percentiles to compute.",
+    )
+    a_durations.add_argument(
+        'test_ids', nargs='*',
+        help="test ids to list; if not supplied then list all tests",
+    )
+    a_bisect = subparsers.add_parser(
+        'bisect', help="find the first failure of tests",
+    )
+    a_bisect.add_argument('test_ids', nargs='+', help="test ids to find")
+    args = aparser.parse_args()
+    with closing(History(args.database)) as history:
+        if args.command == 'ingest':
+            for filename in args.inputs:
+                name = filename
+                if compression(name):
+                    name = os.path.splitext(name)[0]
+                if os.path.splitext(name)[1] == '.xml':
+                    run = history.ingest_junit(filename)
+                else:
+                    run = history.ingest_results(filename, args.suite)
+                if run is None:
+                    print(
+                        f'skipped {filename}: already ingested',
+                        file=sys.stderr,
+                    )
+            return
+        if args.command == 'flaky':
+            dcts = history.flaky(args.last, args.min_runs)
+        elif args.command == 'durations':
+            dcts = history.durations(args.test_ids, args.percentiles)
+        else:
+            dcts = (history.bisect(test_id) for test_id in args.test_ids)
+        for dct in dcts:
+            # Python exits with error code 1 on EPIPE
+            if dct is not None and not print_line(json.dumps(dct)):
+                sys.exit(1)
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,8 @@
+### SPDX-License-Identifier: GPL-2.0-or-later
+
+"""Generate JUnit output, per testdrive.junit.create"""
+
+from .create import main
+
+if __name__ == '__main__':
+    main()
@@ -4,12 +4,14 @@
 
 from argparse import ArgumentParser
 import json
+from urllib.parse import urlparse
 
 from xml.etree import ElementTree as ET
 
-from ..cases import summarize
-from ..common import open_input
+from ..cases import (Summary, summarize)
+from ..common import (open_input, open_output)
 from ..uri import UriBuilder
+from .merge import combine
 
 def _buildattrs(**kwargs):
     """Return a dict from `kwargs` suitable for creating an XML element with."""
@@ -89,6 +91,17 @@ def _error(message):
     )
     return ET.Element('error', attrs)
 
+def _skipped(message):
+    """Return XML skipped element.
+
+    `message` is the reason the test was not run. (Only the first line will be
+    included.)
+    """
+    attrs = _buildattrs(
+        message=(message or '').split('\n', 1)[0],
+    )
+    return ET.Element('skipped', attrs)
+
 def _failure(message):
     """Return XML failure element.
 
@@ -100,6 +113,20 @@ def _failure(message):
     )
     return ET.Element('failure', attrs)
 
+def _rerun(tag, result, message):
+    """Return XML element `tag` for an unsuccessful attempt to run a test.
+
+    `tag` is one of 'rerun' or 'flaky'; `result` is the result of the attempt,
+    False or "error"; `message` is the reason. (Only the first line will be
+    included.)
+    """
+    kind = 'Failure' if result is False else 'Error'
+    attrs = _buildattrs(
+        type=kind,
+        message=(message or '').split('\n', 1)[0],
+    )
+    return ET.Element(f'{tag}{kind}', attrs)
+
 def _system_out(case, exclude=()):
     """Return XML system-out element.
 
@@ -123,6 +150,89 @@ def _properties(*args):
         elem.append(ET.Element('property', name=name, value=str(value)))
     return elem
 
+def testcase(suite, case, exclude=(), uri_builder=None, baseurl_specs=None):
+    """Return XML testcase element for test `case` in `suite`.
+
+    `suite` is the string name of the test suite;
+    `case` is a dict defining test case result and metadata, per junit();
+    `exclude` is a sequence of keys to omit from the JSON object in system-out;
+    `uri_builder` is a UriBuilder for the base URL for test ids, if any;
+    `baseurl_specs` is the base URL for test specifications.
+
+    If `uri_builder` is supplied then add a property element for
+    'test_specification', per junit().
+
+    If `case` has multiple attempts, then add a flakyFailure or flakyError
+    element for each unsuccessful attempt if the last attempt succeeded, else
+    a rerunFailure or rerunError element for each attempt before the last.
+    """
+    e_case = _testcase(suite, case['id'], time=case.get('duration'))
+    if case['result'] is False:
+        e_case.append(_failure(case['reason']))
+    elif case['result'] == 'error':
+        e_case.append(_error(case['reason']))
+    elif case['result'] == 'skipped':
+        e_case.append(_skipped(case['reason']))
+    elif case['result'] is not True:
+        raise ValueError(
+            f"""bad result "{case['result']}" for case {case['id']}"""
+        )
+    # all but the last of multiple attempts were unsuccessful
+    tag = 'flaky' if case['result'] is True else 'rerun'
+    for attempt in case.get('attempts', ())[:-1]:
+        e_case.append(_rerun(tag, attempt['result'], attempt['reason']))
+    e_case.append(_system_out(case, exclude=exclude))
+    properties = [('test_id', case['id'])]
+    if uri_builder:
+        testspec_url = uri_builder.rebase(case['id'], baseurl_specs)
+        properties.append(('test_specification', testspec_url))
+    e_case.append(_properties(*properties))
+    return e_case
+
+def _uri_builder(baseurl_ids=None, baseurl_specs=None):
+    """Return a UriBuilder for test specification URLs, or None.
+
+    Base URLs `baseurl_ids` and `baseurl_specs` are always validated, but are
+    only used if both are supplied, per junit().
+    """
+    if baseurl_ids:
+        UriBuilder(baseurl_ids)
+    if baseurl_specs:
+        UriBuilder(baseurl_specs)
+    if baseurl_ids and baseurl_specs:
+        return UriBuilder(baseurl_ids)
+    return None
+
+def _summary_suite(suite, summary, hostname=None):
+    """Return XML testsuite element for `suite` from `summary` of its cases."""
+    return _testsuite(
+        suite,
+        summary['total'], summary['error'], summary['failure'],
+        summary['skipped'],
+        hostname=hostname,
+        timestamp=summary['timestamp'], time=summary['duration'],
+    )
+
+def _testsuite_for(
+        suite, cases,
+        hostname=None,
+        exclude=(),
+        uri_builder=None, baseurl_specs=None,
+    ): # pylint: disable=too-many-arguments
+    """Return (e_suite, summary) for test `cases` in `suite`.
+
+    `e_suite` is the XML testsuite element containing a testcase element for
+    each of `cases`; `summary` is the summary of `cases`. Other args are as per
+    testcase().
+    """
+    summary = summarize(cases)
+    e_suite = _summary_suite(suite, summary, hostname)
+    for case in cases:
+        e_suite.append(
+            testcase(suite, case, exclude, uri_builder, baseurl_specs),
+        )
+    return (e_suite, summary)
+
 def junit(
         suite, cases,
         hostname=None,
@@ -143,12 +253,15 @@ def junit(
 
     Each case must supply values for keys:
         id - the test URI
-        result - a boolean test result or "error" (no result produced)
+        result - a boolean test result, "error" (no result produced) or
+                 "skipped" (test not run)
         reason - string reason describing test failure or error
 
     Each case may supply values for keys:
         timestamp - ISO 8601 string of UTC time when the test was started
         duration - test duration in seconds
+        attempts - a sequence of dict for each attempt to run the test, with
+                   values for keys result and reason as above
 
     If `timestamp` is supplied then `duration` must also be supplied.
 
@@ -157,50 +270,139 @@ def junit(
     formed by substituting `baseurl_specs` for the base (prefix) of the case
     'id' (which must be `baseurl_ids`).
     """
-    uri_builder = None
-    # always ensure base URLs are valid
-    if baseurl_ids:
-        UriBuilder(baseurl_ids)
-    if baseurl_specs:
-        UriBuilder(baseurl_specs)
-    # only use base URLs if both are supplied
-    if baseurl_ids and baseurl_specs:
-        uri_builder = UriBuilder(baseurl_ids)
-    summary = summarize(cases)
-    tests = summary['total']
-    errors = summary['error']
-    failures = summary['failure']
-    timestamp = summary['timestamp']
-    time_total = summary['duration']
-    e_root = _testsuites(tests, errors, failures)
-    e_suite = _testsuite(
-        suite,
-        tests, errors, failures,
-        hostname=hostname,
-        timestamp=timestamp, time=time_total,
+    (e_suite, summary) = _testsuite_for(
+        suite, cases, hostname, exclude,
+        _uri_builder(baseurl_ids, baseurl_specs), baseurl_specs,
+    )
+    e_root = _testsuites(
+        summary['total'], summary['error'], summary['failure'],
+        summary['skipped'],
     )
-    for case in cases:
-        e_case = _testcase(suite, case['id'], time=case.get('duration'))
-        if case['result'] is False:
-            e_case.append(_failure(case['reason']))
-        elif case['result'] == 'error':
-            e_case.append(_error(case['reason']))
-        elif case['result'] is not True:
-            raise ValueError(
-                f"""bad result "{case['result']}" for case {case['id']}"""
-            )
-        e_case.append(_system_out(case, exclude=exclude))
-        properties = [('test_id', case['id'])]
-        if uri_builder:
-            testspec_url = uri_builder.rebase(case['id'], baseurl_specs)
-            properties.append(('test_specification', testspec_url))
-        e_case.append(_properties(*properties))
-        e_suite.append(e_case)
     e_root.append(e_suite)
     if prettify:
         ET.indent(e_root)
     return ET.tostring(e_root, encoding='unicode', xml_declaration=True)
 
+def group(cases, suite, key=None, depth=None, baseurl=None):
+    """Return a dict mapping test suite name to a list of test `cases`.
+
+    `cases` is an iterable of dict, per junit(); `suite` is the name of the
+    test suite for cases not otherwise grouped. If `key` is supplied, then
+    group cases by their value for `key`. Otherwise, if `depth` is supplied,
+    then group cases by the first `depth` path segments of their id, relative
+    to `baseurl` if supplied: the test suite name is `suite` followed by each
+    segment, separated by '.'. Test suites are in order of first test case.
+    """
+    groups = {}
+    for case in cases:
+        name = suite
+        if key is not None:
+            name = case.get(key, suite)
+        elif depth:
+            id_ = case['id']
+            if baseurl and id_.startswith(baseurl):
+                path = id_[len(baseurl):]
+            else:
+                path = urlparse(id_).path
+            segments = [seg for seg in path.split('/') if seg][:depth]
+            name = '.'.join((suite, *segments))
+        groups.setdefault(name, []).append(case)
+    return groups
+
+def junit_suites(
+        groups,
+        hostname=None,
+        exclude=(),
+        baseurl_ids=None, baseurl_specs=None,
+        prettify=False,
+    ): # pylint: disable=too-many-arguments
+    """Return JUnit output for test suites `groups`.
+
+    `groups` is a dict mapping test suite name to a sequence of test cases, per
+    junit(); other args are as per junit(). The output is the same as merging,
+    per testdrive.junit.merge, the output of junit() for each test suite.
+    """
+    uri_builder = _uri_builder(baseurl_ids, baseurl_specs)
+    attrs = {}
+    e_suites = []
+    for (suite, cases) in groups.items():
+        (e_suite, _) = _testsuite_for(
+            suite, cases, hostname, exclude, uri_builder, baseurl_specs,
+        )
+        e_suites.append(e_suite)
+        combine(attrs, e_suite)
+    e_root = ET.Element('testsuites', {k: str(v) for (k, v) in attrs.items()})
+    e_root.extend(e_suites)
+    if prettify:
+        ET.indent(e_root)
+    return ET.tostring(e_root, encoding='unicode', xml_declaration=True)
+
+class IncrementalJUnit:
+    """JUnit output for test cases in `suite`, updated incrementally.
+
+    `hostname`, `exclude`, `baseurl_ids`, `baseurl_specs` and `prettify` are as
+    per junit(). Each test case added is converted to XML once, so the cost of
+    updated JUnit output is proportional to the number of test cases added
+    since the last update (plus a final concatenation).
+    """
+    # placeholder for test cases in serialized testsuite element
+    _PLACEHOLDER = 'TESTDRIVE-TESTCASES'
+    def __init__(
+            self, suite,
+            hostname=None,
+            exclude=(),
+            baseurl_ids=None, baseurl_specs=None,
+            prettify=False,
+        ): # pylint: disable=too-many-arguments
+        self._uri_builder = _uri_builder(baseurl_ids, baseurl_specs)
+        self._suite = suite
+        self._hostname = hostname
+        self._exclude = exclude
+        self._baseurl_specs = baseurl_specs
+        self._prettify = prettify
+        self._summary = Summary()
+        self._xml = []
+    def add(self, case):
+        """Add test `case`, per junit(), and return its testcase element."""
+        e_case = testcase(
+            self._suite, case, self._exclude,
+            self._uri_builder, self._baseurl_specs,
+        )
+        self._summary.add(case)
+        if self._prettify:
+            ET.indent(e_case, level=2)
+            self._xml.append('\n    ')
+        self._xml.append(ET.tostring(e_case, encoding='unicode'))
+        return e_case
+    def testsuite(self):
+        """Return XML testsuite element, without test cases."""
+        return _summary_suite(
+            self._suite, self._summary.value(), self._hostname,
+        )
+    def tostring(self):
+        """Return JUnit output for test cases added, per junit()."""
+        if not self._xml:
+            return junit(
+                self._suite, (), self._hostname,
+                prettify=self._prettify,
+            )
+        summary = self._summary.value()
+        e_root = _testsuites(
+            summary['total'], summary['error'], summary['failure'],
+            summary['skipped'],
+        )
+        e_suite = self.testsuite()
+        e_suite.text = self._PLACEHOLDER
+        e_root.append(e_suite)
+        if self._prettify:
+            ET.indent(e_root)
+        (head, tail) = ET.tostring(
+            e_root, encoding='unicode', xml_declaration=True,
+        ).rsplit(self._PLACEHOLDER, 1)
+        if self._prettify:
+            tail = '\n  ' + tail
+        return ''.join((head, *self._xml, tail))
+
 def main():
     """Generate JUnit output for test cases.
 
@@ -232,25 +434,62 @@ def main():
         '--baseurl-specs',
         help="The base URL which test specifications are relative to.",
     )
+    aparser.add_argument(
+        '--output', default='-',
+        help=' '.join((
+            "Write JUnit output to this file instead of stdout.",
+            "If the filename ends '.gz', '.xz', '.bz2' or '.zst' then",
+            "output is compressed.",
+        )),
+    )
+    aparser.add_argument(
+        '--suite-key',
+        help=' '.join((
+            "Group test cases into test suites named by their value for",
+            "this key. Test cases without this key are in test suite `suite`.",
+        )),
+    )
+    aparser.add_argument(
+        '--suite-depth', type=int,
+        help=' '.join((
+            "Group test cases into test suites by this number of leading",
+            "path segments of their id (relative to `--baseurl-ids` if",
+            "supplied). Each test suite is named `suite` followed by the",
+            "segments, separated by '.'. Ignored if `--suite-key` is supplied.",
+        )),
+    )
     aparser.add_argument(
         'suite',
         help="The name of the test suite. (Used in JUnit output.)",
     )
     aparser.add_argument(
         'input',
-        help="input file, or '-' to read from stdin",
+        help="input file, which may be compressed, or '-' to read from stdin",
     )
     args = aparser.parse_args()
     with open_input(args.input) as fid:
         cases = tuple(json.loads(line) for line in fid)
-    print(junit(
-        args.suite,
-        cases,
-        args.hostname,
-        args.exclude,
-        args.baseurl_ids, args.baseurl_specs,
-        args.prettify,
-    ))
+    with open_output(args.output) as fout:
+        if args.suite_key or args.suite_depth:
+            print(junit_suites(
+                group(
+                    cases, args.suite,
+                    args.suite_key, args.suite_depth, args.baseurl_ids,
+                ),
+                args.hostname,
+                args.exclude,
+                args.baseurl_ids, args.baseurl_specs,
+                args.prettify,
+            ), file=fout)
+            return
+        print(junit(
+            args.suite,
+            cases,
+            args.hostname,
+            args.exclude,
+            args.baseurl_ids, args.baseurl_specs,
+            args.prettify,
+        ), file=fout)
 
 if __name__ == '__main__':
     main()
@@ -4,43 +4,240 @@
 
 from argparse import ArgumentParser
 from datetime import timedelta
+import json
 
 from xml.etree import ElementTree as ET
 
-from ..run import timevalue
+from ..common import (open_input, open_output, timevalue)
 
-def combine(attrs, e_suite):
-    """Combine attribute values from `e_suite` into `attrs`."""
-    for name in ('tests', 'errors', 'failures', 'skipped'):
-        count = int(e_suite.get(name, 0))
-        try:
-            attrs[name] += count
-        except KeyError:
-            attrs[name] = count
+COUNTS = ('tests', 'errors', 'failures', 'skipped')
+
+def suite_attrs(e_suite):
+    """Return a dict of combined attribute values for `e_suite` alone."""
+    attrs = {name: int(e_suite.get(name, 0)) for name in COUNTS}
     timestamp = e_suite.get('timestamp')
-    duration = float(e_suite.get('time', 0))
     if timestamp:
-        try:
-            # time value when [c]ombined testing [b]egan
-            tv_cb = timevalue(attrs['timestamp'])
-            # time value when [c]ombined testing [f]inished
-            tv_cf = tv_cb + timedelta(seconds=attrs['time'])
-        except KeyError:
-            attrs['timestamp'] = timestamp
-            attrs['time'] = duration
+        attrs['timestamp'] = timestamp
+        attrs['time'] = float(e_suite.get('time', 0))
+    return attrs
+
+def combine_attrs(lhs, rhs):
+    """Return a dict combining attribute values in dicts `lhs` and `rhs`.
+
+    Counts are summed. The combined timestamp and time span the earliest start
+    to the latest finish in `lhs` and `rhs`. Combining is associative, so that
+    attribute values for many test suites can be combined in any grouping.
+    """
+    attrs = {name: lhs.get(name, 0) + rhs.get(name, 0) for name in COUNTS}
+    if 'timestamp' not in rhs:
+        timing = lhs
+    elif 'timestamp' not in lhs:
+        timing = rhs
+    else:
+        # time values when [l]hs and [r]hs testing [b]egan and [f]inished
+        tv_lb = timevalue(lhs['timestamp'])
+        tv_lf = tv_lb + timedelta(seconds=lhs['time'])
+        tv_rb = timevalue(rhs['timestamp'])
+        tv_rf = tv_rb + timedelta(seconds=rhs['time'])
+        if tv_lb <= tv_rb and tv_rf <= tv_lf:
+            timing = lhs
+        elif tv_rb <= tv_lb and tv_lf <= tv_rf:
+            timing = rhs
         else:
-            # time value when this [s]uite [b]egan
-            tv_sb = timevalue(timestamp)
-            # time value when this [s]uite [f]inished
-            tv_sf = tv_sb + timedelta(seconds=duration)
-            if tv_sb < tv_cb:
-                attrs['timestamp'] = timestamp
-                if tv_sf < tv_cf:
-                    attrs['time'] += (tv_cb - tv_sb).total_seconds()
-                else:
-                    attrs['time'] = duration
-            elif tv_cf < tv_sf:
-                attrs['time'] += (tv_sf - tv_cf).total_seconds()
+            (timestamp, tv_b) = min(
+                (lhs['timestamp'], tv_lb), (rhs['timestamp'], tv_rb),
+                key=lambda item: item[1],
+            )
+            timing = {
+                'timestamp': timestamp,
+                'time': (max(tv_lf, tv_rf) - tv_b).total_seconds(),
+            }
+    if 'timestamp' in timing:
+        attrs['timestamp'] = timing['timestamp']
+        attrs['time'] = timing['time']
+    return attrs
+
+def combine(attrs, e_suite):
+    """Combine attribute values from `e_suite` into `attrs`."""
+    attrs.update(combine_attrs(attrs, suite_attrs(e_suite)))
+
+# placeholder for content in serialized elements
+_PLACEHOLDER = 'TESTDRIVE-CONTENT'
+
+def serialize(tag, attrs, content='', xml_declaration=False):
+    """Return serialized XML element `tag` with `attrs` and `content`.
+
+    `content` is a string of serialized XML. If `xml_declaration` then the
+    element is preceded by an XML declaration.
+    """
+    elem = ET.Element(tag, attrs)
+    elem.text = _PLACEHOLDER
+    (head, tail) = ET.tostring(
+        elem, encoding='unicode', xml_declaration=xml_declaration,
+    ).rsplit(_PLACEHOLDER, 1)
+    return head + content + tail
+
+def category(e_case):
+    """Return the count attribute name for testcase `e_case`, if any.
+
+    Return 'failures', 'errors' or 'skipped', else None for a test success.
+    """
+    for (tag, name) in (
+            ('failure', 'failures'),
+            ('error', 'errors'),
+            ('skipped', 'skipped'),
+        ):
+        if e_case.find(tag) is not None:
+            return name
+    return None
+
+def _reduce(func, items):
+    """Return `items` reduced with `func` pairwise, as a balanced tree.
+
+    `func` must be associative; `items` must not be empty.
+    """
+    items = list(items)
+    while len(items) > 1:
+        pairs = zip(items[0::2], items[1::2])
+        reduced = [func(lhs, rhs) for (lhs, rhs) in pairs]
+        if len(items) % 2:
+            reduced.append(items[-1])
+        items = reduced
+    return items[0]
+
+def _case_record(e_case, timestamp, prettify):
+    """Return (test_id, latest, category, xml) for testcase `e_case`.
+
+    `latest` is the POSIX time when the test case started, from the JSON object
+    in system-out, else from `timestamp` of the test suite; `category` is as
+    per category().
+    """
+    test_id = e_case.get('name')
+    for e_prop in e_case.iter('property'):
+        if e_prop.get('name') == 'test_id':
+            test_id = e_prop.get('value')
+    e_out = e_case.find('system-out')
+    try:
+        timestamp = json.loads(e_out.text).get('timestamp') or timestamp
+    except (AttributeError, TypeError, ValueError):
+        pass
+    try:
+        latest = timevalue(timestamp).timestamp()
+    except (TypeError, ValueError):
+        latest = float('-inf')
+    if prettify:
+        ET.indent(e_case, level=2)
+    e_case.tail = None
+    return (
+        test_id, latest, category(e_case),
+        ET.tostring(e_case, encoding='unicode'),
+    )
+
+def _load(filenames, dedupe=False, prettify=False):
+    """Return a list of (attrs, content) for each test suite in `filenames`.
+
+    `attrs` is a dict of test suite attributes. If `dedupe` then `content` is
+    a list of records for its test cases, per _case_record(): otherwise
+    `content` is the serialized test suite. If `prettify` then indent XML.
+    """
+    suites = []
+    for filename in filenames:
+        with open_input(filename, encoding=None) as fid:
+            e_root = ET.parse(fid).getroot()
+        for e_suite in e_root.iter('testsuite'):
+            attrs = dict(e_suite.attrib)
+            if dedupe:
+                timestamp = attrs.get('timestamp')
+                content = [
+                    _case_record(e_case, timestamp, prettify)
+                    for e_case in e_suite.findall('testcase')
+                ]
+            else:
+                if prettify:
+                    ET.indent(e_suite, level=1)
+                e_suite.tail = None
+                content = ET.tostring(e_suite, encoding='unicode')
+            suites.append((attrs, content))
+    return suites
+
+def _dedupe(suites, prettify=False):
+    """Return a list of (attrs, xml) for `suites` with test cases deduplicated.
+
+    `suites` is a list of (attrs, content) per _load() with `dedupe`. Keep only
+    the latest test case for each test id, by start time then by order: drop
+    test suites with no test cases kept. Counts in `attrs` are recomputed.
+    """
+    # hash index of test id to (latest, position) of the test case kept
+    index = {}
+    for (snum, (_, cases)) in enumerate(suites):
+        for (cnum, (test_id, latest, _, _)) in enumerate(cases):
+            key = (latest, snum, cnum)
+            if index.get(test_id, key) <= key:
+                index[test_id] = key
+    deduped = []
+    for (snum, (attrs, cases)) in enumerate(suites):
+        kept = [
+            case for (cnum, case) in enumerate(cases)
+            if index[case[0]][1:] == (snum, cnum)
+        ]
+        if not kept:
+            continue
+        attrs = dict(attrs, tests=str(len(kept)))
+        for name in COUNTS[1:]:
+            attrs[name] = str(sum(1 for case in kept if case[2] == name))
+        indent = '\n    ' if prettify else ''
+        body = ''.join(indent + case[3] for case in kept)
+        if prettify:
+            body += '\n  '
+        deduped.append((attrs, serialize('testsuite', attrs, body)))
+    return deduped
+
+def merge(filenames, prettify=False, jobs=1, dedupe=None):
+    """Return JUnit output merging test suites in JUnit files `filenames`.
+
+    If `prettify` then indent XML output. Files are parsed in up to `jobs`
+    parallel processes. If `dedupe` is 'latest', then keep only the latest test
+    case for each test id (the 'test_id' property, else the test case name),
+    per _dedupe().
+    """
+    filenames = list(filenames)
+    dedupe = dedupe == 'latest'
+    if jobs > 1 and len(filenames) > 1:
+        # pylint: disable-next=import-outside-toplevel
+        from concurrent.futures import ProcessPoolExecutor
+        size = -(-len(filenames) // (jobs * 4))
+        chunks = [
+            filenames[idx:idx + size]
+            for idx in range(0, len(filenames), size)
+        ]
+        with ProcessPoolExecutor(jobs) as executor:
+            suites = [
+                suite
+                for loaded in executor.map(
+                    _load, chunks,
+                    [dedupe] * len(chunks), [prettify] * len(chunks),
+                )
+                for suite in loaded
+            ]
+    else:
+        suites = _load(filenames, dedupe, prettify)
+    if dedupe:
+        suites = _dedupe(suites, prettify)
+    if not suites:
+        e_root = ET.Element('testsuites')
+        return ET.tostring(e_root, encoding='unicode', xml_declaration=True)
+    attrs = _reduce(
+        combine_attrs,
+        (suite_attrs(ET.Element('testsuite', a)) for (a, _) in suites),
+    )
+    indent = '\n  ' if prettify else ''
+    body = ''.join(indent + xml for (_, xml) in suites)
+    if prettify:
+        body += '\n'
+    return serialize(
+        'testsuites', {k: str(v) for (k, v) in attrs.items()}, body,
+        xml_declaration=True,
+    )
 
 def main():
     """Merge JUnit files and print the output to stdout."""
@@ -49,23 +246,35 @@ def main():
         '--prettify', action='store_true',
         help="pretty print XML output",
     )
+    aparser.add_argument(
+        '--output', default='-',
+        help=' '.join((
+            "write output to this file instead of stdout, compressed if the",
+            "filename ends '.gz', '.xz', '.bz2' or '.zst'",
+        )),
+    )
+    aparser.add_argument(
+        '--jobs', type=int, default=1,
+        help="parse input files in up to this many parallel processes",
+    )
+    aparser.add_argument(
+        '--dedupe', choices=('latest',),
+        help=' '.join((
+            "keep only the latest test case for each test id, for example",
+            "when merging reruns; test suites with no test cases kept are",
+            "omitted",
+        )),
+    )
     aparser.add_argument(
         'inputs', nargs='+',
-        help="input files",
+        help="input files, which may be compressed",
     )
     args = aparser.parse_args()
-    attrs = {}
-    e_suites = []
-    for filename in args.inputs:
-        for e_suite in ET.parse(filename).getroot().iter('testsuite'):
-            e_suites.append(e_suite)
-            combine(attrs, e_suite)
-    e_root = ET.Element('testsuites', {k: str(v) for (k,v) in attrs.items()})
-    for e_suite in e_suites:
-        e_root.append(e_suite)
-    if args.prettify:
-        ET.indent(e_root)
-    print(ET.tostring(e_root, encoding='unicode', xml_declaration=True))
+    with open_output(args.output) as fout:
+        print(
+            merge(args.inputs, args.prettify, args.jobs, args.dedupe),
+            file=fout,
+        )
 
 if __name__ == '__main__':
     main()
@@ -0,0 +1,228 @@
+### SPDX-License-Identifier: GPL-2.0-or-later
+
+"""Split JUnit output into shards of bounded size"""
+
+from argparse import ArgumentParser
+import hashlib
+import json
+import os
+import sys
+
+from xml.etree import ElementTree as ET
+
+from ..common import open_input
+from .merge import (COUNTS, category, serialize)
+
+# XML declaration at the start of each shard
+_DECLARATION = "<?xml version='1.0' encoding='utf-8'?>\n"
+
+def limit_output(e_case, truncate=None, externalize=None, outdir=None):
+    """Limit the size of the system-out element of testcase `e_case`.
+
+    If `externalize` is supplied, then system-out text longer than
+    `externalize` bytes is written to a file in directory `outdir`, named for
+    the digest of its content, and replaced by a JSON object with the path
+    to the file relative to the parent of `outdir` at key 'system_out' and its
+    size at key 'size'. If the text was a JSON object, then its values which
+    are not arrays or objects are retained, so that the test result, reason
+    and timing remain available.
+
+    Otherwise, if `truncate` is supplied, then system-out text longer than
+    `truncate` bytes is truncated, and a line noting its original size is
+    appended.
+    """
+    e_out = e_case.find('system-out')
+    if e_out is None or not e_out.text:
+        return
+    data = e_out.text.encode()
+    if externalize is not None and len(data) > externalize:
+        try:
+            obj = json.loads(data)
+        except ValueError:
+            obj = None
+        if isinstance(obj, dict):
+            (ext, ref) = ('.json', {
+                k: v for (k, v) in obj.items()
+                if not isinstance(v, (dict, list))
+            })
+        else:
+            (ext, ref) = ('.txt', {})
+        name = hashlib.sha256(data).hexdigest() + ext
+        path = os.path.join(outdir, name)
+        if not os.path.exists(path):
+            os.makedirs(outdir, exist_ok=True)
+            with open(path, 'wb') as fid:
+                fid.write(data)
+        ref['system_out'] = f'{os.path.basename(outdir)}/{name}'
+        ref['size'] = len(data)
+        e_out.text = json.dumps(ref, sort_keys=True, indent=4)
+    elif truncate is not None and len(data) > truncate:
+        kept = data[:truncate].decode(errors='ignore')
+        e_out.text = f'{kept}\n... truncated from {len(data)} bytes'
+
+class Splitter:
+    """Write JUnit test suites to shards of at most `budget` bytes.
+
+    Each shard is a JUnit file named `prefix`-NNNN.xml, with a testsuites root
+    element. Test suites are split at testcase boundaries: each part of a test
+    suite keeps the attributes of the test suite, with counts for its own test
+    cases; test suites with no test cases are omitted. A shard exceeds `budget`
+    only if it has a single test case which does so. `filenames` is a list of
+    the shards written.
+    """
+    def __init__(self, prefix, budget):
+        self._prefix = prefix
+        self._budget = budget
+        # no shard can have more test cases than bytes
+        self._counts = {name: str(budget) for name in COUNTS}
+        self._empty = len((
+            _DECLARATION + serialize('testsuites', self._counts)
+        ).encode())
+        # test suite parts in the current shard: (attrs, cases, counts)
+        self._parts = []
+        self._size = self._empty
+        self._attrs = None
+        self.filenames = []
+    def start_suite(self, attrs):
+        """Start a test suite with `attrs` in the current shard."""
+        self._attrs = attrs
+        self._start_part()
+    def _start_part(self):
+        """Start a part of the current test suite in the current shard."""
+        self._parts.append(
+            (self._attrs, [], {name: 0 for name in COUNTS}),
+        )
+        self._size += len(
+            serialize('testsuite', dict(self._attrs, **self._counts)).encode()
+        )
+    def add_case(self, xml, cat=None):
+        """Add serialized testcase `xml` in count attribute `cat`, if any."""
+        size = len(xml.encode())
+        if self._size + size > self._budget and any(
+                cases for (_, cases, _) in self._parts
+            ):
+            self._write()
+            self._start_part()
+        (_, cases, counts) = self._parts[-1]
+        cases.append(xml)
+        counts['tests'] += 1
+        if cat:
+            counts[cat] += 1
+        self._size += size
+    def end_suite(self):
+        """End the current test suite."""
+        self._attrs = None
+    def _write(self):
+        """Write the current shard and start a new shard."""
+        totals = {name: 0 for name in COUNTS}
+        content = ''
+        for (attrs, cases, counts) in self._parts:
+            if not cases:
+                continue
+            for name in COUNTS:
+                totals[name] += counts[name]
+            attrs = dict(attrs, **{k: str(v) for (k, v) in counts.items()})
+            content += serialize('testsuite', attrs, ''.join(cases))
+        filename = f'{self._prefix}-{len(self.filenames) + 1:04d}.xml'
+        with open(filename, 'w', encoding='utf-8') as fid:
+            fid.write(_DECLARATION)
+            fid.write(serialize(
+                'testsuites',
+                {k: str(v) for (k, v) in totals.items()},
+                content,
+            ))
+        self.filenames.append(filename)
+        self._parts = []
+        self._size = self._empty
+    def close(self):
+        """Write the last shard, if it has any test cases."""
+        if any(cases for (_, cases, _) in self._parts):
+            self._write()
+
+def split(
+        filename, prefix, budget,
+        truncate=None, externalize=None,
+    ):
+    """Split JUnit test suites in `filename` into shards, per Splitter.
+
+    `filename` may be compressed. It is parsed incrementally, so that memory
+    use is bounded by the size of a shard. The size of system-out in each
+    testcase is limited per limit_output(), with files externalized to
+    directory `prefix`-system-out. Return a list of the shards written.
+    """
+    splitter = Splitter(prefix, budget)
+    outdir = f'{prefix}-system-out'
+    e_suite = None
+    with open_input(filename, encoding=None) as fid:
+        for (event, elem) in ET.iterparse(fid, ('start', 'end')):
+            if elem.tag == 'testsuite':
+                if event == 'start':
+                    e_suite = elem
+                    splitter.start_suite(dict(elem.attrib))
+                else:
+                    splitter.end_suite()
+                    e_suite = None
+            elif elem.tag == 'testcase' and event == 'end':
+                limit_output(elem, truncate, externalize, outdir)
+                elem.tail = None
+                splitter.add_case(
+                    ET.tostring(elem, encoding='unicode'), category(elem),
+                )
+                if e_suite is not None:
+                    e_suite.remove(elem)
+    splitter.close()
+    return splitter.filenames
+
+def main():
+    """Split JUnit output into shards of bounded size, for upload.
+
+    Write shards along testsuite and testcase boundaries, printing the name of
+    each shard written.
+    """
+    aparser = ArgumentParser(description=main.__doc__)
+    aparser.add_argument(
+        '--budget', type=int, required=True,
+        help="the maximum size of each shard, in bytes",
+    )
+    aparser.add_argument(
+        '--truncate', type=int,
+        help="truncate system-out text longer than this many bytes",
+    )
+    aparser.add_argument(
+        '--externalize', type=int,
+        help=' '.join((
+            "write system-out text longer than this many bytes to a side file",
+            "in directory PREFIX-system-out, replacing it with a reference",
+        )),
+    )
+    aparser.add_argument(
+        '--schema',
+        help="validate each shard against this XSD schema file",
+    )
+    aparser.add_argument(
+        '--prefix', default='junit',
+        help="write shards to files PREFIX-NNNN.xml",
+    )
+    aparser.add_argument(
+        'input',
+        help="input JUnit file, which may be compressed",
+    )
+    args = aparser.parse_args()
+    filenames = split(
+        args.input, args.prefix, args.budget, args.truncate, args.externalize,
+    )
+    for filename in filenames:
+        print(filename)
+    if args.schema:
+        # pylint: disable-next=import-outside-toplevel
+        from ..xml import validate_many
+        valid = True
+        for (filename, reason) in validate_many(args.schema, filenames):
+            if reason is not True:
+                print(f'{filename}: {reason}', file=sys.stderr)
+                valid = False
+        if not valid:
+            sys.exit(1)
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,230 @@
+### SPDX-License-Identifier: GPL-2.0-or-later
+
+"""Live metrics for long runs of tests"""
+
+from collections import (Counter, deque)
+from http.server import (BaseHTTPRequestHandler, ThreadingHTTPServer)
+import socketserver
+import sys
+import threading
+from time import monotonic
+
+from .cases import (category, percentile)
+
+class Metrics:
+    """Live metrics for a run of tests with ids `test_ids`.
+
+    `test_ids` is a sequence of the id of each test case to be run, or None if
+    not known; `expected` maps test id to expected test duration in seconds,
+    from historical durations; `window` is the number of seconds over which
+    throughput is computed, and the number of the latest test durations from
+    which duration percentiles are computed; `jobs` is a function returning
+    the current limit on the number of test cases run concurrently, if more
+    than one.
+
+    The estimated time to completion is the sum of expected durations of test
+    cases remaining, divided by the number of them which can run concurrently:
+    the mean of the latest test durations is used for test cases without an
+    expected duration.
+    """
+    def __init__(self, test_ids=None, expected=None, window=60, jobs=None):
+        self._lock = threading.Lock()
+        self._jobs = jobs
+        self._start = monotonic()
+        self._window = window
+        self._total = None if test_ids is None else len(test_ids)
+        self._expected = expected or {}
+        self._remaining = Counter(test_ids or ())
+        self._counts = Counter(
+            {'success': 0, 'failure': 0, 'error': 0, 'skipped': 0},
+        )
+        self._durations = deque(maxlen=window)
+        # sum and count of all test durations, for Prometheus summary
+        self._duration_sum = 0.0
+        self._duration_count = 0
+        self._completions = deque()
+    def record(self, result):
+        """Record test case `result`, a result dict as output by drive()."""
+        now = monotonic()
+        with self._lock:
+            self._counts[category(result['result'])] += 1
+            duration = result.get('duration')
+            if duration is not None:
+                self._durations.append(duration)
+                self._duration_sum += duration
+                self._duration_count += 1
+            self._completions.append(now)
+            self._expire(now)
+            test_id = result.get('id')
+            if self._remaining[test_id]:
+                self._remaining[test_id] -= 1
+    def _expire(self, now):
+        """Discard completion times before the window ending `now`."""
+        while self._completions and self._completions[0] < now - self._window:
+            self._completions.popleft()
+    def snapshot(self):
+        """Return a dict of current metrics."""
+        now = monotonic()
+        with self._lock:
+            elapsed = now - self._start
+            completed = sum(self._counts.values())
+            self._expire(now)
+            span = min(self._window, elapsed)
+            throughput = len(self._completions) / span if span else 0.0
+            durations = sorted(self._durations)
+            mean = sum(durations) / len(durations) if durations else None
+            eta = None
+            if self._total is not None:
+                try:
+                    eta = sum(
+                        count * self._expected.get(test_id, mean)
+                        for (test_id, count) in self._remaining.items()
+                    )
+                except TypeError:
+                    # no mean duration for tests without expected duration
+                    pass
+                else:
+                    concurrent = min(
+                        self._jobs() if self._jobs else 1,
+                        sum(self._remaining.values()),
+                    )
+                    eta /= max(concurrent, 1)
+            return {
+                'elapsed': round(elapsed, 3),
+                'total': self._total,
+                'completed': completed,
+                'remaining': (
+                    None if self._total is None else self._total - completed
+                ),
+                **self._counts,
+                'throughput': round(throughput, 6),
+                'p50': percentile(durations, 50),
+                'p95': percentile(durations, 95),
+                'eta': None if eta is None else round(eta, 3),
+                'duration_sum': round(self._duration_sum, 6),
+                'duration_count': self._duration_count,
+            }
+    def prometheus(self):
+        """Return current metrics in Prometheus text exposition format."""
+        snap = self.snapshot()
+        lines = []
+        def metric(name, mtype, help_, *samples):
+            lines.append(f'# HELP testdrive_{name} {help_}')
+            lines.append(f'# TYPE testdrive_{name} {mtype}')
+            for (labels, value) in samples:
+                if value is not None:
+                    lines.append(f'testdrive_{name}{labels} {value}')
+        metric(
+            'elapsed_seconds', 'gauge', 'Seconds since the run started.',
+            ('', snap['elapsed']),
+        )
+        metric(
+            'cases', 'gauge', 'Number of test cases in the run.',
+            ('', snap['total']),
+        )
+        metric(
+            'cases_completed_total', 'counter',
+            'Number of test cases completed.',
+            ('', snap['completed']),
+        )
+        metric(
+            'cases_remaining', 'gauge', 'Number of test cases remaining.',
+            ('', snap['remaining']),
+        )
+        metric(
+            'results_total', 'counter',
+            'Number of test case results by result.',
+            *((f'{{result="{r}"}}', snap[r]) for r in self._counts),
+        )
+        metric(
+            'throughput_cases_per_second', 'gauge',
+            f'Test cases completed per second over {self._window} seconds.',
+            ('', snap['throughput']),
+        )
+        metric(
+            'case_duration_seconds', 'summary',
+            ' '.join((
+                'Duration of test cases,',
+                f'with quantiles of the latest {self._window} test cases.',
+            )),
+            ('{quantile="0.5"}', snap['p50']),
+            ('{quantile="0.95"}', snap['p95']),
+        )
+        # summary series, without HELP or TYPE of their own
+        lines.append(
+            f"testdrive_case_duration_seconds_sum {snap['duration_sum']}",
+        )
+        lines.append(
+            f"testdrive_case_duration_seconds_count {snap['duration_count']}",
+        )
+        metric(
+            'eta_seconds', 'gauge',
+            'Estimated seconds until the run is completed.',
+            ('', snap['eta']),
+        )
+        return '\n'.join(lines) + '\n'
+    def progress(self):
+        """Return a one line summary of current metrics."""
+        snap = self.snapshot()
+        total = '?' if snap['total'] is None else snap['total']
+        eta = '?' if snap['eta'] is None else f"{snap['eta']:.0f}s"
+        return ' '.join((
+            f"{snap['completed']}/{total} cases",
+            f"({snap['success']} success, {snap['failure']} failure,",
+            f"{snap['error']} error, {snap['skipped']} skipped)",
+            f"{snap['throughput']:.3f} cases/s",
+            f"p50 {snap['p50']}s p95 {snap['p95']}s",
+            f"eta {eta}",
+        ))
+
+class _Handler(BaseHTTPRequestHandler):
+    """HTTP request handler serving metrics from server attribute `metrics`."""
+    def do_GET(self): # pylint: disable=invalid-name
+        """Serve metrics in Prometheus text exposition format."""
+        body = self.server.metrics.prometheus().encode()
+        self.send_response(200)
+        self.send_header('Content-Type', 'text/plain; version=0.0.4')
+        self.send_header('Content-Length', str(len(body)))
+        self.end_headers()
+        self.wfile.write(body)
+    def log_message(self, format, *args): # pylint: disable=redefined-builtin
+        """Do not log requests."""
+
+class _HTTPServer(ThreadingHTTPServer):
+    """A HTTP server serving `metrics` on localhost `port`."""
+    def __init__(self, port, metrics):
+        super().__init__(('127.0.0.1', port), _Handler)
+        self.metrics = metrics
+
+class _UnixHTTPServer(
+        socketserver.ThreadingMixIn,
+        socketserver.UnixStreamServer,
+    ):
+    """A HTTP server serving `metrics` on a Unix socket `path`."""
+    daemon_threads = True
+    def __init__(self, path, metrics):
+        super().__init__(path, _Handler)
+        self.metrics = metrics
+
+def serve(metrics, port=None, path=None):
+    """Serve `metrics` over HTTP in a background thread.
+
+    Listen on localhost `port`, if supplied, else on Unix socket `path`. Return
+    the server, which can be stopped with its shutdown() method.
+    """
+    if port is not None:
+        server = _HTTPServer(port, metrics)
+    else:
+        server = _UnixHTTPServer(path, metrics)
+    threading.Thread(target=server.serve_forever, daemon=True).start()
+    return server
+
+def report(metrics, interval, stop, file=sys.stderr):
+    """Print `metrics` progress to `file` every `interval` seconds.
+
+    Stop reporting when threading.Event `stop` is set.
+    """
+    def loop():
+        while not stop.wait(interval):
+            print(metrics.progress(), file=file, flush=True)
+    threading.Thread(target=loop, daemon=True).start()
@@ -4,18 +4,58 @@
 
 import json
 from argparse import ArgumentParser
+from contextlib import (ExitStack, closing)
+from fnmatch import fnmatchcase
+from functools import lru_cache
+from itertools import chain
 import sys
 import os
+import select
 import subprocess
-from datetime import (datetime, timezone)
+import threading
+from time import monotonic
 
-from .common import (open_input, print_line)
+from .artifacts import (ArtifactStore, Manifest)
+from .common import ( # pylint: disable=unused-import
+    OutputSink, open_input, open_output, timenow, timestamp, timevalue,
+)
+from .schedule import (
+    AdaptiveLimit, Job, Resources, RetryPolicy, Scheduler, StopPolicy,
+)
+from .selection import (Selection, failed_ids, parse_ranges)
 from .source import (Source, sequence)
+from .trace import (NullTracer, Tracer)
 from .uri import UriBuilder
 
-def drive(test, *test_args):
+@lru_cache(maxsize=None)
+def environment(keep=None, overrides=frozenset()):
+    """Return the environment for a subprocess, or None to inherit os.environ.
+
+    `keep` is a tuple of glob patterns matching the names of variables to keep
+    from os.environ, or None to keep all; `overrides` is a frozenset of (name,
+    value) pairs overriding variables kept. The environment for each distinct
+    (`keep`, `overrides`) is computed once: os.environ must not change while
+    tests are run.
+    """
+    if keep is None and not overrides:
+        return None
+    if keep is None:
+        env = dict(os.environ)
+    else:
+        env = {
+            name: value for (name, value) in os.environ.items()
+            if any(fnmatchcase(name, pattern) for pattern in keep)
+        }
+    env.update(overrides)
+    return env
+
+def drive(test, *test_args, env=None, cwd=None, close_fds=True):
     """Execute `test` and return a result dict.
 
+    `test` is executed with environment `env`, if supplied, else os.environ;
+    in working directory `cwd`, if supplied; and with file descriptors other
+    than stdin, stdout and stderr closed if `close_fds` is True.
+
     If `test` exits with error or outputs to stderr, then the result dict
     will contain string 'error' at key 'result' and a string at key 'reason'.
 
@@ -29,7 +69,9 @@ def drive(test, *test_args):
         (test,) + test_args,
         capture_output=True,
         check=False,
-        env=os.environ,
+        env=env,
+        cwd=cwd,
+        close_fds=close_fds,
     )
     if not subp.returncode and not subp.stderr:
         dct = json.loads(subp.stdout)
@@ -42,9 +84,11 @@ def drive(test, *test_args):
     dct['argv'] = test_args
     return dct
 
-def plot(plotter, prefix, *test_args):
+def plot(plotter, prefix, *test_args, env=None, cwd=None, close_fds=True):
     """Execute `plotter` and return a sequence of images output.
 
+    `env`, `cwd` and `close_fds` are as per drive().
+
     If `plotter` exits with error or outputs to stderr, then raise RuntimeError.
 
     Otherwise the sequence of images output contains whatever `plotter` outputs
@@ -58,7 +102,9 @@ def plot(plotter, prefix, *test_args):
         (plotter, prefix) + test_args,
         capture_output=True,
         check=False,
-        env=os.environ,
+        env=env,
+        cwd=cwd,
+        close_fds=close_fds,
     )
     if not subp.returncode and not subp.stderr:
         return json.loads(subp.stdout)
@@ -67,20 +113,399 @@ def plot(plotter, prefix, *test_args):
     reason += subp.stderr.decode()
     raise RuntimeError(reason)
 
-def timenow():
-    """Return a datetime value for UTC time now."""
-    return datetime.now(timezone.utc)
+class BatchPlotter:
+    """Plotters run in batch mode, each started once to plot many test cases.
 
-def timestamp(dtv):
-    """Return an ISO 8601 string for datetime value `dtv`."""
-    return datetime.isoformat(dtv)
+    A plotter supporting batch mode is executed with the single arg '--batch'.
+    It must first output the line '{"batch": 1}' to stdout. Then, for each line
+    input on stdin, a JSON object with pairs for 'prefix' and 'argv' (as per the
+    args to plot()), it must output one line to stdout: either a JSON array, as
+    per plot(), or a JSON object with a string reason at 'error'. The plotter
+    must exit when stdin is closed. Output to stderr is not captured.
 
-def timevalue(string):
-    """Return a datetime value for ISO 8601 `string`."""
-    return datetime.fromisoformat(string)
+    A process is started for each plotter (and environment, working directory
+    and `close_fds`) when there is no idle process to plot with, so concurrent
+    test cases each have a process. A plotter which does not output the first
+    line within `timeout` seconds is killed, then executed per test case, using
+    plot(): so a plotter which waits for input is not mistaken for a plotter in
+    batch mode.
+    """
+    HELLO = {'batch': 1}
+    def __init__(self, timeout=10.0):
+        self._timeout = timeout
+        self._lock = threading.Lock()
+        # map of key to list of idle processes
+        self._idle = {}
+        self._procs = set()
+        self._unsupported = set()
+    @staticmethod
+    def _stop(proc, kill=False):
+        """Close stdin of plotter process `proc` and wait for it to exit.
 
-def main():
-    """Run tests"""
+        If `kill` then kill `proc` first, else only if it does not exit.
+        """
+        if kill:
+            proc.kill()
+        try:
+            proc.stdin.close()
+        except BrokenPipeError:
+            pass
+        try:
+            proc.wait(10)
+        except subprocess.TimeoutExpired:
+            proc.kill()
+            proc.wait()
+        proc.stdout.close()
+    def _hello(self, proc):
+        """Return the first line output by plotter process `proc`.
+
+        Return None if no complete line is output within the timeout. Bytes are
+        read unbuffered, so that no output after the first line is consumed.
+        """
+        deadline = monotonic() + self._timeout
+        fileno = proc.stdout.fileno()
+        data = b''
+        while not data.endswith(b'\n'):
+            remaining = deadline - monotonic()
+            if remaining <= 0 or not select.select(
+                    (fileno,), (), (), remaining,
+                )[0]:
+                return None
+            byte = os.read(fileno, 1)
+            if not byte:
+                break
+            data += byte
+        return data.decode(errors='replace')
+    def _acquire(self, key):
+        """Return an idle process for `key`, a new process or None."""
+        with self._lock:
+            if key in self._unsupported:
+                return None
+            idle = self._idle.get(key)
+            if idle:
+                return idle.pop()
+        (plotter, env, cwd, close_fds) = key
+        proc = subprocess.Popen(
+            (plotter, '--batch'),
+            stdin=subprocess.PIPE,
+            stdout=subprocess.PIPE,
+            env=None if env is None else dict(env),
+            cwd=cwd,
+            close_fds=close_fds,
+            text=True,
+        )
+        line = self._hello(proc)
+        try:
+            hello = None if line is None else json.loads(line)
+        except ValueError:
+            hello = None
+        if hello != self.HELLO:
+            self._stop(proc, kill=True)
+            with self._lock:
+                self._unsupported.add(key)
+            return None
+        with self._lock:
+            self._procs.add(proc)
+        return proc
+    def __call__(
+            self, plotter, prefix, *test_args,
+            env=None, cwd=None, close_fds=True,
+        ):
+        """Plot as per plot(), using a plotter process in batch mode."""
+        key = (
+            plotter, None if env is None else frozenset(env.items()),
+            cwd, close_fds,
+        )
+        proc = self._acquire(key)
+        if proc is None:
+            return plot(
+                plotter, prefix, *test_args,
+                env=env, cwd=cwd, close_fds=close_fds,
+            )
+        try:
+            proc.stdin.write(
+                json.dumps({'prefix': prefix, 'argv': test_args}) + '\n',
+            )
+            proc.stdin.flush()
+            line = proc.stdout.readline()
+        except BrokenPipeError:
+            line = ''
+        if not line:
+            with self._lock:
+                self._procs.discard(proc)
+            self._stop(proc)
+            raise RuntimeError(f'{plotter} exited with code {proc.returncode}')
+        with self._lock:
+            self._idle.setdefault(key, []).append(proc)
+        obj = json.loads(line)
+        if isinstance(obj, dict):
+            raise RuntimeError(f"{plotter} failed:\n\n{obj.get('error')}")
+        return obj
+    def close(self):
+        """Stop all plotter processes."""
+        with self._lock:
+            (procs, self._procs, self._idle) = (self._procs, set(), {})
+        for proc in procs:
+            self._stop(proc)
+
+def store_plot(manifest, item):
+    """Return plot `item` with its image file moved into artifact `manifest`.
+
+    `item` is an item in the sequence of images output by plot().
+    """
+    if isinstance(item, str):
+        return manifest.put(item, remove=True)
+    return {**item, 'path': manifest.put(item['path'], remove=True)}
+
+def run_case(
+        tracer, builder, basedir, imagedir, plotter,
+        test, *test_args,
+        env=None, cwd=None, close_fds=True, manifest=None, batch=None,
+    ): # pylint: disable=too-many-arguments,too-many-locals
+    """Run `test` with `test_args` and return a result dict.
+
+    `tracer` records spans of execution, per testdrive.trace;
+    `builder` builds the test id from the directory of `test`;
+    `basedir` is the base directory which `test` is relative to;
+    `imagedir` is the directory to generate plot images in, if any;
+    `plotter` is the name of the plotter colocated with `test`;
+    `env` and `close_fds` are as per drive();
+    `cwd` is the working directory, relative to `basedir`, if any;
+    `manifest` is the artifact manifest to move plot images into, if any;
+    `batch` is the BatchPlotter to plot with, if any, else plot() is used.
+    """
+    with tracer.span('build'):
+        id_ = builder.build(os.path.dirname(test))
+    testimpl = os.path.join(basedir, test)
+    if cwd is not None:
+        # paths must not be relative to the working directory of the test
+        (basedir, testimpl) = map(os.path.abspath, (basedir, testimpl))
+        imagedir = imagedir and os.path.abspath(imagedir)
+        cwd = os.path.join(basedir, cwd)
+    kwargs = {'env': env, 'cwd': cwd, 'close_fds': close_fds}
+    start = timenow()
+    with tracer.span('drive'):
+        result = drive(testimpl, *test_args, **kwargs)
+    end = timenow()
+    result['id'] = id_
+    if 'timestamp' not in result:
+        result['timestamp'] = timestamp(start)
+        result['duration'] = (end - start).total_seconds()
+    if result['result'] in (True, False) and imagedir:
+        plotter = os.path.join(os.path.dirname(testimpl), plotter)
+        if os.path.isfile(plotter):
+            prefix = os.path.join(
+                imagedir,
+                os.path.splitext(test)[0].strip('/').replace('/', '_'),
+            )
+            with tracer.span('plot'):
+                result['plot'] = (batch or plot)(
+                    plotter, prefix, *test_args, **kwargs,
+                )
+            if manifest:
+                with tracer.span('store'):
+                    result['plot'] = [
+                        store_plot(manifest, item) for item in result['plot']
+                    ]
+    return result
+
+def skip_case(builder, job, reason, result='skipped'):
+    """Return a result dict for `job` which was not run for `reason`.
+
+    `builder` builds the test id from the directory of the job test; `result`
+    is the test result, 'skipped' or 'error'.
+    """
+    return {
+        'result': result,
+        'reason': reason,
+        'argv': job.argv,
+        'id': builder.build(os.path.dirname(job.test)),
+    }
+
+def read_job(spec, policy, resources):
+    """Return a Job for test `spec`, retried per `policy`.
+
+    If `spec` is invalid, per Job.from_spec(), or requires more units of a
+    resource than it has in Resources `resources`, then return a job with no
+    retries or resources and a string reason at `error`, which is not run. The
+    job has the test and args in `spec`, as far as they are valid.
+    """
+    try:
+        job = Job.from_spec(spec, policy)
+        resources.check(job)
+    except ValueError as exc:
+        (test, argv) = ('', [])
+        if isinstance(spec, dict):
+            (test, argv) = (spec.get('test', test), spec.get('argv', argv))
+        elif isinstance(spec, list) and spec:
+            (test, *argv) = spec
+        job = Job(
+            test if isinstance(test, str) else '',
+            argv if isinstance(argv, list) else (),
+        )
+        job.error = str(exc)
+    return job
+
+def read_jobs(args, fid, builder, resources):
+    """Return an iterator of Job for tests in `fid`, per read_job().
+
+    Tests are selected and retried as requested in `args`; `builder` builds
+    test ids for selection; `resources` is as per read_job().
+    """
+    selected = selection(args, builder)
+    policy = RetryPolicy(args.retry_attempts, args.retry_on, args.retry_backoff)
+    lines = selected.lines(args.input, fid) if selected else fid
+    return (read_job(json.loads(line), policy, resources) for line in lines)
+
+def stop_server(server, path=None):
+    """Stop metrics `server`, removing its Unix socket `path`, if any."""
+    server.shutdown()
+    server.server_close()
+    if path:
+        os.unlink(path)
+
+def start_metrics(args, builder, jobs, scheduler, stack):
+    """Return Metrics for live metrics of running `jobs` with `scheduler`.
+
+    Serve metrics and report progress as requested in `args`, until exit from
+    ExitStack `stack`.
+    """
+    # only import metrics dependencies when metrics are requested
+    # pylint: disable=import-outside-toplevel
+    from .history import History
+    from .metrics import (Metrics, report, serve)
+    test_ids = tuple(
+        builder.build(os.path.dirname(job.test)) for job in jobs
+    )
+    expected = None
+    if args.metrics_history:
+        with closing(History(args.metrics_history)) as history:
+            expected = {
+                dct['test_id']: dct['p50']
+                for dct in history.durations(set(test_ids), (50,))
+            }
+    metrics = Metrics(test_ids, expected, jobs=lambda: scheduler.limit)
+    if args.metrics_port:
+        stack.callback(stop_server, serve(metrics, port=args.metrics_port))
+    elif args.metrics_socket:
+        server = serve(metrics, path=args.metrics_socket)
+        stack.callback(stop_server, server, args.metrics_socket)
+    if args.progress:
+        stop = threading.Event()
+        stack.callback(stop.set)
+        report(metrics, args.progress, stop)
+    return metrics
+
+def start_adaptive(args, stack):
+    """Return an AdaptiveLimit per `args`, or None if not adaptive.
+
+    The adaptive log file, if any, is closed on exit from ExitStack `stack`.
+    """
+    if not args.adaptive:
+        return None
+    log = sys.stderr
+    if args.adaptive_log:
+        # pylint: disable-next=consider-using-with
+        log = open(args.adaptive_log, 'a', encoding='utf-8')
+        stack.enter_context(log)
+    return AdaptiveLimit(
+        args.min_jobs, args.jobs,
+        args.adaptive_interval, args.max_load, args.max_pressure,
+        log=log,
+    )
+
+def start_attempt(args, stack, tracer, builder):
+    """Return a function running an attempt of a Job, per `args`.
+
+    The function returns the result dict for the attempt, per run_case(), or
+    an error result for a job with an error, per read_job(). The artifact store
+    and batch plotter are used as requested in `args`: the artifact manifest is
+    saved and plotter processes are stopped on exit from ExitStack `stack`.
+    `tracer` and `builder` are as per run_case().
+    """
+    basedir = args.basedir or os.path.dirname(args.input)
+    keep = tuple(args.env_keep) if args.env_keep is not None else None
+    (manifest, imagedir) = (None, args.imagedir)
+    if args.artifact_store:
+        store = ArtifactStore(args.artifact_store)
+        name = args.artifact_manifest or f'{timenow():%Y%m%dT%H%M%S%f}'
+        manifest = stack.enter_context(closing(Manifest(store, name)))
+        imagedir = imagedir or store.tmpdir
+    batch = None
+    if args.batch_plotter:
+        batch = stack.enter_context(closing(BatchPlotter()))
+    def attempt(job):
+        if job.error:
+            return skip_case(builder, job, job.error, 'error')
+        with tracer.span('case', test=job.test):
+            return run_case(
+                tracer, builder, basedir, imagedir,
+                args.plotter, job.test, *job.argv,
+                env=environment(keep, job.env),
+                cwd=job.cwd,
+                close_fds=not args.fast_spawn,
+                manifest=manifest,
+                batch=batch,
+            )
+    return attempt
+
+def run_jobs(scheduler, jobs, stop_policy, builder):
+    """Generate a result dict for each of `jobs`, run with `scheduler`.
+
+    Results are generated in order of completion. Once `stop_policy` gives a
+    reason to stop the run, no more jobs are started: jobs not run are then
+    generated with result 'skipped' for that reason, per skip_case().
+    `builder` builds the test ids of jobs not run.
+    """
+    jobs = iter(jobs)
+    reason = None
+    for job in scheduler.run(jobs):
+        result = job.result()
+        yield result
+        stop_policy.record(result)
+        if reason is None:
+            reason = stop_policy.reason()
+            if reason is not None:
+                print(reason, file=sys.stderr)
+                scheduler.stop()
+    for job in chain(scheduler.unstarted(), jobs):
+        yield skip_case(builder, job, reason)
+
+def finish_trace(tracer, args):
+    """Write trace events and summary from `tracer` as requested in `args`."""
+    if args.trace:
+        tracer.write_events(args.trace)
+    if args.trace_summary:
+        for dct in tracer.summary():
+            print(json.dumps(dct), file=sys.stderr)
+
+def read_patterns(filename):
+    """Return a list of patterns from `filename`, one per line.
+
+    Blank lines and lines starting '#' are ignored.
+    """
+    with open_input(filename) as fid:
+        return [
+            line.strip() for line in fid
+            if line.strip() and not line.lstrip().startswith('#')
+        ]
+
+def selection(args, builder):
+    """Return a Selection for the selection options in `args`, or None."""
+    include = list(args.include or ())
+    exclude = list(args.exclude or ())
+    for filename in args.include_from or ():
+        include += read_patterns(filename)
+    for filename in args.exclude_from or ():
+        exclude += read_patterns(filename)
+    ranges = args.lines or ()
+    ids = failed_ids(args.failed_from) if args.failed_from else None
+    if not (include or exclude or ranges or args.failed_from):
+        return None
+    return Selection(include, exclude, ranges, ids, builder)
+
+def argument_parser():
+    """Return the ArgumentParser for main()."""
     aparser = ArgumentParser(description=main.__doc__)
     aparser.add_argument(
         '--basedir',
@@ -93,7 +518,8 @@ def main():
         '--imagedir',
         help=' '.join((
             "The directory which plot image files are to be generated in.",
-            "If not supplied then no plots are generated.",
+            "If not supplied then no plots are generated, unless",
+            "`--artifact-store` is supplied.",
         )),
     )
     aparser.add_argument(
@@ -106,6 +532,262 @@ def main():
             "Ignored if plots are not generated.",
         )),
     )
+    aparser.add_argument(
+        '--batch-plotter', action='store_true',
+        help=' '.join((
+            "Start each plotter once, in batch mode, to plot many test cases.",
+            "Plotters which do not support batch mode, per",
+            "testdrive.run.BatchPlotter, are called for each test case.",
+        )),
+    )
+    aparser.add_argument(
+        '--trace',
+        help=' '.join((
+            "Write Chrome trace events JSON for spans of execution of",
+            "test cases, tests, plotters, building ids, JSON encoding and",
+            "printing results to this file.",
+        )),
+    )
+    aparser.add_argument(
+        '--trace-summary', action='store_true',
+        help=' '.join((
+            "Print a JSON object to stderr summarizing execution time in",
+            "each phase of running tests, including runner overhead.",
+        )),
+    )
+    aparser.add_argument(
+        '--metrics-port', type=int,
+        help=' '.join((
+            "Serve live metrics for the run in Prometheus text format over",
+            "HTTP on localhost at this port.",
+        )),
+    )
+    aparser.add_argument(
+        '--metrics-socket',
+        help=' '.join((
+            "Serve live metrics for the run in Prometheus text format over",
+            "HTTP on a Unix socket at this path.",
+            "Ignored if `--metrics-port` is supplied.",
+        )),
+    )
+    aparser.add_argument(
+        '--progress', type=float,
+        help="Print a line of progress to stderr every this many seconds.",
+    )
+    aparser.add_argument(
+        '--metrics-history',
+        help=' '.join((
+            "A test result history database, per testdrive.history, from",
+            "which to estimate time to completion.",
+            "If not supplied then the time to completion is estimated from",
+            "durations of test cases in this run.",
+        )),
+    )
+    aparser.add_argument(
+        '--output', default='-',
+        help=' '.join((
+            "Write test results to this file instead of stdout.",
+            "If the filename ends '.gz', '.xz', '.bz2' or '.zst' then",
+            "results are compressed.",
+        )),
+    )
+    aparser.add_argument(
+        '--flush-lines', type=int, default=1,
+        help=' '.join((
+            "Write and flush test results in batches of this many lines.",
+            "By default each test result is written and flushed immediately.",
+        )),
+    )
+    aparser.add_argument(
+        '--flush-interval', type=float,
+        help=' '.join((
+            "Write and flush a batch of test results at most this many",
+            "milliseconds after the first test result in the batch.",
+        )),
+    )
+    aparser.add_argument(
+        '--jobs', type=int,
+        help=' '.join((
+            "Run up to this many tests concurrently.",
+            "Test results are output in order of completion.",
+            "If not supplied then 1, or the number of CPUs if `--adaptive`.",
+        )),
+    )
+    aparser.add_argument(
+        '--adaptive', action='store_true',
+        help=' '.join((
+            "Adapt the number of tests run concurrently to system load,",
+            "between `--min-jobs` and `--jobs`: halve it when the host is",
+            "overloaded, else increase it by one while tests are waiting.",
+        )),
+    )
+    aparser.add_argument(
+        '--min-jobs', type=int, default=1,
+        help="The minimum number of tests run concurrently, if adaptive.",
+    )
+    aparser.add_argument(
+        '--max-load', type=float, default=1.0,
+        help=' '.join((
+            "The 1 minute load average per CPU above which the host is",
+            "overloaded, if adaptive.",
+        )),
+    )
+    aparser.add_argument(
+        '--max-pressure', type=float, default=10.0,
+        help=' '.join((
+            "The percentage of time stalled, per /proc/pressure (cpu and",
+            "memory 'some', io 'full', over 10 seconds), above which the host",
+            "is overloaded, if adaptive.",
+        )),
+    )
+    aparser.add_argument(
+        '--adaptive-interval', type=float, default=2.0,
+        help=' '.join((
+            "The minimum number of seconds between adjustments of the",
+            "number of tests run concurrently, if adaptive.",
+        )),
+    )
+    aparser.add_argument(
+        '--adaptive-log',
+        help=' '.join((
+            "Append a JSON object for each adjustment of the number of tests",
+            "run concurrently to this file instead of stderr, if adaptive.",
+        )),
+    )
+    aparser.add_argument(
+        '--resource', action='append', type=Resources.parse, default=[],
+        metavar='NAME=CAPACITY',
+        help=' '.join((
+            "The capacity of resource NAME: the number of units of NAME which",
+            "tests running concurrently can hold at once.",
+            "A test specified as a JSON object can require resources at key",
+            "'resources', as a list of names (requiring one unit of each) or",
+            "an object mapping each name to the number of units required or",
+            "'exclusive'.",
+            "A resource without a capacity has capacity 1.",
+        )),
+    )
+    aparser.add_argument(
+        '--retry-attempts', type=int, default=1,
+        help=' '.join((
+            "The maximum number of attempts to run each test.",
+            "If more than one, the result of each attempt is recorded in a",
+            "list at key 'attempts' in the test result.",
+        )),
+    )
+    aparser.add_argument(
+        '--retry-on', choices=RetryPolicy.ON, default='error',
+        help=' '.join((
+            "Retry tests which produce no result ('error'), or which also",
+            "fail ('failure').",
+        )),
+    )
+    aparser.add_argument(
+        '--retry-backoff', type=float, default=0.0,
+        help=' '.join((
+            "The number of seconds to wait before the first retry of a test,",
+            "doubling for each subsequent retry.",
+            "Other tests are run while waiting.",
+        )),
+    )
+    aparser.add_argument(
+        '--max-consecutive-errors', type=int,
+        help=' '.join((
+            "Stop the run after this many consecutive tests produce no result.",
+            "Tests not run are output with result 'skipped'.",
+        )),
+    )
+    aparser.add_argument(
+        '--max-failure-ratio', type=float,
+        help=' '.join((
+            "Stop the run when the ratio of tests which did not succeed",
+            "exceeds this value, once `--min-tests` tests have completed.",
+            "Tests not run are output with result 'skipped'.",
+        )),
+    )
+    aparser.add_argument(
+        '--min-tests', type=int, default=10,
+        help="The minimum number of tests for `--max-failure-ratio`.",
+    )
+    aparser.add_argument(
+        '--budget', type=float,
+        help=' '.join((
+            "Stop starting tests when this number of seconds has elapsed.",
+            "Tests not run are output with result 'skipped'.",
+        )),
+    )
+    aparser.add_argument(
+        '--include', action='append',
+        help=' '.join((
+            "Run only tests whose test implementation matches this pattern.",
+            "A pattern is a glob pattern or, if prefixed 're:', a regular",
+            "expression to search for. May be supplied more than once.",
+        )),
+    )
+    aparser.add_argument(
+        '--exclude', action='append',
+        help=' '.join((
+            "Do not run tests whose test implementation matches this pattern,",
+            "as per `--include`. May be supplied more than once.",
+        )),
+    )
+    aparser.add_argument(
+        '--include-from', action='append',
+        help="Read `--include` patterns from this file, one per line.",
+    )
+    aparser.add_argument(
+        '--exclude-from', action='append',
+        help="Read `--exclude` patterns from this file, one per line.",
+    )
+    aparser.add_argument(
+        '--failed-from',
+        help=' '.join((
+            "Run only tests whose test id did not succeed in this file of",
+            "test results, as previously output.",
+        )),
+    )
+    aparser.add_argument(
+        '--lines', type=parse_ranges,
+        help=' '.join((
+            "Run only tests on these lines of `input`: a comma-separated list",
+            "of line numbers, counting all lines from 1, or inclusive ranges",
+            "'M-N', where M or N may be omitted.",
+        )),
+    )
+    aparser.add_argument(
+        '--artifact-store',
+        help=' '.join((
+            "Move plot image files into this content-addressed artifact store,",
+            "per testdrive.artifacts, so that identical images are stored",
+            "once. Test results reference images in the store.",
+            "If `--imagedir` is not supplied then images are generated in the",
+            "store tmp directory.",
+        )),
+    )
+    aparser.add_argument(
+        '--artifact-manifest',
+        help=' '.join((
+            "The name of the artifact store manifest recording images",
+            "referenced by this run. If not supplied then the name is the",
+            "time the run started.",
+        )),
+    )
+    aparser.add_argument(
+        '--env-keep', action='append',
+        help=' '.join((
+            "Run tests with only those environment variables whose names",
+            "match this glob pattern, plus any set for the test.",
+            "May be supplied more than once.",
+            "If not supplied then tests inherit the whole environment.",
+        )),
+    )
+    aparser.add_argument(
+        '--fast-spawn', action='store_true',
+        help=' '.join((
+            "Do not close inherited file descriptors when starting tests,",
+            "allowing a faster way of starting processes to be used.",
+        )),
+    )
     aparser.add_argument(
         'baseurl',
         help="The base URL which test ids are relative to.",
@@ -113,39 +795,77 @@ def main():
     aparser.add_argument(
         'input',
         help=' '.join((
-            "File containing tests to run or '-' to read from stdin.",
+            "File containing tests to run, which may be compressed,",
+            "or '-' to read from stdin.",
             "Each test is specified on a separate line as a JSON array.",
             "The first element is the name of the test implementation,",
             "relative to `--basedir`.",
             "The remaining elements are args to the test implementation.",
+            "Alternatively, a test can be specified as a JSON object with",
+            "the name of the test implementation at 'test', an array of args",
+            "at 'argv' and an object overriding retry options at 'retry',",
+            "with 'attempts', 'on' and 'backoff' values, an object of",
+            "environment variables to set at 'env', a working directory,",
+            "relative to `--basedir`, at 'cwd' and the resources required",
+            "at 'resources' (see `--resource`).",
+            "If tests are selected and `input` is an uncompressed file, then",
+            "an index of `input` is saved in `input`.idx and used to read",
+            "only the lines selected.",
         )),
     )
-    args = aparser.parse_args()
-    basedir = args.basedir or os.path.dirname(args.input)
+    return aparser
+
+def run(args):
+    """Run tests as requested in parsed command line `args`."""
     builder = UriBuilder(args.baseurl)
-    with open_input(args.input) as fid:
-        source = Source(sequence(json.loads(line) for line in fid))
-        for test, *test_args in source.next():
-            id_ = builder.build(os.path.dirname(test))
-            testimpl = os.path.join(basedir, test)
-            start = timenow()
-            result = drive(testimpl, *test_args)
-            end = timenow()
-            result['id'] = id_
-            if 'timestamp' not in result:
-                result['timestamp'] = timestamp(start)
-                result['duration'] = (end - start).total_seconds()
-            if result['result'] in (True, False) and args.imagedir:
-                plotter = os.path.join(os.path.dirname(testimpl), args.plotter)
-                if os.path.isfile(plotter):
-                    prefix = os.path.join(
-                        args.imagedir,
-                        os.path.splitext(test)[0].strip('/').replace('/', '_'),
-                    )
-                    result['plot'] = plot(plotter, prefix, *test_args)
-            # Python exits with error code 1 on EPIPE
-            if not print_line(json.dumps(result)):
-                sys.exit(1)
+    tracer = Tracer() if args.trace or args.trace_summary else NullTracer()
+    resources = Resources(dict(args.resource))
+    stop_policy = StopPolicy(
+        args.max_consecutive_errors,
+        args.max_failure_ratio, args.min_tests,
+        args.budget,
+    )
+    with ExitStack() as stack:
+        # write the trace last, once all else is done
+        stack.callback(finish_trace, tracer, args)
+        scheduler = Scheduler(
+            start_attempt(args, stack, tracer, builder),
+            args.jobs, resources, adaptive=start_adaptive(args, stack),
+        )
+        fid = stack.enter_context(open_input(args.input))
+        fout = stack.enter_context(open_output(args.output))
+        jobs = read_jobs(args, fid, builder, resources)
+        metrics = None
+        if args.metrics_port or args.metrics_socket or args.progress:
+            # metrics require the total number of tests up front
+            jobs = tuple(jobs)
+            metrics = start_metrics(args, builder, jobs, scheduler, stack)
+        sink = stack.enter_context(OutputSink(
+            fout, args.flush_lines,
+            args.flush_interval / 1000 if args.flush_interval else None,
+        ))
+        source = Source(sequence(jobs))
+        for result in run_jobs(scheduler, source.next(), stop_policy, builder):
+            if metrics:
+                metrics.record(result)
+            with tracer.span('encode'):
+                line = json.dumps(result)
+            with tracer.span('write_line'):
+                if not sink.write_line(line):
+                    # Python exits with error code 1 on EPIPE
+                    sys.exit(1)
+
+def main():
+    """Run tests"""
+    aparser = argument_parser()
+    args = aparser.parse_args()
+    if args.jobs is None:
+        args.jobs = (os.cpu_count() or 1) if args.adaptive else 1
+    if args.jobs < 1:
+        aparser.error('--jobs must be at least 1')
+    if args.adaptive and not 1 <= args.min_jobs <= args.jobs:
+        aparser.error('--min-jobs must be between 1 and --jobs')
+    run(args)
 
 if __name__ == '__main__':
     main()
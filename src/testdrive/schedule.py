@@ -0,0 +1,584 @@
+### SPDX-License-Identifier: GPL-2.0-or-later
+
+"""Scheduling of tests to run"""
+
+from collections import deque
+from concurrent.futures import (ThreadPoolExecutor, wait, FIRST_COMPLETED)
+import heapq
+from itertools import count
+import json
+import os
+from time import (monotonic, sleep)
+
+from .common import (timenow, timestamp)
+
+def _is_number(value, types=(int, float)):
+    """Return True if `value` is an instance of `types`, and not a bool."""
+    return isinstance(value, types) and not isinstance(value, bool)
+
+class RetryPolicy:
+    """A policy for retrying a test.
+
+    `attempts` is the maximum number of attempts to run the test; `on` is
+    'error' to retry only a test which produced no result, or 'failure' to also
+    retry a test which failed; `backoff` is the delay in seconds before the
+    first retry, doubling for each subsequent retry.
+    """
+    ON = ('error', 'failure')
+    def __init__(self, attempts=1, on='error', backoff=0.0):
+        if not _is_number(attempts, int) or attempts < 1:
+            raise ValueError(f'bad retry attempts "{attempts}"')
+        if on not in self.ON:
+            raise ValueError(f'bad retry on "{on}"')
+        if not _is_number(backoff) or backoff < 0:
+            raise ValueError(f'bad retry backoff "{backoff}"')
+        self.attempts = attempts
+        self.on = on # pylint: disable=invalid-name
+        self.backoff = backoff
+    def retry(self, attempt, result):
+        """Return True if the test should be retried.
+
+        `attempt` is the number of attempts so far; `result` is the result dict
+        for the latest attempt.
+        """
+        if attempt >= self.attempts or result['result'] is True:
+            return False
+        return self.on == 'failure' or result['result'] == 'error'
+    def delay(self, attempt):
+        """Return the delay in seconds before retrying after `attempt`."""
+        return self.backoff * 2 ** (attempt - 1)
+    def override(self, dct):
+        """Return a new policy with values in `dct` overriding this policy.
+
+        Raise ValueError if `dct` is not a dict of values for this policy.
+        """
+        if not isinstance(dct, dict) or not set(dct) <= {
+                'attempts', 'on', 'backoff',
+            }:
+            raise ValueError(f'bad retry "{dct}"')
+        return RetryPolicy(**{
+            'attempts': self.attempts,
+            'on': self.on,
+            'backoff': self.backoff,
+            **dct,
+        })
+
+class StopPolicy:
+    """A policy for stopping a run of tests early.
+
+    Stop after `consecutive_errors` consecutive tests produce no result; or when
+    the ratio of tests which did not succeed exceeds `failure_ratio`, once at
+    least `min_tests` tests have completed; or when `budget` seconds have
+    elapsed since this policy was created. Each of these is optional.
+    """
+    def __init__(
+            self,
+            consecutive_errors=None,
+            failure_ratio=None, min_tests=10,
+            budget=None,
+        ):
+        self._consecutive_errors = consecutive_errors
+        self._failure_ratio = failure_ratio
+        self._min_tests = min_tests
+        self._deadline = None if budget is None else monotonic() + budget
+        self._budget = budget
+        self._errors = self._completed = self._unsuccessful = 0
+    def record(self, result):
+        """Record `result`, the result dict for a completed test."""
+        self._completed += 1
+        if result['result'] is not True:
+            self._unsuccessful += 1
+        if result['result'] == 'error':
+            self._errors += 1
+        else:
+            self._errors = 0
+    def reason(self):
+        """Return a string reason to stop the run, or None to continue."""
+        if self._consecutive_errors and (
+                self._errors >= self._consecutive_errors
+            ):
+            return f'stopped after {self._errors} consecutive errors'
+        if self._failure_ratio is not None and (
+                self._completed >= self._min_tests
+            ):
+            ratio = self._unsuccessful / self._completed
+            if ratio > self._failure_ratio:
+                return ' '.join((
+                    f'stopped after {self._unsuccessful} of {self._completed}',
+                    f'tests did not succeed (ratio {ratio:.3f} exceeds',
+                    f'{self._failure_ratio})',
+                ))
+        if self._deadline is not None and monotonic() >= self._deadline:
+            return f'stopped after time budget of {self._budget} s exhausted'
+        return None
+
+class Resources:
+    """Resources which jobs hold while they run, with `capacities`.
+
+    `capacities` is a dict mapping resource name to capacity, the number of
+    units of the resource which can be held at once: a resource not in
+    `capacities` has capacity 1, so it is held exclusively. A job holds all the
+    units of the resources it requires while it runs, or none of them.
+    """
+    def __init__(self, capacities=None):
+        self._capacities = dict(capacities or {})
+        for (name, capacity) in self._capacities.items():
+            if capacity < 1:
+                raise ValueError(f'bad capacity "{capacity}" of "{name}"')
+        self._held = {}
+    @staticmethod
+    def parse(value):
+        """Return (name, capacity) from string `value`, 'NAME=CAPACITY'."""
+        (name, capacity) = value.rsplit('=', 1)
+        capacity = int(capacity)
+        if capacity < 1:
+            raise ValueError(f'bad capacity "{capacity}" of "{name}"')
+        return (name, capacity)
+    def capacity(self, name):
+        """Return the capacity of resource `name`."""
+        return self._capacities.get(name, 1)
+    def check(self, job):
+        """Raise ValueError if `job` requires more units than a resource has.
+
+        A job which fails this check can never start, so it must be checked
+        before it is scheduled.
+        """
+        for (name, units) in job.resources:
+            capacity = self.capacity(name)
+            if units is not None and units > capacity:
+                raise ValueError(' '.join((
+                    f'bad units "{units}" of "{name}" for {job.test}:',
+                    f'capacity is {capacity}',
+                )))
+    def required(self, job):
+        """Generate (name, units) for each resource required by `job`."""
+        for (name, units) in job.resources:
+            yield (name, self.capacity(name) if units is None else units)
+    def available(self, job, reserved):
+        """Return True if resources required by `job` are available.
+
+        `reserved` is a dict mapping resource name to units reserved for jobs
+        waiting ahead of `job`, which `job` must not take.
+        """
+        return all(
+            self._held.get(name, 0) + reserved.get(name, 0) + units
+            <= self.capacity(name)
+            for (name, units) in self.required(job)
+        )
+    def reserve(self, job, reserved):
+        """Add units of resources required by `job` to `reserved`."""
+        for (name, units) in self.required(job):
+            reserved[name] = reserved.get(name, 0) + units
+    def acquire(self, job):
+        """Hold resources required by `job`."""
+        for (name, units) in self.required(job):
+            self._held[name] = self._held.get(name, 0) + units
+    def release(self, job):
+        """Stop holding resources required by `job`."""
+        for (name, units) in self.required(job):
+            self._held[name] -= units
+
+def read_pressure(resource, kind='some'):
+    """Return the pressure stall percentage for `resource` over 10 seconds.
+
+    `resource` is 'cpu', 'memory' or 'io'; `kind` is 'some' (some tasks
+    stalled) or 'full' (all tasks stalled). Return None if pressure stall
+    information is not available.
+    """
+    try:
+        with open(f'/proc/pressure/{resource}', encoding='utf-8') as fid:
+            for line in fid:
+                (name, *fields) = line.split()
+                if name == kind:
+                    return float(dict(
+                        field.split('=', 1) for field in fields
+                    )['avg10'])
+    except (OSError, KeyError, ValueError):
+        pass
+    return None
+
+def system_load():
+    """Return a dict of system load measurements.
+
+    The dict has the 1 minute load average per CPU at key 'load' and the
+    percentage of time stalled for each pressure stall reading at key
+    'pressure': 'some' tasks stalled for cpu and memory, and 'full' (all tasks
+    stalled) for io. Readings which are not available are omitted.
+    """
+    pressure = {}
+    for (resource, kind) in (
+            ('cpu', 'some'),
+            ('memory', 'some'),
+            ('io', 'full'),
+        ):
+        value = read_pressure(resource, kind)
+        if value is not None:
+            pressure[resource] = value
+    return {
+        'load': round(os.getloadavg()[0] / (os.cpu_count() or 1), 3),
+        'pressure': pressure,
+    }
+
+class AdaptiveLimit:
+    """An adaptive limit on the number of jobs run concurrently.
+
+    The limit is between `min_jobs` and `max_jobs`, starting at `min_jobs`. It
+    is adjusted at most every `interval` seconds, by additive increase and
+    multiplicative decrease. The limit is halved if the host is overloaded:
+    the load average per CPU exceeds `max_load`; or a pressure stall reading
+    exceeds `max_pressure` percent; or the completion rate of jobs at the
+    current limit is more than a tenth below the rate at a lower limit. The
+    limit is not halved again for `cooldown` seconds, while load averages catch
+    up. Otherwise, the limit is increased by one if it is reached by the jobs
+    running while more jobs are queued to start, so that the limit only grows
+    while there are jobs to run.
+
+    The completion rate at a limit is measured over the jobs completed since
+    the limit was set, once there are at least `samples` of them, so that it is
+    not dominated by noise in the completion times of a few jobs.
+
+    Each adjustment is written as a JSON object to file `log`, if supplied.
+    `measure` returns system load measurements, per system_load().
+    """
+    def __init__(
+            self, min_jobs=1, max_jobs=None,
+            interval=2.0, max_load=1.0, max_pressure=10.0, cooldown=10.0,
+            log=None, measure=system_load, samples=8,
+        ): # pylint: disable=too-many-arguments
+        max_jobs = max_jobs or os.cpu_count() or 1
+        if not 1 <= min_jobs <= max_jobs:
+            raise ValueError(f'bad jobs "{min_jobs}" to "{max_jobs}"')
+        self.min_jobs = min_jobs
+        self.max_jobs = max_jobs
+        self.interval = interval
+        self._max_load = max_load
+        self._max_pressure = max_pressure
+        self._cooldown = cooldown
+        self._log = log
+        self._measure = measure
+        self._samples = max(samples, 2)
+        self.limit = min_jobs
+        self._sampled = monotonic()
+        self._decreased = self._sampled - cooldown
+        # number, first and last completion time of jobs since the limit was
+        # last changed
+        (self._completed, self._first, self._last) = (0, None, None)
+        # completion rate measured at a lower limit, before it was increased
+        self._rate = None
+    def record(self):
+        """Record the completion of a job."""
+        self._last = monotonic()
+        if not self._completed:
+            self._first = self._last
+        self._completed += 1
+    def _measured(self):
+        """Return the completion rate since the limit was last changed.
+
+        Return None if fewer than `samples` jobs have completed since then.
+        """
+        if self._completed < self._samples:
+            return None
+        span = self._last - self._first
+        return (self._completed - 1) / span if span > 0 else None
+    def _overload(self, dct, rate):
+        """Return a string reason the host is overloaded, or None.
+
+        `dct` is system load measurements; `rate` is the completion rate at the
+        current limit, if measured.
+        """
+        if dct['load'] > self._max_load:
+            return 'load'
+        if any(val > self._max_pressure for val in dct['pressure'].values()):
+            return 'pressure'
+        if self._rate and rate is not None and rate < 0.9 * self._rate:
+            return 'throughput'
+        return None
+    def update(self, running, queued=True):
+        """Return the limit, adjusted if `interval` has elapsed.
+
+        `running` is the number of jobs running; `queued` is True if there are
+        jobs waiting to start.
+        """
+        now = monotonic()
+        if now - self._sampled < self.interval:
+            return self.limit
+        self._sampled = now
+        rate = self._measured()
+        dct = self._measure()
+        reason = self._overload(dct, rate)
+        limit = self.limit
+        if reason:
+            if now - self._decreased >= self._cooldown:
+                limit = max(self.min_jobs, limit // 2)
+        elif running >= limit and queued:
+            (limit, reason) = (min(self.max_jobs, limit + 1), 'headroom')
+        if limit != self.limit:
+            if limit < self.limit:
+                (self._decreased, self._rate) = (now, None)
+            elif rate is not None:
+                self._rate = rate
+            (self._completed, self._first, self._last) = (0, None, None)
+            if self._log:
+                print(json.dumps({
+                    'timestamp': timestamp(timenow()),
+                    'limit': limit,
+                    'previous': self.limit,
+                    'reason': reason,
+                    'running': running,
+                    'rate': None if rate is None else round(rate, 3),
+                    **dct,
+                }), file=self._log, flush=True)
+            self.limit = limit
+        return self.limit
+
+class Job:
+    """A test to run: `test` with args `argv`, retried per `policy`.
+
+    `env` is a dict of environment variables to set for the test, if any; `cwd`
+    is the working directory for the test, if any. The environment variables
+    are held in `env` as a frozenset of (name, value) pairs.
+
+    `resources` is the resources the test requires while it runs, if any: a
+    list of resource names, each requiring one unit of the resource, or a
+    dict mapping resource name to the number of units required, or 'exclusive'
+    for all units of the resource. The resources are held in `resources` as a
+    frozenset of (name, units) pairs, with units None for exclusive use.
+
+    The result dict for each attempt to run the test is appended to `attempts`.
+    If the test is not to be run, because its specification is invalid, then
+    `error` is a string reason, else None.
+    """
+    def __init__(
+            self, test, argv=(), policy=None, env=None, cwd=None,
+            resources=None,
+        ): # pylint: disable=too-many-arguments
+        self.test = test
+        self.argv = tuple(argv)
+        self.policy = policy or RetryPolicy()
+        self.env = frozenset((env or {}).items())
+        self.cwd = cwd
+        self.resources = frozenset(self._resources(resources))
+        self.attempts = []
+        self.error = None
+    @staticmethod
+    def _resources(resources):
+        """Generate (name, units) pairs for `resources`, per Job.
+
+        Raise ValueError if `resources` is not a list or a dict, per Job.
+        """
+        if resources is None:
+            return
+        if isinstance(resources, (list, tuple)):
+            resources = [(name, 1) for name in resources]
+        elif isinstance(resources, dict):
+            resources = resources.items()
+        else:
+            raise ValueError(f'bad resources "{resources}"')
+        for (name, units) in resources:
+            if not isinstance(name, str):
+                raise ValueError(f'bad resource "{name}"')
+            if units == 'exclusive':
+                units = None
+            elif not _is_number(units, int) or units < 1:
+                raise ValueError(f'bad units "{units}" of "{name}"')
+            yield (name, units)
+    @classmethod
+    def from_spec(cls, spec, policy=None):
+        """Return a new instance from test `spec`, retried per `policy`.
+
+        `spec` is either a sequence, the test followed by its args, or a dict
+        with the test at key 'test' and, optionally, a sequence of args at key
+        'argv', a dict of values overriding `policy` at key 'retry', a dict of
+        environment variables at key 'env', a working directory at key 'cwd'
+        and the resources required, per Job, at key 'resources'.
+
+        Raise ValueError if `spec` is not of this form.
+        """
+        policy = policy or RetryPolicy()
+        if isinstance(spec, dict):
+            retry = spec.get('retry')
+            if retry is not None:
+                policy = policy.override(retry)
+            (test, argv) = (spec.get('test'), spec.get('argv', []))
+            (env, cwd) = (spec.get('env'), spec.get('cwd'))
+            for (key, value, types) in (
+                    ('argv', argv, list),
+                    ('env', env, (dict, type(None))),
+                    ('cwd', cwd, (str, type(None))),
+                ):
+                if not isinstance(value, types):
+                    raise ValueError(f'bad {key} "{value}"')
+            resources = spec.get('resources')
+        elif isinstance(spec, list) and spec:
+            (test, *argv) = spec
+            (env, cwd, resources) = (None, None, None)
+        else:
+            raise ValueError(f'bad test spec "{spec}"')
+        if not isinstance(test, str):
+            raise ValueError(f'bad test "{test}"')
+        return cls(test, argv, policy, env, cwd, resources)
+    def result(self):
+        """Return the result dict for this job.
+
+        This is the result dict for the latest attempt. If the policy for this
+        job allows more than one attempt, then it includes a list of a dict for
+        each attempt at key 'attempts', giving the result, reason, timestamp
+        and duration of that attempt.
+        """
+        result = dict(self.attempts[-1])
+        if self.policy.attempts > 1:
+            result['attempts'] = [
+                {
+                    k: attempt.get(k)
+                    for k in ('result', 'reason', 'timestamp', 'duration')
+                }
+                for attempt in self.attempts
+            ]
+        return result
+
+class Scheduler:
+    """A scheduler running jobs with `func` in up to `jobs` threads.
+
+    `func` is called with a Job for each attempt to run it, and returns the
+    result dict for that attempt. A job to be retried is scheduled again after
+    the delay in its policy, while other jobs run.
+
+    Each job holds the resources it requires, from Resources `resources`,
+    while it runs. A job which cannot start, because resources it requires are
+    held, waits while up to `lookahead` waiting jobs are considered in order:
+    a later job starts if its resources are available and are not required by
+    an earlier waiting job (so that no job waits indefinitely).
+
+    If `adaptive` is supplied, then it is an AdaptiveLimit on the number of
+    jobs run concurrently, and `jobs` is its `max_jobs`.
+    """
+    def __init__(
+            self, func, jobs=1, resources=None, lookahead=64, adaptive=None,
+        ): # pylint: disable=too-many-arguments
+        self._func = func
+        self._jobs = adaptive.max_jobs if adaptive else jobs
+        self._adaptive = adaptive
+        self._resources = resources or Resources()
+        self._lookahead = lookahead
+        # heap of (due, seq, job) for jobs to be retried
+        self._retries = []
+        self._seq = count()
+        # jobs waiting for resources, in order
+        self._waiting = deque()
+        self._stopped = False
+    def stop(self):
+        """Stop starting jobs.
+
+        Jobs already running complete. Jobs waiting to be retried are not
+        retried: they are generated with the result of their latest attempt.
+        Jobs not yet taken from `jobs` passed to run() are left there; jobs
+        taken but not started are returned by unstarted().
+        """
+        self._stopped = True
+    @property
+    def limit(self):
+        """The current limit on the number of jobs run concurrently."""
+        return self._adaptive.limit if self._adaptive else self._jobs
+    def _limit(self, running, jobs):
+        """Return the limit on jobs run concurrently, with `running` jobs.
+
+        `jobs` is the iterator of jobs passed to run(): with an adaptive limit,
+        the next job is taken from it, to wait to start, if no other job is
+        waiting.
+        """
+        if self._adaptive:
+            return self._adaptive.update(running, self._queued(jobs))
+        return self._jobs
+    def _queued(self, jobs):
+        """Return True if there is a job waiting to start, from `jobs`."""
+        if self._stopped:
+            return False
+        if self._waiting or (
+                self._retries and self._retries[0][0] <= monotonic()
+            ):
+            return True
+        job = next(jobs, None)
+        if job is None:
+            return False
+        self._waiting.append(job)
+        return True
+    def unstarted(self):
+        """Return a list of jobs taken from `jobs` but never started."""
+        return [job for job in self._waiting if not job.attempts]
+    def _next(self, jobs):
+        """Return the next job to start from retries due or `jobs`, or None."""
+        if self._stopped:
+            return None
+        due = []
+        while self._retries and self._retries[0][0] <= monotonic():
+            due.append(heapq.heappop(self._retries)[2])
+        # retries due go ahead of other waiting jobs
+        self._waiting.extendleft(reversed(due))
+        reserved = {}
+        for (idx, job) in enumerate(self._waiting):
+            if self._resources.available(job, reserved):
+                del self._waiting[idx]
+                return job
+            self._resources.reserve(job, reserved)
+        while len(self._waiting) < self._lookahead:
+            job = next(jobs, None)
+            if job is None or self._resources.available(job, reserved):
+                return job
+            self._waiting.append(job)
+            self._resources.reserve(job, reserved)
+        return None
+    def run(self, jobs):
+        """Run `jobs`, generating each Job when its last attempt completes.
+
+        Jobs are taken from iterable `jobs` only when there is a thread to run
+        them, so `jobs` can be a stream. Jobs are generated in order of
+        completion.
+        """
+        jobs = iter(jobs)
+        running = {}
+        with ThreadPoolExecutor(self._jobs) as executor:
+            while True:
+                while len(running) < self._limit(len(running), jobs):
+                    job = self._next(jobs)
+                    if job is None:
+                        break
+                    self._resources.acquire(job)
+                    running[executor.submit(self._func, job)] = job
+                if not running and (self._stopped or not self._retries):
+                    # no jobs left in `jobs`, else one would be running
+                    while self._retries:
+                        yield heapq.heappop(self._retries)[2]
+                    for job in list(self._waiting):
+                        if job.attempts:
+                            self._waiting.remove(job)
+                            yield job
+                    return
+                timeout = None
+                if self._retries:
+                    timeout = max(self._retries[0][0] - monotonic(), 0)
+                if self._adaptive:
+                    # wake to adjust the limit while jobs run
+                    interval = self._adaptive.interval
+                    timeout = min(
+                        interval if timeout is None else timeout, interval,
+                    )
+                if not running:
+                    sleep(timeout)
+                    continue
+                (done, _) = wait(running, timeout, FIRST_COMPLETED)
+                for future in done:
+                    job = running.pop(future)
+                    self._resources.release(job)
+                    if self._adaptive:
+                        self._adaptive.record()
+                    job.attempts.append(future.result())
+                    attempt = len(job.attempts)
+                    if not self._stopped and job.policy.retry(
+                            attempt, job.attempts[-1],
+                        ):
+                        due = monotonic() + job.policy.delay(attempt)
+                        heapq.heappush(
+                            self._retries, (due, next(self._seq), job),
+                        )
+                    else:
+                        yield job
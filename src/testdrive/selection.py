@@ -0,0 +1,183 @@
+### SPDX-License-Identifier: GPL-2.0-or-later
+
+"""Selection of tests to run from a file of tests"""
+
+from fnmatch import fnmatchcase
+import json
+import os
+import re
+
+from .common import (compression, open_input)
+
+def spec_test(spec):
+    """Return the test implementation for test `spec`, per schedule.Job."""
+    return spec['test'] if isinstance(spec, dict) else spec[0]
+
+# version of the index file format, rebuilt when this changes
+INDEX_VERSION = 2
+
+class Index:
+    """An index of the offset and test implementation of each line in a file.
+
+    `filename` is the file of tests indexed; `entries` is a list of (number,
+    offset, test) for each non-blank line, where `number` counts all lines
+    from 1. An index is persisted in file `filename`.idx, which is rebuilt
+    whenever `filename` is modified.
+    """
+    def __init__(self, filename, entries):
+        self._filename = filename
+        self._entries = entries
+    @property
+    def entries(self):
+        """A list of (number, offset, test) for each non-blank line."""
+        return self._entries
+    @staticmethod
+    def _stamp(filename):
+        """Return a stamp which changes when `filename` is modified."""
+        stat = os.stat(filename)
+        return [INDEX_VERSION, stat.st_size, stat.st_mtime_ns]
+    @classmethod
+    def build(cls, filename):
+        """Return a new index for `filename`."""
+        entries = []
+        offset = 0
+        with open(filename, 'rb') as fid:
+            for (number, line) in enumerate(fid, 1):
+                if line.strip():
+                    entries.append(
+                        (number, offset, spec_test(json.loads(line))),
+                    )
+                offset += len(line)
+        return cls(filename, entries)
+    @classmethod
+    def load(cls, filename):
+        """Return the index for `filename`, built and saved if not current."""
+        stamp = cls._stamp(filename)
+        try:
+            with open(f'{filename}.idx', encoding='utf-8') as fid:
+                dct = json.load(fid)
+            if dct['stamp'] == stamp:
+                return cls(filename, [tuple(e) for e in dct['entries']])
+        except (OSError, ValueError, KeyError, TypeError):
+            pass
+        index = cls.build(filename)
+        index.save(stamp)
+        return index
+    def save(self, stamp):
+        """Save this index with `stamp`, if the index file is writable."""
+        tmpname = f'{self._filename}.idx.tmp'
+        try:
+            with open(tmpname, 'w', encoding='utf-8') as fid:
+                json.dump({'stamp': stamp, 'entries': self._entries}, fid)
+            os.replace(tmpname, f'{self._filename}.idx')
+        except OSError:
+            pass
+    def read(self, indexes):
+        """Generate the line at each of `indexes` into entries."""
+        with open(self._filename, 'rb') as fid:
+            for idx in indexes:
+                fid.seek(self._entries[idx][1])
+                yield fid.readline().decode()
+
+def _matcher(pattern):
+    """Return a function matching a test implementation with `pattern`.
+
+    `pattern` is a glob pattern or, if prefixed 're:', a regular expression
+    searched for in the test implementation.
+    """
+    if pattern.startswith('re:'):
+        regex = re.compile(pattern[3:])
+        return lambda test: regex.search(test) is not None
+    return lambda test: fnmatchcase(test, pattern)
+
+def parse_ranges(string):
+    """Return a list of (first, last) line ranges from `string`.
+
+    `string` is a comma-separated list of line numbers (from 1) or ranges of
+    line numbers, 'first-last' inclusive, where either may be omitted. Raise
+    ValueError if `string` is not of this form.
+    """
+    ranges = []
+    for item in string.split(','):
+        (first, sep, last) = item.partition('-')
+        if not item:
+            raise ValueError(f'bad line range "{item}"')
+        try:
+            first = int(first) if first else 1
+            last = first if not sep else int(last) if last else None
+        except ValueError:
+            raise ValueError(f'bad line range "{item}"') from None
+        if first < 1 or (last is not None and last < first):
+            raise ValueError(f'bad line range "{item}"')
+        ranges.append((first, last))
+    return ranges
+
+def failed_ids(filename):
+    """Return a set of ids of tests which did not succeed in `filename`.
+
+    `filename` is a file of JSON-lines test results, as output by testdrive.run.
+    """
+    with open_input(filename) as fid:
+        return {
+            dct['id']
+            for dct in (json.loads(line) for line in fid if line.strip())
+            if dct['result'] is not True
+        }
+
+class Selection:
+    """A selection of tests to run.
+
+    A test is selected if it is specified on a line in `ranges`, per
+    parse_ranges(), if any; and its implementation matches a pattern in
+    `include`, if any; and does not match any pattern in `exclude`; and its id
+    (built with `builder` from the directory of its implementation) is in
+    `ids`, if supplied. Patterns are as per _matcher(). Lines are numbered
+    from 1, counting blank lines.
+    """
+    def __init__(
+            self, include=(), exclude=(), ranges=(), ids=None, builder=None,
+        ): # pylint: disable=too-many-arguments
+        self._include = tuple(_matcher(p) for p in include)
+        self._exclude = tuple(_matcher(p) for p in exclude)
+        self._ranges = tuple(ranges)
+        self._ids = ids
+        self._builder = builder
+    def match(self, number, test):
+        """Return True if `test` on line `number` (from 1) is selected."""
+        if self._ranges and not any(
+                first <= number and (last is None or number <= last)
+                for (first, last) in self._ranges
+            ):
+            return False
+        if self._include and not any(m(test) for m in self._include):
+            return False
+        if any(m(test) for m in self._exclude):
+            return False
+        if self._ids is not None:
+            test_id = self._builder.build(os.path.dirname(test))
+            if test_id not in self._ids:
+                return False
+        return True
+    def lines(self, filename, fid):
+        """Generate each selected line of tests from `filename`.
+
+        `fid` is an open file for reading from `filename`. If `filename` is a
+        regular uncompressed file, then lines are selected using its Index and
+        only selected lines are read: otherwise each line is read from `fid`.
+        """
+        if filename != '-' and os.path.isfile(filename):
+            with open(filename, 'rb') as raw:
+                indexable = compression(filename, raw.read(8)) is None
+            if indexable:
+                index = Index.load(filename)
+                yield from index.read(
+                    idx
+                    for (idx, (number, _, test)) in enumerate(index.entries)
+                    if self.match(number, test)
+                )
+                return
+        for (number, line) in enumerate(fid, 1):
+            if line.strip() and self.match(
+                    number, spec_test(json.loads(line)),
+                ):
+                yield line
@@ -0,0 +1,113 @@
+### SPDX-License-Identifier: GPL-2.0-or-later
+
+"""Tracing of testdrive execution"""
+
+from contextlib import (contextmanager, nullcontext)
+import json
+import os
+import threading
+from time import perf_counter_ns
+
+class NullTracer:
+    """A tracer which records nothing, for use when tracing is not enabled."""
+    _NULL = nullcontext()
+    def span(self, name, **kwargs): # pylint: disable=unused-argument
+        """Return a context manager which does nothing."""
+        return self._NULL
+
+class Tracer:
+    """A tracer recording spans of execution time.
+
+    Spans can be exported as Chrome trace events (for viewing in a trace event
+    viewer, such as Perfetto UI or chrome://tracing) or summarized per phase,
+    where a phase is the set of spans with the same name.
+    """
+    def __init__(self):
+        self._pid = os.getpid()
+        self._origin = perf_counter_ns()
+        self._spans = []
+    @contextmanager
+    def span(self, name, **kwargs):
+        """Return a context manager recording a span of execution `name`.
+
+        `kwargs` are recorded as args for the span.
+        """
+        start = perf_counter_ns()
+        try:
+            yield
+        finally:
+            self._spans.append((
+                name, threading.get_ident(), start, perf_counter_ns(), kwargs,
+            ))
+    def events(self):
+        """Return a dict of Chrome trace events for spans recorded."""
+        return {
+            'displayTimeUnit': 'ms',
+            'traceEvents': [
+                {
+                    'name': name,
+                    'cat': 'testdrive',
+                    'ph': 'X',
+                    'ts': (start - self._origin) / 1000,
+                    'dur': (end - start) / 1000,
+                    'pid': self._pid,
+                    'tid': tid,
+                    'args': args,
+                }
+                for (name, tid, start, end, args) in self._spans
+            ],
+        }
+    def summary(self):
+        """Return a list of dict summarizing spans recorded per phase.
+
+        Each dict gives the phase name, the count of spans and the total, mean
+        and maximum span duration in seconds. The share of the total elapsed
+        time in each phase is also given. Spans in phase 'case', if any, are
+        each assumed to contain all other spans for a test case: the final
+        phase, 'runner', is the elapsed time not in any 'case' span: with
+        concurrent test cases, this is the time during which no case ran.
+        """
+        elapsed = perf_counter_ns() - self._origin
+        phases = {}
+        cases = []
+        for (name, _, start, end, _) in self._spans:
+            phases.setdefault(name, []).append(end - start)
+            if name == 'case':
+                cases.append((start, end))
+        dcts = []
+        for (name, durations) in phases.items():
+            total = sum(durations)
+            dcts.append({
+                'phase': name,
+                'count': len(durations),
+                'total': round(total / 1e9, 6),
+                'mean': round(total / len(durations) / 1e9, 6),
+                'max': round(max(durations) / 1e9, 6),
+                'share': round(total / elapsed, 6) if elapsed else None,
+            })
+        runner = elapsed - _union(cases)
+        dcts.append({
+            'phase': 'runner',
+            'count': 1,
+            'total': round(runner / 1e9, 6),
+            'mean': round(runner / 1e9, 6),
+            'max': round(runner / 1e9, 6),
+            'share': round(runner / elapsed, 6) if elapsed else None,
+        })
+        return dcts
+    def write_events(self, filename):
+        """Write Chrome trace events JSON for spans recorded to `filename`."""
+        with open(filename, 'w', encoding='utf-8') as fid:
+            json.dump(self.events(), fid)
+
+def _union(intervals):
+    """Return the total length of the union of (start, end) `intervals`."""
+    total = 0
+    last = None
+    for (start, end) in sorted(intervals):
+        if last is not None:
+            start = max(start, last)
+        if end > start:
+            total += end - start
+            last = end
+    return total
@@ -2,6 +2,7 @@
 
 """Test URIs"""
 
+from functools import lru_cache
 from urllib.parse import (
     urlsplit,
     urlunsplit,
@@ -9,8 +10,14 @@ from urllib.parse import (
     quote_plus,
 )
 
+# the maximum number of URIs memoised by each of build() and rebase()
+CACHE_SIZE = 65536
+
 class UriBuilder:
-    """A builder of URIs relative to a `base` absolute URI"""
+    """A builder of URIs relative to a `base` absolute URI
+
+    URIs built and rebased are memoised per instance, up to CACHE_SIZE of each.
+    """
     def __init__(self, base, **kwargs):
         (scheme, authority, path, query, fragment) = urlsplit(base)
         if not scheme or query or fragment or base.endswith('#'):
@@ -24,12 +31,15 @@ class UriBuilder:
         self._authority = authority
         self._head = head
         self._query = urlencode(kwargs, quote_via=quote_plus) if kwargs else None
-    def build(self, path):
+        # memoise per instance: caches are released with the instance
+        self.build = lru_cache(maxsize=CACHE_SIZE)(self._build)
+        self.rebase = lru_cache(maxsize=CACHE_SIZE)(self._rebase)
+    def _build(self, path):
         """Build a URI from `path` relative to this instance's base"""
         tail = path.split('/')
         if tail[0] == '':
             tail = tail[1:]
-        if tail[-1] == '':
+        if tail and tail[-1] == '':
             tail = tail[:-1]
         if not self._is_urn:
             tail.append('')
@@ -40,7 +50,10 @@ class UriBuilder:
             self._query,
             None, # never supply a fragment
         ))
-    def rebase(self, uri, base):
+    def build_many(self, paths):
+        """Return a list of URIs built from each of `paths`, per build()"""
+        return [self.build(path) for path in paths]
+    def _rebase(self, uri, base):
         """Return a URI from `uri` rebased under `base`, discarding query"""
         (scheme, authority, path, _, fragment) = urlsplit(uri)
         path = path.split(self._path_sep)
@@ -51,4 +64,12 @@ class UriBuilder:
                 uri.endswith('#')
             ):
             raise ValueError(f'cannot rebase {uri}')
-        return UriBuilder(base).build('/'.join(path[len(self._head):]))
+        return _target(base).build('/'.join(path[len(self._head):]))
+    def rebase_many(self, uris, base):
+        """Return a list of URIs from each of `uris` rebased, per rebase()"""
+        return [self.rebase(uri, base) for uri in uris]
+
+@lru_cache(maxsize=64)
+def _target(base):
+    """Return a UriBuilder for rebasing URIs under `base`."""
+    return UriBuilder(base)
@@ -0,0 +1,222 @@
+### SPDX-License-Identifier: GPL-2.0-or-later
+
+"""Build JUnit and asciidoc output continuously as test results stream in"""
+
+from argparse import ArgumentParser
+import json
+import os
+from time import (monotonic, sleep)
+
+from .asciidoc import (Config, TestCase, TestSuite, TestSuites, document)
+from .common import open_output
+from .junit.create import IncrementalJUnit
+
+class _CachedSuite(TestSuite):
+    """A test suite caching the asciidoc generated for each test case.
+
+    Asciidoc for a test case is generated (and any files it includes copied)
+    once only, however many times this test suite is presented.
+    """
+    def __init__(self, elem):
+        super().__init__(elem)
+        self._cache = {}
+    def _cached(self, func, case, objdir, config, level):
+        """Return a tuple of lines from `func`, generated at most once."""
+        key = (func.__name__, case.name, level)
+        try:
+            return self._cache[key]
+        except KeyError:
+            lines = self._cache[key] = tuple(func(case, objdir, config, level))
+            return lines
+    def case_results(self, case, objdir, config, level):
+        """Return asciidoc results for test `case` in this test suite."""
+        return self._cached(super().case_results, case, objdir, config, level)
+    def case_spec(self, case, objdir, config, level):
+        """Return asciidoc test spec for test `case` in this test suite."""
+        return self._cached(super().case_spec, case, objdir, config, level)
+
+def _replace(filename, text):
+    """Replace the content of `filename` with `text`.
+
+    Write to a temporary file then rename, so that readers of `filename` never
+    see partial content.
+    """
+    (dirname, basename) = os.path.split(filename)
+    tmpname = os.path.join(dirname, f'.{basename}')
+    with open_output(tmpname) as fid:
+        fid.write(text)
+    os.replace(tmpname, filename)
+
+class Watch:
+    """Build JUnit and asciidoc output for test results in `filename`.
+
+    `filename` is a file of JSON-lines test results, as output by testdrive.run,
+    which may still be growing; `suite` is the name of the test suite; `junit`
+    is the JUnit output filename, if any; `asciidoc` is the asciidoc output
+    filename, if any; `objdir` and `config` are for asciidoc output, as per
+    testdrive.asciidoc. `kwargs` are supplied to IncrementalJUnit.
+
+    Only complete lines of test results are consumed. XML and asciidoc for each
+    test case is generated once, when the test case is consumed. A Watch is a
+    context manager which closes the file of test results on exit.
+    """
+    def __init__(
+            self, filename, suite,
+            junit=None,
+            asciidoc=None, objdir=None, config=None,
+            **kwargs,
+        ): # pylint: disable=too-many-arguments
+        self._partial = ''
+        self._junit = junit
+        self._asciidoc = asciidoc
+        self._objdir = objdir
+        self._config = config
+        self._builder = IncrementalJUnit(suite, **kwargs)
+        self._suites = TestSuites()
+        self._suite = self._suites[suite] = _CachedSuite(
+            self._builder.testsuite(),
+        )
+        # open last, so that the file is not left open if setup fails
+        # pylint: disable-next=consider-using-with
+        self._fid = open(filename, encoding='utf-8')
+    def close(self):
+        """Close the file of test results."""
+        self._fid.close()
+    def __enter__(self):
+        return self
+    def __exit__(self, *exc_info):
+        self.close()
+    def poll(self):
+        """Consume test results written since the last poll.
+
+        Return the number of test cases consumed.
+        """
+        count = 0
+        while True:
+            line = self._fid.readline()
+            if not line:
+                return count
+            line = self._partial + line
+            if not line.endswith('\n'):
+                # wait for the rest of the line
+                self._partial = line
+                return count
+            self._partial = ''
+            if line.strip():
+                e_case = self._builder.add(json.loads(line))
+                if self._asciidoc:
+                    self._suite.add(TestCase(e_case))
+                count += 1
+    def write(self):
+        """Write JUnit and asciidoc output for test results consumed."""
+        if self._junit:
+            _replace(self._junit, self._builder.tostring() + '\n')
+        if self._asciidoc:
+            self._suite.set_metadata(self._builder.testsuite())
+            lines = document(self._suites, self._objdir, self._config)
+            _replace(self._asciidoc, '\n'.join(lines) + '\n')
+    def run(self, refresh, idle_timeout=None):
+        """Poll for test results, writing output at most every `refresh` s.
+
+        Return when no test results have been written for `idle_timeout`
+        seconds, if supplied: otherwise continue indefinitely.
+        """
+        latest = monotonic()
+        self.write()
+        while idle_timeout is None or monotonic() - latest < idle_timeout:
+            sleep(refresh)
+            if self.poll():
+                latest = monotonic()
+                self.write()
+
+def main():
+    """Build JUnit and asciidoc output continuously as test results stream in.
+
+    Follow a growing file of JSON-lines test results, as output by
+    testdrive.run, and rewrite JUnit and asciidoc output files as new test
+    results are written. Output files are replaced atomically, so they always
+    contain complete output for the test results written so far.
+    """
+    aparser = ArgumentParser(description=main.__doc__)
+    aparser.add_argument(
+        '--junit',
+        help="JUnit output file, which is compressed per testdrive.common",
+    )
+    aparser.add_argument(
+        '--asciidoc',
+        help=' '.join((
+            "asciidoc output file, which is compressed per testdrive.common;",
+            "requires `--objdir` and `--config`",
+        )),
+    )
+    aparser.add_argument(
+        '--objdir',
+        help="target directory for asciidoc, per testdrive.asciidoc",
+    )
+    aparser.add_argument(
+        '--config',
+        help="config file for asciidoc, per testdrive.asciidoc",
+    )
+    aparser.add_argument(
+        '--refresh', type=float, default=10,
+        help="the minimum number of seconds between output rewrites",
+    )
+    aparser.add_argument(
+        '--idle-timeout', type=float,
+        help=' '.join((
+            "exit after no test results have been written for this number",
+            "of seconds; if not supplied then follow until interrupted",
+        )),
+    )
+    aparser.add_argument(
+        '--hostname',
+        help="the name of the host which ran the tests",
+    )
+    aparser.add_argument(
+        '--exclude', nargs='*', default=('id',),
+        help="omit pairs for these keys from the JSON object in <system-out>",
+    )
+    aparser.add_argument(
+        '--prettify', action='store_true',
+        help="pretty print JUnit output",
+    )
+    aparser.add_argument(
+        '--baseurl-ids',
+        help="the base URL which test ids are relative to",
+    )
+    aparser.add_argument(
+        '--baseurl-specs',
+        help="the base URL which test specifications are relative to",
+    )
+    aparser.add_argument(
+        'suite',
+        help="the name of the test suite",
+    )
+    aparser.add_argument(
+        'input',
+        help="file of JSON-lines test results to follow",
+    )
+    args = aparser.parse_args()
+    if not (args.junit or args.asciidoc):
+        aparser.error('at least one of --junit, --asciidoc is required')
+    if args.asciidoc and not (args.objdir and args.config):
+        aparser.error('--asciidoc requires --objdir and --config')
+    with Watch(
+            args.input, args.suite,
+            args.junit,
+            args.asciidoc, args.objdir,
+            Config.json(args.config) if args.config else None,
+            hostname=args.hostname,
+            exclude=args.exclude,
+            baseurl_ids=args.baseurl_ids, baseurl_specs=args.baseurl_specs,
+            prettify=args.prettify,
+        ) as watch:
+        try:
+            watch.poll()
+            watch.run(args.refresh, args.idle_timeout)
+        except KeyboardInterrupt:
+            watch.poll()
+            watch.write()
+
+if __name__ == '__main__':
+    main()
@@ -4,32 +4,346 @@
 
 import sys
 from argparse import ArgumentParser
+import hashlib
+from html import escape
+import json
+import os
+import pickle
 
 from xml.etree import ElementTree
 
-import xmlschema
-from xmlschema.validators.exceptions import XMLSchemaValidationError
+from .common import (OutputSink, open_input, open_output)
+
+# compiled schemas, keyed by digest of schema file content
+_SCHEMAS = {}
+
+def load_schema(schema, cachedir=None):
+    """Return a compiled XSD schema from file `schema`.
+
+    Each compiled schema is cached in memory, keyed by the digest of `schema`
+    file content, so that `schema` is compiled at most once per process. If
+    `cachedir` is supplied, then the compiled schema is also cached on disk as
+    a pickle file in `cachedir`, whether or not it was cached in memory, so
+    that it is compiled at most once.
+    """
+    # xmlschema is slow to import: only import it when a schema is required
+    import xmlschema # pylint: disable=import-outside-toplevel
+    with open(schema, 'rb') as fid:
+        digest = hashlib.sha256(fid.read()).hexdigest()
+    compiled = _SCHEMAS.get(digest)
+    filename = None
+    if cachedir:
+        # pickle files are only compatible with the same xmlschema version
+        filename = os.path.join(
+            cachedir, f'{digest}-{xmlschema.__version__}.pickle',
+        )
+        if compiled is None:
+            try:
+                with open(filename, 'rb') as fid:
+                    compiled = pickle.load(fid)
+                filename = None
+            except (OSError, EOFError, AttributeError, pickle.UnpicklingError):
+                pass
+    if compiled is None:
+        compiled = xmlschema.XMLSchema(schema)
+    if filename and not os.path.exists(filename):
+        os.makedirs(cachedir, exist_ok=True)
+        # write then rename, so concurrent readers never see partial files
+        tmpname = f'{filename}.{os.getpid()}'
+        with open(tmpname, 'wb') as fid:
+            pickle.dump(compiled, fid)
+        os.replace(tmpname, filename)
+    _SCHEMAS[digest] = compiled
+    return compiled
 
 def validate(schema, filename):
     """Validate XML in `filename` against XSD `schema`.
 
-    Return True on validation success, or a string reason on validation failure.
+    `schema` is either a filename or a compiled schema, per load_schema().
+
+    Return True on validation success, or a string reason on validation failure,
+    including failure to read or parse `filename`.
     """
+    # pylint: disable-next=import-outside-toplevel
+    from xmlschema import (XMLResourceError, XMLSchemaValidationError)
+    if isinstance(schema, str):
+        schema = load_schema(schema)
     try:
-        xmlschema.validate(filename, schema)
+        with open_input(filename, encoding=None) as fid:
+            schema.validate(fid)
         return True
     except XMLSchemaValidationError as exc:
         return str(exc)
+    except (
+            XMLResourceError, ElementTree.ParseError, OSError, EOFError,
+        ) as exc:
+        return f'cannot read {filename}: {exc}'
+
+# compiled schema used by validate_many() worker processes
+_WORKER_SCHEMA = None
+
+def _init_worker(schema):
+    """Initialize a validate_many() worker process to use `schema`."""
+    global _WORKER_SCHEMA # pylint: disable=global-statement
+    _WORKER_SCHEMA = schema
+
+def _validate_worker(filename):
+    """Validate XML in `filename` in a validate_many() worker process."""
+    return validate(_WORKER_SCHEMA, filename)
+
+def validate_many(schema, filenames, jobs=1):
+    """Generate (filename, reason) validating XML in `filenames`.
+
+    `schema` is either a filename or a compiled schema, per load_schema(). It is
+    compiled once and used to validate every file in `filenames`, in up to
+    `jobs` parallel processes. Each `reason` is as returned by validate(), and
+    (filename, reason) pairs are generated in the order of `filenames`.
+    """
+    if isinstance(schema, str):
+        schema = load_schema(schema)
+    if jobs <= 1:
+        for filename in filenames:
+            yield (filename, validate(schema, filename))
+        return
+    # pylint: disable-next=import-outside-toplevel
+    from concurrent.futures import ProcessPoolExecutor
+    with ProcessPoolExecutor(
+            jobs, initializer=_init_worker, initargs=(schema,),
+        ) as executor:
+        yield from zip(filenames, executor.map(_validate_worker, filenames))
+
+class _Streamer:
+    """Validate XML in a single pass, emitting validated XML as it goes.
+
+    Subtrees at `depth` in the document are validated against `schema` in
+    batches of up to `batch` siblings, in a document containing shallow copies
+    of their ancestors (with attributes and text, but no other children). Each
+    subtree is discarded once it has been validated and output, so that memory
+    use is bounded by the size of a batch of subtrees. Elements above `depth`
+    with no children are similarly validated. `depth` must be at least 1, as
+    the root element cannot be detached from the document.
+    """
+    def __init__(self, schema, fout, pretty=False, depth=2, batch=256):
+        if depth < 1:
+            raise ValueError(f'bad depth "{depth}"')
+        self._schema = schema
+        self._fout = fout
+        self._pretty = pretty
+        self._depth = depth
+        self._batch_size = batch
+        self._parser = ElementTree.XMLPullParser(events=('start', 'end'))
+        # ancestors of the current element, with flags for validated
+        self._stack = []
+        self._validated = []
+        # subtrees at depth not yet validated
+        self._batch = []
+        # output held back until validated: bytes, str or element; and the
+        # index of the first item in output held back not yet validated
+        self._held = []
+        self._mark = None
+        # pretty print state
+        self._pending = None # element with open tag not yet output
+        self._last = None # element with tail not yet output
+    def feed(self, data):
+        """Feed bytes `data` to this streamer.
+
+        Return True if all complete batches are valid, or a string reason on
+        validation failure.
+        """
+        if not self._pretty:
+            self._held.append(data)
+        try:
+            self._parser.feed(data)
+            reason = self._read_events()
+        except ElementTree.ParseError as exc:
+            return str(exc)
+        if reason is True:
+            self._release()
+        return reason
+    def close(self):
+        """Complete validation of input fed to this streamer.
+
+        Return True if all input is valid, or a string reason on validation
+        failure.
+        """
+        try:
+            self._parser.close()
+            reason = self._read_events()
+        except ElementTree.ParseError as exc:
+            return str(exc)
+        if reason is True:
+            if self._pretty:
+                self._held.append('\n')
+            self._release()
+        return reason
+    def _read_events(self):
+        """Handle parser events, stopping at the first validation failure."""
+        for (event, elem) in self._parser.read_events():
+            reason = getattr(self, f'_{event}')(elem)
+            if reason is not True:
+                return reason
+        return True
+    def _release(self):
+        """Write output held back which has been validated."""
+        end = len(self._held) if self._mark is None else self._mark
+        for item in self._held[:end]:
+            if isinstance(item, ElementTree.Element):
+                ElementTree.indent(item, level=self._depth)
+                item.tail = None
+                item = ElementTree.tostring(item, encoding='unicode')
+            self._fout.write(item if isinstance(item, bytes) else item.encode())
+        del self._held[:end]
+        if self._mark is not None:
+            self._mark = 0
+    def _hold(self, item):
+        """Hold back `item` for pretty printed output."""
+        if self._pretty:
+            self._held.append(item)
+    @staticmethod
+    def _indentation(text, level):
+        """Return pretty printed `text`, an element text or tail at `level`."""
+        if not text or not text.strip():
+            return '\n' + '  ' * level
+        return escape(text, quote=False)
+    @staticmethod
+    def _tags(elem):
+        """Return (open, close) tag strings for `elem`."""
+        shallow = ElementTree.Element(elem.tag, elem.attrib)
+        text = ElementTree.tostring(
+            shallow, encoding='unicode', short_empty_elements=False,
+        )
+        idx = text.rindex('</')
+        return (text[:idx], text[idx:])
+    def _validate(self, elems):
+        """Validate `elems` in a document with shallow copies of ancestors.
+
+        Return True if valid, or a string reason on validation failure.
+        """
+        root = parent = None
+        for ancestor in self._stack:
+            shallow = ElementTree.Element(ancestor.tag, ancestor.attrib)
+            shallow.text = ancestor.text
+            if parent is None:
+                root = shallow
+            else:
+                parent.append(shallow)
+            parent = shallow
+        if parent is None:
+            (root,) = elems
+        else:
+            parent.extend(elems)
+        error = next(self._schema.iter_errors(root), None)
+        if error is not None:
+            return str(error)
+        self._validated = [True] * len(self._stack)
+        self._mark = None
+        return True
+    def _validate_batch(self):
+        """Validate the current batch of subtrees."""
+        if not self._batch:
+            return True
+        reason = self._validate(self._batch)
+        if not self._pretty:
+            for elem in self._batch:
+                elem.clear()
+        self._batch.clear()
+        return reason
+    def _start(self, elem):
+        """Handle start of `elem`."""
+        if self._mark is None:
+            # hold back output from the input chunk containing `elem`
+            self._mark = len(self._held) - (0 if self._pretty else 1)
+        level = len(self._stack)
+        if self._pending is not None:
+            self._hold(self._tags(self._pending)[0])
+            self._hold(self._indentation(self._pending.text, level))
+            self._pending = None
+        elif self._last is not None:
+            self._hold(self._indentation(self._last.tail, level))
+            self._last = None
+        if level < self._depth:
+            self._pending = elem
+        self._stack.append(elem)
+        self._validated.append(False)
+        return True
+    def _end(self, elem):
+        """Handle end of `elem`."""
+        level = len(self._stack) - 1
+        if level > self._depth:
+            self._stack.pop()
+            self._validated.pop()
+            return True
+        if level == self._depth:
+            self._stack.pop()
+            self._validated.pop()
+            # detach from parent until validated in a batch
+            del self._stack[-1][-1]
+            self._batch.append(elem)
+            self._hold(elem)
+            self._last = elem
+            if len(self._batch) < self._batch_size:
+                return True
+            return self._validate_batch()
+        # validate descendants, then this element if not yet validated
+        reason = self._validate_batch()
+        self._stack.pop()
+        if reason is True and not self._validated.pop():
+            reason = self._validate((elem,))
+        if reason is not True:
+            return reason
+        if self._pending is elem:
+            self._hold(elem)
+            self._pending = None
+        else:
+            self._hold(self._indentation(self._last.tail, level))
+            self._hold(self._tags(elem)[1])
+            elem.clear()
+        self._last = elem
+        if self._stack:
+            del self._stack[-1][-1]
+        return True
+
+def stream(
+        schema, fin, fout,
+        pretty=False, depth=2, batch=256, size=65536,
+    ): # pylint: disable=too-many-arguments
+    """Validate XML from `fin` against XSD `schema`, writing it to `fout`.
+
+    `schema` is either a filename or a compiled schema, per load_schema();
+    `fin` is a binary file object to read XML from, in chunks of `size` bytes;
+    `fout` is a binary file object to write validated XML to; if `pretty`
+    then write pretty printed XML (as per prettify()) instead of source XML;
+    `depth` is the depth of subtrees to validate in batches of up to `batch`
+    siblings, per class _Streamer.
+
+    XML is read, validated and written in a single pass, with memory use
+    bounded by the size of a batch of subtrees at `depth`. Only XML which has
+    been validated is written. Reading stops at the first validation failure.
+    Raise ValueError if `depth` is less than 1.
+
+    Return True on validation success, or a string reason on validation failure.
+    """
+    if isinstance(schema, str):
+        schema = load_schema(schema)
+    streamer = _Streamer(schema, fout, pretty, depth, batch)
+    while True:
+        data = fin.read(size)
+        if not data:
+            return streamer.close()
+        reason = streamer.feed(data)
+        if reason is not True:
+            return reason
 
 def prettify(filename):
     """Return prettified XML from `filename`."""
-    et_ = ElementTree.parse(filename)
+    with open_input(filename, encoding=None) as fid:
+        et_ = ElementTree.parse(fid)
     ElementTree.indent(et_)
     return ElementTree.tostring(et_.getroot(), encoding='unicode')
 
 def source(filename, encoding='utf-8'):
     """Return source text from `filename`."""
-    with open(filename, encoding=encoding) as fid:
+    with open_input(filename, encoding) as fid:
         return fid.read()
 
 def main():
@@ -43,16 +357,89 @@ def main():
         '--prettify', action='store_true',
         help="pretty print XML output",
     )
+    aparser.add_argument(
+        '--stream', action='store_true',
+        help=' '.join((
+            "validate and print XML in a single pass with bounded memory,",
+            "stopping at the first validation failure",
+        )),
+    )
+    aparser.add_argument(
+        '--depth', type=int, default=2,
+        help=' '.join((
+            "depth of subtrees to validate in batches in stream mode,",
+            "at least 1 (default 2, each testcase in JUnit);",
+            "a greater depth uses less memory, but validates ancestors of",
+            "subtrees with only their attributes and text",
+        )),
+    )
+    aparser.add_argument(
+        '--batch', action='store_true',
+        help=' '.join((
+            "print a JSON object with the validation result for each file",
+            "instead of printing valid XML; implied by multiple files",
+        )),
+    )
+    aparser.add_argument(
+        '--jobs', type=int, default=1,
+        help="number of files to validate in parallel in batch mode",
+    )
+    aparser.add_argument(
+        '--cache-dir',
+        help="directory to cache compiled XSD schema files in",
+    )
+    aparser.add_argument(
+        '--output', default='-',
+        help=' '.join((
+            "write output to this file instead of stdout, compressed if the",
+            "filename ends '.gz', '.xz', '.bz2' or '.zst'",
+        )),
+    )
     aparser.add_argument('schema', help="XSD schema file")
-    aparser.add_argument('filename', help="XML data file")
+    aparser.add_argument(
+        'filename', nargs='+',
+        help="XML data file, which may be compressed",
+    )
     args = aparser.parse_args()
-    reason = validate(args.schema, args.filename)
+    if args.depth < 1:
+        aparser.error('--depth must be at least 1')
+    schema = load_schema(args.schema, args.cache_dir)
+    if args.batch or len(args.filename) > 1:
+        valid = True
+        with open_output(args.output) as fout, OutputSink(fout) as sink:
+            for (filename, reason) in validate_many(
+                    schema, args.filename, args.jobs,
+                ):
+                result = reason is True
+                valid = valid and result
+                line = json.dumps({
+                    'filename': filename,
+                    'result': result,
+                    'reason': None if result or not args.verbose else reason,
+                })
+                # Python exits with error code 1 on EPIPE
+                if not sink.write_line(line):
+                    sys.exit(1)
+        if not valid:
+            sys.exit(1)
+        return
+    (filename,) = args.filename
+    if args.stream:
+        with open_input(filename, encoding=None) as fid:
+            with open_output(args.output, encoding=None) as fout:
+                reason = stream(schema, fid, fout, args.prettify, args.depth)
+                fout.flush()
+        if reason is not True:
+            sys.exit(reason if args.verbose else 1)
+        return
+    reason = validate(schema, filename)
     if reason is not True:
         sys.exit(reason if args.verbose else 1)
-    elif args.prettify:
-        print(prettify(args.filename))
-    else:
-        print(source(args.filename), end='')
+    with open_output(args.output) as fout:
+        if args.prettify:
+            print(prettify(filename), file=fout)
+        else:
+            print(source(filename), end='', file=fout)
 
 if __name__ == '__main__':
     main()
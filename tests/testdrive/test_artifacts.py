@@ -0,0 +1,98 @@
+### SPDX-License-Identifier: GPL-2.0-or-later
+
+"""Test cases for testdrive.artifacts"""
+
+import os
+from tempfile import TemporaryDirectory
+from unittest import TestCase
+
+from testdrive.artifacts import (ArtifactStore, Manifest, blob_name)
+from testdrive import asciidoc
+
+def write(path, data):
+    """Write bytes `data` to file `path` and return `path`."""
+    with open(path, 'wb') as fid:
+        fid.write(data)
+    return path
+
+class TestArtifactStore(TestCase):
+    """Tests for testdrive.artifacts.ArtifactStore"""
+    def test_put(self):
+        """Test testdrive.artifacts.ArtifactStore stores content once"""
+        with TemporaryDirectory() as tmpdir:
+            store = ArtifactStore(os.path.join(tmpdir, 'store'))
+            src1 = write(os.path.join(tmpdir, 'a.png'), b'foo')
+            src2 = write(os.path.join(tmpdir, 'b.png'), b'foo')
+            blob1 = store.put(src1)
+            blob2 = store.put(src2, remove=True)
+            self.assertEqual(blob1, blob2)
+            self.assertEqual(os.path.basename(blob1), blob_name(src1))
+            self.assertTrue(blob1.endswith('.png'))
+            self.assertTrue(os.path.exists(src1))
+            self.assertFalse(os.path.exists(src2))
+            self.assertEqual(store.put(blob1, remove=True), blob1)
+            self.assertTrue(os.path.exists(blob1))
+    def test_gc(self):
+        """Test testdrive.artifacts.ArtifactStore removes unreferenced blobs"""
+        with TemporaryDirectory() as tmpdir:
+            store = ArtifactStore(tmpdir)
+            manifest = Manifest(store, 'run1', interval=0)
+            self.assertEqual(
+                [(dct['name'], dct['blobs']) for dct in store.manifests()],
+                [('run1', [])],
+            )
+            kept = manifest.put(write(os.path.join(tmpdir, 'a'), b'foo'))
+            dropped = store.put(write(os.path.join(tmpdir, 'b'), b'bar'))
+            # the manifest is saved as blobs are added, before write()
+            self.assertEqual(store.gc(), (0, 0))
+            self.assertEqual(store.gc(grace=-1), (1, 3))
+            self.assertTrue(os.path.exists(kept))
+            self.assertFalse(os.path.exists(dropped))
+            dropped = store.put(write(os.path.join(tmpdir, 'b'), b'bar'))
+            manifest.write()
+            self.assertEqual(store.gc(), (0, 0))
+            self.assertEqual(store.gc(grace=-1), (1, 3))
+            self.assertTrue(os.path.exists(kept))
+            self.assertFalse(os.path.exists(dropped))
+            self.assertEqual(
+                [(dct['name'], dct['blobs']) for dct in store.manifests()],
+                [('run1', [os.path.basename(kept)])],
+            )
+            store.remove_manifest('run1')
+            self.assertEqual(store.gc(grace=-1), (1, 3))
+    def test_interval(self):
+        """Test testdrive.artifacts.Manifest saves blobs added at intervals"""
+        with TemporaryDirectory() as tmpdir:
+            store = ArtifactStore(tmpdir)
+            manifest = Manifest(store, 'run1')
+            blobs = [
+                os.path.basename(manifest.put(
+                    write(os.path.join(tmpdir, 'a'), data), remove=True,
+                ))
+                for data in (b'foo', b'bar')
+            ]
+            # not saved until the interval has elapsed, else when closed
+            self.assertEqual(store.manifests()[0]['blobs'], [])
+            self.assertEqual(store.gc(), (0, 0))
+            manifest.close()
+            self.assertEqual(store.manifests()[0]['blobs'], sorted(blobs))
+
+class TestDetailImages(TestCase):
+    """Tests for images in testdrive.asciidoc.TestDetail"""
+    def test_dedupe(self):
+        """Test testdrive.asciidoc.TestDetail stores each image once"""
+        with TemporaryDirectory() as tmpdir:
+            os.makedirs(os.path.join(tmpdir, 'pdf-assets/images'))
+            src1 = write(os.path.join(tmpdir, 'a.png'), b'foo')
+            src2 = write(os.path.join(tmpdir, 'b.png'), b'foo')
+            detail = asciidoc.TestDetail(((None, src1), ('B', src2)))
+            lines = list(detail.to_asciidoc(tmpdir))
+            name = blob_name(src1)
+            self.assertEqual(
+                [line for line in lines if line.startswith('image::')],
+                [f'image::{name}[]', f'image::{name}[]'],
+            )
+            self.assertEqual(
+                os.listdir(os.path.join(tmpdir, 'pdf-assets/images')),
+                [name],
+            )
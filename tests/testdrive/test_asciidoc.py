@@ -0,0 +1,98 @@
+### SPDX-License-Identifier: GPL-2.0-or-later
+
+"""Test cases for testdrive.asciidoc"""
+
+import re
+from tempfile import TemporaryDirectory
+from unittest import TestCase
+from xml.etree import ElementTree as ET
+
+from testdrive import asciidoc
+from testdrive.junit import create
+
+CASES = (
+    {
+        'id': 'https://example.com/A/', 'result': True, 'reason': None,
+        'argv': [], 'timestamp': '2023-08-25T07:22:57.368206+00:00',
+        'duration': 0.029972, 'data': {'baz': 99},
+    },
+    {
+        'id': 'https://example.com/B/', 'result': False,
+        'reason': 'something went wrong\nin detail', 'argv': ['x'],
+        'analysis': {'stats': {'mean': 1.5}, 'notes': ['a', 'b']},
+    },
+    {
+        'id': 'https://example.com/C/', 'result': 'error',
+        'reason': 'C/test.sh exited with code 7', 'argv': [],
+        'duration': 0.5,
+        'attempts': [
+            {'result': 'error', 'reason': 'first'},
+            {'result': 'error', 'reason': 'second'},
+        ],
+    },
+    {
+        'id': 'https://example.com/D/', 'result': 'skipped',
+        'reason': 'stopped', 'argv': [],
+    },
+)
+
+def document(suites):
+    """Return the asciidoc document for `suites` with uuids normalized."""
+    with TemporaryDirectory() as objdir:
+        text = '\n'.join(asciidoc.document(suites, objdir, asciidoc.Config()))
+    return re.sub(r'[0-9a-f]{8}(-[0-9a-f]{4}){3}-[0-9a-f]{12}', 'UUID', text)
+
+class TestFromResults(TestCase):
+    """Tests for testdrive.asciidoc test suites from result dicts"""
+    def test_same(self):
+        """Test testdrive.asciidoc from results is the same as from JUnit"""
+        junit = create.junit('suite', CASES)
+        from_junit = asciidoc.TestSuites()
+        root = ET.fromstring(junit.split('\n', 1)[1])
+        from_junit.add(asciidoc.TestSuite(root.find('testsuite')))
+        from_results = asciidoc.TestSuites()
+        from_results.add(asciidoc.TestSuite.from_results('suite', CASES))
+        self.assertEqual(document(from_results), document(from_junit))
+        case = from_results['suite']['https://example.com/C/']
+        self.assertEqual(case.attempts, 2)
+        self.assertEqual(case['test_id'], 'https://example.com/C/')
+
+class TestTestCases(TestCase):
+    """Tests for testdrive.asciidoc.TestCases"""
+    def test_view(self):
+        """Test testdrive.asciidoc.TestCase views rows in TestCases"""
+        suite = asciidoc.TestSuite.from_results('suite', CASES)
+        self.assertEqual(len(suite), 4)
+        case = suite['https://example.com/A/']
+        self.assertEqual(dict(case), {'test_id': 'https://example.com/A/'})
+        self.assertEqual(
+            (case.suite, case.result, case.reason, case.attempts),
+            ('suite', True, None, 1),
+        )
+        self.assertEqual(case.duration, 0.029972)
+        self.assertIsNone(suite['https://example.com/D/'].duration)
+        self.assertEqual(
+            suite['https://example.com/B/'].reason, 'something went wrong',
+        )
+        # uuids are derived from suite and case names
+        self.assertEqual(
+            case.uuid,
+            asciidoc.TestSuite.from_results('suite', CASES)[case.name].uuid,
+        )
+        self.assertEqual(
+            len({suite[name].uuid for name in suite}), len(CASES),
+        )
+    def test_add(self):
+        """Test testdrive.asciidoc.TestSuite adds TestCase rows"""
+        junit = create.junit('suite', CASES[2:3])
+        root = ET.fromstring(junit.split('\n', 1)[1])
+        case = asciidoc.TestCase(root.find('testsuite/testcase'))
+        suite = asciidoc.TestSuite.from_results('suite', CASES[:2])
+        suite.add(case)
+        self.assertEqual(list(suite), [c['id'] for c in CASES[:3]])
+        added = suite[case.name]
+        self.assertEqual(added.fields(), case.fields())
+        self.assertEqual(added.uuid, case.uuid)
+        self.assertEqual((added.duration, added.attempts), (0.5, 2))
+        with self.assertRaises(KeyError):
+            suite.add(case)
@@ -0,0 +1,109 @@
+### SPDX-License-Identifier: GPL-2.0-or-later
+
+"""Test cases for testdrive.common"""
+
+import gzip
+import io
+import os
+from tempfile import TemporaryDirectory
+import threading
+from unittest import TestCase
+
+from testdrive.common import (
+    OutputSink, compression, open_input, open_output,
+)
+
+class _Pipe(io.StringIO):
+    """A text stream counting flushes, which can be broken."""
+    def __init__(self):
+        super().__init__()
+        self.flushes = 0
+        self.broken = False
+    def write(self, s):
+        if self.broken:
+            raise BrokenPipeError()
+        return super().write(s)
+    def flush(self):
+        self.flushes += 1
+        super().flush()
+
+class TestOutputSink(TestCase):
+    """Tests for testdrive.common.OutputSink"""
+    def test_immediate(self):
+        """Test testdrive.common.OutputSink flushes each line by default"""
+        fid = _Pipe()
+        sink = OutputSink(fid)
+        self.assertTrue(sink.write_line('a'))
+        self.assertTrue(sink.write_line('b'))
+        self.assertEqual(fid.getvalue(), 'a\nb\n')
+        self.assertEqual(fid.flushes, 2)
+    def test_lines(self):
+        """Test testdrive.common.OutputSink writes batches of lines"""
+        fid = _Pipe()
+        with OutputSink(fid, lines=2) as sink:
+            for line in 'abc':
+                self.assertTrue(sink.write_line(line))
+            self.assertEqual(fid.getvalue(), 'a\nb\n')
+            self.assertEqual(fid.flushes, 1)
+        self.assertEqual(fid.getvalue(), 'a\nb\nc\n')
+        self.assertEqual(fid.flushes, 2)
+    def test_interval(self):
+        """Test testdrive.common.OutputSink writes batches when due"""
+        fid = _Pipe()
+        with OutputSink(fid, lines=100, interval=0.01) as sink:
+            self.assertTrue(sink.write_line('a'))
+            sink._stop.wait(0.1) # pylint: disable=protected-access
+            self.assertEqual(fid.getvalue(), 'a\n')
+    def test_broken_pipe(self):
+        """Test testdrive.common.OutputSink fails on broken pipe"""
+        fid = _Pipe()
+        sink = OutputSink(fid)
+        fid.broken = True
+        self.assertFalse(sink.write_line('a'))
+        fid.broken = False
+        self.assertFalse(sink.write_line('b'))
+        self.assertFalse(sink.close())
+        self.assertEqual(fid.getvalue(), '')
+
+class TestCompressed(TestCase):
+    """Tests for compressed input and output in testdrive.common"""
+    def test_roundtrip(self):
+        """Test testdrive.common reads compressed output"""
+        with TemporaryDirectory() as tmpdir:
+            for ext in ('', '.gz', '.xz', '.bz2'):
+                filename = os.path.join(tmpdir, 'data' + ext)
+                with open_output(filename) as fid:
+                    fid.write('foo\nbar\n')
+                with open_input(filename) as fid:
+                    self.assertEqual(fid.read(), 'foo\nbar\n')
+                with open_input(filename, encoding=None) as fid:
+                    self.assertEqual(fid.read(), b'foo\nbar\n')
+    def test_magic(self):
+        """Test testdrive.common detects compression from magic bytes"""
+        with TemporaryDirectory() as tmpdir:
+            for ext in ('.gz', '.xz', '.bz2'):
+                filename = os.path.join(tmpdir, 'data' + ext)
+                with open_output(filename) as fid:
+                    fid.write('foo\n')
+                with open(filename, 'rb') as fid:
+                    magic = fid.read(8)
+                self.assertEqual(compression('data', magic), ext)
+                renamed = os.path.join(tmpdir, 'data')
+                os.replace(filename, renamed)
+                with open_input(renamed) as fid:
+                    self.assertEqual(fid.read(), 'foo\n')
+        self.assertIsNone(compression('data.json', b'{"result"'))
+    def test_pipe(self):
+        """Test testdrive.common reads plain and compressed input from a pipe"""
+        with TemporaryDirectory() as tmpdir:
+            filename = os.path.join(tmpdir, 'fifo')
+            os.mkfifo(filename)
+            for data in (b'foo\n', gzip.compress(b'foo\n')):
+                def write(data=data):
+                    with open(filename, 'wb') as fid:
+                        fid.write(data)
+                writer = threading.Thread(target=write, daemon=True)
+                writer.start()
+                with open_input(filename) as fid:
+                    self.assertEqual(fid.read(), 'foo\n')
+                writer.join()
@@ -0,0 +1,124 @@
+### SPDX-License-Identifier: GPL-2.0-or-later
+
+"""Test cases for testdrive.compare"""
+
+import json
+import os
+from tempfile import TemporaryDirectory
+from unittest import TestCase
+
+from testdrive.compare import (Run, compare, to_asciidoc)
+from testdrive.junit.create import junit
+
+BASEURL = 'https://example.com/'
+
+def run(name, *cases):
+    """Return a Run `name` with (test, result, duration) `cases`."""
+    obj = Run(name)
+    for (test, result, duration) in cases:
+        obj.add(f'{BASEURL}{test}/', result, duration)
+    return obj
+
+class TestCompare(TestCase):
+    """Tests for testdrive.compare.compare"""
+    def test_results(self):
+        """Test testdrive.compare.compare result changes"""
+        before = run('before', ('A', True, 1), ('B', False, 1), ('C', True, 1))
+        after = run('after', ('A', 'error', 1), ('B', True, 1), ('D', True, 1))
+        comparison = compare((before,), after)
+        self.assertEqual(
+            comparison['summary'],
+            {
+                'tests': 3, 'new_failures': 1, 'fixed': 1,
+                'added': 1, 'removed': 1, 'slower': 0,
+            },
+        )
+        self.assertEqual(
+            comparison['new_failures'],
+            [{
+                'test_id': f'{BASEURL}A/', 'before': 'success', 'after': 'error',
+            }],
+        )
+        self.assertEqual(comparison['removed'][0]['test_id'], f'{BASEURL}C/')
+        lines = list(to_asciidoc(comparison))
+        self.assertIn('.New Failures', lines)
+        self.assertNotIn('.Slower', lines)
+    def test_skipped(self):
+        """Test testdrive.compare.compare result changes from skipped"""
+        before = run(
+            'before',
+            ('A', 'skipped', 1), ('B', 'skipped', 1),
+            ('C', True, 1), ('D', 'error', 1),
+        )
+        after = run(
+            'after',
+            ('A', False, 1), ('B', True, 1),
+            ('C', 'skipped', 1), ('D', 'skipped', 1),
+        )
+        comparison = compare((before,), after)
+        self.assertEqual(
+            [
+                (dct['test_id'], dct['before'], dct['after'])
+                for dct in comparison['new_failures']
+            ],
+            [(f'{BASEURL}A/', 'skipped', 'failure')],
+        )
+        self.assertEqual(
+            [
+                (dct['test_id'], dct['before'], dct['after'])
+                for dct in comparison['fixed']
+            ],
+            [
+                (f'{BASEURL}B/', 'skipped', 'success'),
+                (f'{BASEURL}D/', 'error', 'skipped'),
+            ],
+        )
+    def test_worst(self):
+        """Test testdrive.compare.Run keeps the most severe result"""
+        obj = run('run', ('A', True, 1), ('A', False, 2), ('A', 'skipped', 3))
+        self.assertEqual(obj.results, {f'{BASEURL}A/': 'failure'})
+        # durations of skipped test cases are excluded
+        self.assertEqual(obj.durations, {f'{BASEURL}A/': [1.0, 2.0]})
+    def test_slower(self):
+        """Test testdrive.compare.compare duration regressions"""
+        baselines = (
+            run('1', ('A', True, 1.0), ('B', True, 1.0), ('C', True, 1.0)),
+            run('2', ('A', True, 1.1), ('B', True, 3.0), ('C', True, 1.0)),
+            run('3', ('A', True, 1.0), ('B', True, 2.0), ('C', 'skipped', 9)),
+        )
+        current = run('4', ('A', True, 2.0), ('B', True, 3.5), ('C', True, 1))
+        comparison = compare(baselines, current)
+        # B is noisy and C has too few samples, so only A is slower
+        self.assertEqual(
+            [
+                (dct['test_id'], dct['samples'])
+                for dct in comparison['slower']
+            ],
+            [(f'{BASEURL}A/', 3)],
+        )
+        # too few samples with fewer baselines
+        comparison = compare(baselines[1:], current)
+        self.assertEqual(comparison['slower'], [])
+        # with a single sample only ratio and delta apply
+        comparison = compare(baselines[1:2], current, min_samples=1)
+        self.assertEqual(
+            [dct['test_id'] for dct in comparison['slower']],
+            [f'{BASEURL}A/'],
+        )
+    def test_load(self):
+        """Test testdrive.compare.Run loads JSON-lines and JUnit the same"""
+        cases = (
+            {'id': f'{BASEURL}A/', 'result': True, 'reason': None,
+             'duration': 0.5},
+            {'id': f'{BASEURL}B/', 'result': 'error', 'reason': 'bad'},
+        )
+        with TemporaryDirectory() as tmpdir:
+            results = os.path.join(tmpdir, 'results.json')
+            with open(results, 'w', encoding='utf-8') as fid:
+                fid.writelines(json.dumps(case) + '\n' for case in cases)
+            xml = os.path.join(tmpdir, 'results.xml')
+            with open(xml, 'w', encoding='utf-8') as fid:
+                fid.write(junit('suite', cases))
+            (from_results, from_junit) = (Run.load(results), Run.load(xml))
+        self.assertEqual(from_results.results, from_junit.results)
+        self.assertEqual(from_results.durations, from_junit.durations)
@@ -0,0 +1,96 @@
+### SPDX-License-Identifier: GPL-2.0-or-later
+
+"""Test cases for testdrive.history"""
+
+from unittest import TestCase
+from unittest.mock import patch
+
+from testdrive.history import History
+
+def _case(test_id, result, timestamp, duration):
+    """Return a test case dict suitable for ingesting into History."""
+    return {
+        'suite': 'suite',
+        'test_id': test_id,
+        'result': result,
+        'reason': None if result is True else 'reason',
+        'timestamp': timestamp,
+        'duration': duration,
+    }
+
+class TestHistory(TestCase):
+    """Tests for testdrive.history.History"""
+    def setUp(self):
+        self.history = History(':memory:')
+        runs = (
+            (True, True, 1.0),
+            (True, False, 2.0),
+            (False, True, 3.0),
+            (False, 'error', 4.0),
+        )
+        for (idx, (res_a, res_b, duration)) in enumerate(runs):
+            timestamp = f'2023-08-2{idx}T00:00:00.000000+00:00'
+            self.history.ingest(f'run{idx}', (
+                _case('A', res_a, timestamp, duration),
+                _case('B', res_b, timestamp, duration),
+            ))
+    def tearDown(self):
+        self.history.close()
+    def test_ingest_duplicate(self):
+        """Test testdrive.history.History skips duplicate test results"""
+        cases = (_case('A', True, '2023-08-30T00:00:00.000000+00:00', 1.0),)
+        self.assertIsNotNone(self.history.ingest('run0', cases))
+        self.assertIsNone(self.history.ingest('run0', cases))
+        self.assertIsNone(self.history.ingest('other', list(cases)))
+    def test_flaky(self):
+        """Test testdrive.history.History.flaky"""
+        self.assertEqual(
+            tuple(self.history.flaky()),
+            (
+                {
+                    'test_id': 'B',
+                    'runs': 4, 'success': 2, 'flips': 3, 'flip_rate': 1.0,
+                },
+                {
+                    'test_id': 'A',
+                    'runs': 4, 'success': 2, 'flips': 1,
+                    'flip_rate': 0.333333,
+                },
+            ),
+        )
+        self.assertEqual(
+            tuple(d['test_id'] for d in self.history.flaky(last=2)),
+            ('B',),
+        )
+    def test_durations(self):
+        """Test testdrive.history.History.durations"""
+        self.assertEqual(
+            tuple(self.history.durations(('A',), (50, 100))),
+            (
+                {
+                    'test_id': 'A', 'count': 4, 'min': 1.0, 'max': 4.0,
+                    'p50': 2.0, 'p100': 4.0,
+                },
+            ),
+        )
+        # many test ids are queried in chunks, in order of test id
+        ids = ['B', 'A', 'X'] + [f'Y{idx}' for idx in range(40000)]
+        self.assertEqual(
+            [dct['test_id'] for dct in self.history.durations(ids)],
+            ['A', 'B'],
+        )
+        with patch('testdrive.history.QUERY_IDS', 1):
+            self.assertEqual(
+                [dct['test_id'] for dct in self.history.durations(ids[:3])],
+                ['A', 'B'],
+            )
+    def test_bisect(self):
+        """Test testdrive.history.History.bisect"""
+        dct = self.history.bisect('A')
+        self.assertEqual(dct['first_failure']['source'], 'run2')
+        self.assertEqual(dct['last_success']['source'], 'run1')
+        dct = self.history.bisect('B')
+        self.assertEqual(dct['first_failure']['source'], 'run3')
+        self.assertEqual(dct['first_failure']['result'], 'error')
+        self.assertEqual(dct['last_success']['source'], 'run2')
+        self.assertIsNone(self.history.bisect('C'))
@@ -0,0 +1,274 @@
+### SPDX-License-Identifier: GPL-2.0-or-later
+
+"""Test cases for testdrive.junit"""
+
+import json
+import os
+from tempfile import TemporaryDirectory
+from unittest import TestCase
+from xml.etree import ElementTree as ET
+
+from testdrive.junit import (create, merge, split)
+from testdrive.xml import validate_many
+
+BASEURL = 'https://github.com/redhat-partner-solutions/testdrive/'
+
+SCHEMA = os.path.join(
+    os.path.dirname(__file__),
+    '../../junit/schema/testdrive.xsd',
+)
+
+class TestTestcase(TestCase):
+    """Tests for testdrive.junit.create.testcase"""
+    def _tags(self, result, *attempts):
+        """Return child tags of testcase element for `result`, `attempts`"""
+        case = {
+            'id': 'https://github.com/redhat-partner-solutions/testdrive/A/',
+            'result': result,
+            'reason': None if result is True else 'reason',
+            'attempts': [
+                {'result': res, 'reason': str(res)}
+                for res in (*attempts, result)
+            ],
+        }
+        return [child.tag for child in create.testcase('suite', case)]
+    def test_flaky(self):
+        """Test testdrive.junit.create.testcase with flaky test"""
+        self.assertEqual(
+            self._tags(True, False, 'error'),
+            ['flakyFailure', 'flakyError', 'system-out', 'properties'],
+        )
+    def test_rerun(self):
+        """Test testdrive.junit.create.testcase with rerun test"""
+        self.assertEqual(
+            self._tags(False, 'error'),
+            ['failure', 'rerunError', 'system-out', 'properties'],
+        )
+    def test_single(self):
+        """Test testdrive.junit.create.testcase with a single attempt"""
+        self.assertEqual(
+            self._tags('error'),
+            ['error', 'system-out', 'properties'],
+        )
+    def test_valid(self):
+        """Test testdrive.junit.create reruns in attempt order are valid"""
+        e_suite = ET.Element('testsuite', {
+            'name': 'suite', 'hostname': 'host',
+            'timestamp': '2023-08-25T07:00:00.000000+00:00',
+            'tests': '2', 'failures': '1', 'errors': '0', 'time': '2',
+        })
+        for (name, result, attempts) in (
+                ('A', True, ('error', False, 'error')),
+                ('B', False, (False, 'error', False)),
+            ):
+            e_case = create.testcase('suite', {
+                'id': f'{BASEURL}{name}/', 'result': result, 'reason': 'x',
+                'duration': 1,
+                'attempts': [
+                    {'result': res, 'reason': 'x'}
+                    for res in (*attempts, result)
+                ],
+            })
+            # the schema has system-out and properties per test suite
+            for tag in ('system-out', 'properties'):
+                e_case.remove(e_case.find(tag))
+            e_suite.append(e_case)
+        e_suite.append(ET.Element('properties'))
+        e_suite.append(ET.Element('system-out'))
+        with TemporaryDirectory() as tmpdir:
+            filename = os.path.join(tmpdir, 'suite.xml')
+            ET.ElementTree(e_suite).write(filename)
+            self.assertEqual(
+                list(validate_many(SCHEMA, [filename])), [(filename, True)],
+            )
+
+class TestJUnitSuites(TestCase):
+    """Tests for testdrive.junit.create.junit_suites"""
+    CASES = (
+        {
+            'id': f'{BASEURL}A/x/', 'result': True, 'reason': None,
+            'timestamp': '2023-08-25T07:00:00+00:00', 'duration': 10,
+        },
+        {
+            'id': f'{BASEURL}B/y/', 'result': False, 'reason': 'bad',
+            'timestamp': '2023-08-25T07:00:05+00:00', 'duration': 20,
+            'suite': 'other',
+        },
+        {
+            'id': f'{BASEURL}A/z/', 'result': 'error', 'reason': 'worse',
+            'timestamp': '2023-08-25T06:59:55+00:00', 'duration': 1,
+        },
+    )
+    def test_group(self):
+        """Test testdrive.junit.create.group by key and id prefix"""
+        self.assertEqual(
+            {k: len(v) for (k, v) in create.group(
+                self.CASES, 'main', key='suite',
+            ).items()},
+            {'main': 2, 'other': 1},
+        )
+        self.assertEqual(
+            list(create.group(self.CASES, 'main', depth=1, baseurl=BASEURL)),
+            ['main.A', 'main.B'],
+        )
+    def test_merge(self):
+        """Test testdrive.junit.create.junit_suites is the same as merge"""
+        groups = create.group(self.CASES, 'main', depth=1, baseurl=BASEURL)
+        with TemporaryDirectory() as tmpdir:
+            filenames = []
+            for (suite, cases) in groups.items():
+                filename = os.path.join(tmpdir, f'{suite}.xml')
+                with open(filename, 'w', encoding='utf-8') as fid:
+                    fid.write(create.junit(suite, cases))
+                filenames.append(filename)
+            merged = merge.merge(filenames)
+        self.assertEqual(create.junit_suites(groups), merged)
+        self.assertIn(
+            'timestamp="2023-08-25T06:59:55+00:00" time="30.0"', merged,
+        )
+
+class TestMerge(TestCase):
+    """Tests for testdrive.junit.merge.merge"""
+    CASES = TestJUnitSuites.CASES
+    def _write(self, tmpdir, suite, cases):
+        filename = os.path.join(tmpdir, f'{suite}.xml')
+        with open(filename, 'w', encoding='utf-8') as fid:
+            fid.write(create.junit(suite, cases))
+        return filename
+    def test_parallel(self):
+        """Test testdrive.junit.merge.merge in parallel processes"""
+        with TemporaryDirectory() as tmpdir:
+            filenames = [
+                self._write(tmpdir, f'suite{num}', self.CASES[num % 3:])
+                for num in range(7)
+            ]
+            merged = merge.merge(filenames)
+            self.assertEqual(merge.merge(filenames, jobs=3), merged)
+            pretty = merge.merge(filenames, prettify=True, jobs=3)
+        e_root = ET.fromstring(merged)
+        ET.indent(e_root)
+        self.assertEqual(
+            pretty,
+            ET.tostring(e_root, encoding='unicode', xml_declaration=True),
+        )
+        self.assertTrue(merged.startswith(
+            "<?xml version='1.0' encoding='utf-8'?>\n"
+            '<testsuites tests="15" errors="7" failures="5" skipped="0"'
+            ' timestamp="2023-08-25T06:59:55+00:00" time="30.0">'
+        ))
+    def test_attrs(self):
+        """Test testdrive.junit.merge.combine_attrs is associative"""
+        attrs = [
+            merge.suite_attrs(ET.Element('testsuite', {
+                'tests': '1', 'timestamp': case['timestamp'],
+                'time': str(case['duration']),
+            }))
+            for case in self.CASES
+        ]
+        (lhs, mid, rhs) = attrs
+        self.assertEqual(
+            merge.combine_attrs(merge.combine_attrs(lhs, mid), rhs),
+            merge.combine_attrs(lhs, merge.combine_attrs(mid, rhs)),
+        )
+    def test_dedupe(self):
+        """Test testdrive.junit.merge.merge keeps the latest test cases"""
+        rerun = dict(
+            self.CASES[2], result=True, reason=None,
+            timestamp='2023-08-25T08:00:00+00:00',
+        )
+        with TemporaryDirectory() as tmpdir:
+            filenames = [
+                self._write(tmpdir, 'rerun', [rerun]),
+                self._write(tmpdir, 'main', self.CASES),
+            ]
+            for jobs in (1, 2):
+                e_root = ET.fromstring(
+                    merge.merge(filenames, jobs=jobs, dedupe='latest'),
+                )
+                self.assertEqual(
+                    [e_suite.get('name') for e_suite in e_root],
+                    ['rerun', 'main'],
+                )
+                self.assertEqual(
+                    [e_root.get(n) for n in ('tests', 'errors', 'failures')],
+                    ['3', '0', '1'],
+                )
+                self.assertEqual(
+                    [e_case.get('name') for e_case in e_root.iter('testcase')],
+                    [rerun['id'], self.CASES[0]['id'], self.CASES[1]['id']],
+                )
+
+class TestSplit(TestCase):
+    """Tests for testdrive.junit.split"""
+    CASES = [
+        {
+            'id': f'{BASEURL}{name}/', 'result': result, 'reason': reason,
+            'timestamp': f'2023-08-25T07:00:0{num}.000000+00:00',
+            'duration': 1, 'data': {'values': list(range(50 * num))},
+        }
+        for (num, (name, result, reason)) in enumerate((
+            ('A', True, None), ('B', False, 'bad'), ('C', 'error', 'worse'),
+            ('D', 'skipped', 'no'), ('E', True, None),
+        ))
+    ]
+    def _split(self, tmpdir, budget, **kwargs):
+        filename = os.path.join(tmpdir, 'results.xml')
+        with open(filename, 'w', encoding='utf-8') as fid:
+            fid.write(create.junit_suites(
+                {'main': self.CASES[:3], 'other': self.CASES[3:]},
+                hostname='localhost',
+            ))
+        return split.split(
+            filename, os.path.join(tmpdir, 'shard'), budget, **kwargs,
+        )
+    def _cases(self, filenames):
+        cases = []
+        for filename in filenames:
+            e_root = ET.parse(filename).getroot()
+            for e_suite in e_root:
+                for e_case in e_suite:
+                    cases.append((e_suite.get('name'), e_case.get('name')))
+        return cases
+    def test_budget(self):
+        """Test testdrive.junit.split.split writes valid shards under budget"""
+        with TemporaryDirectory() as tmpdir:
+            filenames = self._split(tmpdir, 4000)
+            self.assertGreater(len(filenames), 2)
+            for filename in filenames:
+                # a shard only exceeds budget with a single test case
+                if os.path.getsize(filename) > 4000:
+                    self.assertEqual(len(self._cases((filename,))), 1)
+            self.assertEqual(
+                self._cases(filenames),
+                [('main', c['id']) for c in self.CASES[:3]]
+                + [('other', c['id']) for c in self.CASES[3:]],
+            )
+            for (_, reason) in validate_many(SCHEMA, filenames):
+                self.assertIs(reason, True)
+            e_root = ET.parse(filenames[0]).getroot()
+            self.assertEqual(e_root.get('tests'), e_root[0].get('tests'))
+    def test_limit(self):
+        """Test testdrive.junit.split.split limits system-out"""
+        with TemporaryDirectory() as tmpdir:
+            filenames = self._split(tmpdir, 1 << 20, externalize=1000)
+            self.assertEqual(len(filenames), 1)
+            for (_, reason) in validate_many(SCHEMA, filenames):
+                self.assertIs(reason, True)
+            outs = [
+                json.loads(e_out.text)
+                for e_out in ET.parse(filenames[0]).iter('system-out')
+            ]
+            self.assertNotIn('system_out', outs[0])
+            self.assertEqual(outs[2]['result'], 'error')
+            with open(
+                    os.path.join(tmpdir, outs[2]['system_out']),
+                    encoding='utf-8',
+                ) as fid:
+                self.assertEqual(
+                    json.load(fid)['data'], self.CASES[2]['data'],
+                )
+            filenames = self._split(tmpdir, 1 << 20, truncate=1000)
+            e_outs = list(ET.parse(filenames[0]).iter('system-out'))
+            self.assertTrue(e_outs[4].text.endswith(
+                f'truncated from {outs[4]["size"]} bytes',
+            ))
@@ -0,0 +1,44 @@
+### SPDX-License-Identifier: GPL-2.0-or-later
+
+"""Test cases for testdrive.__main__"""
+
+import os
+import subprocess
+import sys
+from unittest import TestCase
+
+SRC = os.path.join(os.path.dirname(__file__), '../../src')
+
+def python(*args):
+    """Return the completed process running Python with `args`."""
+    env = dict(os.environ)
+    env['PYTHONPATH'] = os.pathsep.join(
+        filter(None, (SRC, env.get('PYTHONPATH'))),
+    )
+    return subprocess.run(
+        (sys.executable, *args),
+        capture_output=True, check=False, env=env, text=True,
+    )
+
+class TestMain(TestCase):
+    """Tests for testdrive.__main__"""
+    def test_dispatch(self):
+        """Test testdrive.__main__ runs a command"""
+        subp = python('-m', 'testdrive', 'merge', '--help')
+        self.assertEqual(subp.returncode, 0)
+        self.assertTrue(subp.stdout.startswith('usage: testdrive merge'))
+    def test_unknown(self):
+        """Test testdrive.__main__ rejects an unknown command"""
+        subp = python('-m', 'testdrive', 'bogus')
+        self.assertNotEqual(subp.returncode, 0)
+        self.assertIn('unknown command "bogus"', subp.stderr)
+    def test_lazy(self):
+        """Test testdrive modules do not import unneeded dependencies"""
+        subp = python('-c', '\n'.join((
+            'import sys',
+            'import testdrive.junit.merge, testdrive.cases, testdrive.xml',
+            'heavy = ("testdrive.run", "subprocess", "xmlschema",',
+            '         "multiprocessing", "urllib.request")',
+            'print(" ".join(m for m in heavy if m in sys.modules))',
+        )))
+        self.assertEqual((subp.returncode, subp.stdout.strip()), (0, ''))
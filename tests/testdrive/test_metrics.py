@@ -0,0 +1,74 @@
+### SPDX-License-Identifier: GPL-2.0-or-later
+
+"""Test cases for testdrive.metrics"""
+
+from unittest import TestCase
+from urllib.request import urlopen
+
+from testdrive.metrics import (Metrics, serve)
+
+class TestMetrics(TestCase):
+    """Tests for testdrive.metrics.Metrics"""
+    def test_snapshot(self):
+        """Test testdrive.metrics.Metrics counts results and estimates eta"""
+        metrics = Metrics(('A', 'B', 'C', 'D'), expected={'C': 10.0})
+        metrics.record({'id': 'A', 'result': True, 'duration': 1.0})
+        metrics.record({'id': 'B', 'result': 'error', 'duration': 3.0})
+        snap = metrics.snapshot()
+        self.assertEqual(snap['total'], 4)
+        self.assertEqual(snap['completed'], 2)
+        self.assertEqual(snap['remaining'], 2)
+        self.assertEqual(
+            (snap['success'], snap['failure'], snap['error']),
+            (1, 0, 1),
+        )
+        self.assertEqual(snap['p50'], 1.0)
+        self.assertEqual(snap['p95'], 3.0)
+        # expected duration for C, mean duration for D
+        self.assertEqual(snap['eta'], 12.0)
+        # both remaining test cases can run concurrently
+        metrics = Metrics(
+            ('A', 'B', 'C'), expected={'A': 4.0, 'B': 2.0, 'C': 6.0},
+            jobs=lambda: 4,
+        )
+        metrics.record({'id': 'C', 'result': True, 'duration': 6.0})
+        self.assertEqual(metrics.snapshot()['eta'], 3.0)
+    def test_unknown_total(self):
+        """Test testdrive.metrics.Metrics without test ids"""
+        metrics = Metrics()
+        metrics.record({'id': 'A', 'result': False, 'duration': 1.0})
+        snap = metrics.snapshot()
+        self.assertEqual(snap['completed'], 1)
+        self.assertEqual(snap['failure'], 1)
+        self.assertIsNone(snap['total'])
+        self.assertIsNone(snap['remaining'])
+        self.assertIsNone(snap['eta'])
+    def test_prometheus(self):
+        """Test testdrive.metrics.Metrics Prometheus text exposition"""
+        metrics = Metrics(('A',))
+        lines = metrics.prometheus().splitlines()
+        self.assertIn('testdrive_cases 1', lines)
+        self.assertIn('testdrive_cases_completed_total 0', lines)
+        self.assertIn('testdrive_results_total{result="success"} 0', lines)
+        self.assertIn('testdrive_case_duration_seconds_count 0', lines)
+        # no durations, no duration quantiles
+        self.assertFalse(any(
+            line.startswith('testdrive_case_duration_seconds{')
+            for line in lines
+        ))
+    def test_serve(self):
+        """Test testdrive.metrics.serve serves metrics over HTTP"""
+        metrics = Metrics(('A', 'B'))
+        metrics.record({'id': 'A', 'result': True, 'duration': 1.5})
+        metrics.record({'id': 'B', 'result': True, 'duration': 2.0})
+        server = serve(metrics, port=0)
+        try:
+            port = server.server_address[1]
+            with urlopen(f'http://127.0.0.1:{port}/metrics') as response:
+                lines = response.read().decode().splitlines()
+        finally:
+            server.shutdown()
+            server.server_close()
+        self.assertIn('testdrive_cases_completed_total 2', lines)
+        self.assertIn('testdrive_case_duration_seconds_sum 3.5', lines)
+        self.assertIn('testdrive_case_duration_seconds_count 2', lines)
@@ -2,11 +2,17 @@
 
 """Test cases for testdrive.run"""
 
-import os.path
-
+from io import StringIO
+import json
+import os
+import sys
+from tempfile import TemporaryDirectory
+from time import monotonic
 from unittest import TestCase
+from unittest.mock import patch
 
-from testdrive.run import drive
+from testdrive.run import (BatchPlotter, drive, environment, main, read_job)
+from testdrive.schedule import (Resources, RetryPolicy)
 
 EXAMPLES = os.path.join(
     os.path.dirname(__file__),
@@ -40,3 +46,197 @@ class TestDrive(TestCase):
                 'reason': f'{test} exited with code 7\n\nfoo\nbaz\n',
             },
         )
+    def test_env_cwd(self):
+        """Test testdrive.run.drive with environment and working directory"""
+        with TemporaryDirectory() as tmpdir:
+            test = os.path.join(tmpdir, 'test.sh')
+            with open(test, 'w', encoding='utf-8') as fid:
+                fid.write('#!/bin/sh\n')
+                fid.write('echo "{\\"result\\": \\"$FOO\\", ')
+                fid.write('\\"reason\\": \\"$(pwd)\\"}"\n')
+            os.chmod(test, 0o755)
+            self.assertEqual(
+                drive(
+                    test, env={'FOO': 'bar'}, cwd=tmpdir, close_fds=False,
+                ),
+                {
+                    'argv': (),
+                    'result': 'bar',
+                    'reason': os.path.realpath(tmpdir),
+                },
+            )
+
+class TestMain(TestCase):
+    """Tests for testdrive.run.main and testdrive.run.read_job"""
+    def test_read_job(self):
+        """Test testdrive.run.read_job flags jobs which cannot run"""
+        (policy, resources) = (RetryPolicy(2), Resources({'dut': 2}))
+        job = read_job(
+            {'test': 'A', 'argv': ['x'], 'resources': {'dut': 2}},
+            policy, resources,
+        )
+        self.assertIsNone(job.error)
+        self.assertEqual(job.policy.attempts, 2)
+        for spec in (
+                {'test': 'A', 'argv': ['x'], 'resources': {'dut': 3}},
+                {'test': 'A', 'argv': ['x'], 'resources': {'dut': 0}},
+                {'test': 'A', 'argv': ['x'], 'retry': {'attempts': 0}},
+                {'test': 'A', 'argv': ['x'], 'retry': {'attempt': 3}},
+                {'test': 'A', 'argv': ['x'], 'retry': {'attempts': '3'}},
+                {'test': 'A', 'argv': ['x'], 'env': ['X=1']},
+            ):
+            job = read_job(spec, policy, resources)
+            self.assertIsInstance(job.error, str)
+            self.assertEqual((job.test, job.argv), ('A', ('x',)))
+            self.assertEqual(job.policy.attempts, 1)
+            self.assertEqual(job.resources, frozenset())
+        for spec in ({'argv': ['x']}, {'test': 1}, [], 'A'):
+            job = read_job(spec, policy, resources)
+            self.assertIsInstance(job.error, str)
+            self.assertEqual(job.test, '')
+    def test_main(self):
+        """Test testdrive.run.main outputs an error for a job not run"""
+        with TemporaryDirectory() as tmpdir:
+            tests = os.path.join(tmpdir, 'tests.json')
+            with open(tests, 'w', encoding='utf-8') as fid:
+                for spec in (
+                        {'test': 'B/testimpl.py', 'resources': {'dut': 2}},
+                        ['B/testimpl.py'],
+                    ):
+                    print(json.dumps(spec), file=fid)
+            output = os.path.join(tmpdir, 'results.json')
+            with patch('sys.argv', [
+                    'run', '--basedir', os.path.join(EXAMPLES, 'sequence'),
+                    '--jobs', '2', '--output', output,
+                    'https://example.com/', tests,
+                ]):
+                main()
+            with open(output, encoding='utf-8') as fid:
+                results = sorted(
+                    (json.loads(line) for line in fid),
+                    key=lambda result: result['result'] is True,
+                )
+        self.assertEqual(
+            [result['result'] for result in results], ['error', True],
+        )
+        self.assertIn('capacity is 1', results[0]['reason'])
+        self.assertEqual(results[0]['id'], 'https://example.com/B/')
+    def test_bad_jobs(self):
+        """Test testdrive.run.main rejects bad numbers of jobs"""
+        for opts in (
+                ['--jobs', '0'],
+                ['--adaptive', '--min-jobs', '4', '--jobs', '2'],
+            ):
+            with (
+                    patch('sys.argv', ['run', *opts, 'https://x/', 'in']),
+                    patch('sys.stderr', StringIO()) as stderr,
+                    self.assertRaises(SystemExit) as ctx,
+                ):
+                main()
+            self.assertEqual(ctx.exception.code, 2)
+            self.assertIn('jobs', stderr.getvalue())
+
+class TestEnvironment(TestCase):
+    """Tests for testdrive.run.environment"""
+    def test_environment(self):
+        """Test testdrive.run.environment keeps and overrides variables"""
+        env = {'PATH': '/bin', 'LC_ALL': 'C', 'LC_TIME': 'C', 'HOME': '/'}
+        with patch.dict(os.environ, env, clear=True):
+            environment.cache_clear()
+            self.assertIsNone(environment())
+            self.assertEqual(
+                environment(('PATH', 'LC_*'), frozenset({('LC_ALL', 'en')})),
+                {'PATH': '/bin', 'LC_ALL': 'en', 'LC_TIME': 'C'},
+            )
+            self.assertIs(
+                environment(None, frozenset({('X', '1')})),
+                environment(None, frozenset({('X', '1')})),
+            )
+            self.assertEqual(
+                environment(None, frozenset({('X', '1')})),
+                {**env, 'X': '1'},
+            )
+        environment.cache_clear()
+
+BATCH_PLOTTER = '''#!/usr/bin/env python3
+import json, os, sys
+if sys.argv[1:] == ['--batch']:
+    print(json.dumps({'batch': 1}), flush=True)
+    for line in sys.stdin:
+        job = json.loads(line)
+        if job['argv'] == ['bad']:
+            print(json.dumps({'error': 'bad args'}), flush=True)
+            continue
+        plot = {'path': f"{job['prefix']}_{os.getpid()}.png"}
+        plot['title'] = job['argv'][0]
+        print(json.dumps([plot]), flush=True)
+else:
+    print(json.dumps([f'{sys.argv[1]}.png']))
+'''
+
+class TestBatchPlotter(TestCase):
+    """Tests for testdrive.run.BatchPlotter"""
+    def plotter(self, tmpdir, content):
+        """Write executable plotter `content` to `tmpdir` and return path."""
+        path = os.path.join(tmpdir, 'plot.py')
+        with open(path, 'w', encoding='utf-8') as fid:
+            fid.write(content)
+        os.chmod(path, 0o755)
+        return path
+    def test_batch(self):
+        """Test testdrive.run.BatchPlotter plots with one process"""
+        with TemporaryDirectory() as tmpdir:
+            plotter = self.plotter(tmpdir, BATCH_PLOTTER)
+            batch = BatchPlotter()
+            try:
+                plots = [batch(plotter, 'x', arg) for arg in ('a', 'b')]
+                with self.assertRaises(RuntimeError):
+                    batch(plotter, 'x', 'bad')
+            finally:
+                batch.close()
+        self.assertEqual([p[0]['title'] for p in plots], ['a', 'b'])
+        self.assertEqual(plots[0][0]['path'], plots[1][0]['path'])
+    def test_fallback(self):
+        """Test testdrive.run.BatchPlotter falls back to plot()"""
+        with TemporaryDirectory() as tmpdir:
+            # a plotter which does not support batch mode
+            content = BATCH_PLOTTER.replace('--batch', '--none')
+            plotter = self.plotter(tmpdir, content)
+            batch = BatchPlotter()
+            try:
+                self.assertEqual(batch(plotter, 'x', 'a'), ['x.png'])
+                self.assertEqual(batch(plotter, 'y', 'a'), ['y.png'])
+            finally:
+                batch.close()
+    def test_empty_env(self):
+        """Test testdrive.run.BatchPlotter with an empty environment"""
+        with TemporaryDirectory() as tmpdir:
+            # run without PATH in the environment
+            content = BATCH_PLOTTER.replace(
+                '/usr/bin/env python3', sys.executable,
+            )
+            plotter = self.plotter(tmpdir, content)
+            batch = BatchPlotter()
+            try:
+                plots = [batch(plotter, 'x', a, env={}) for a in ('a', 'b')]
+            finally:
+                batch.close()
+        self.assertEqual([p[0]['title'] for p in plots], ['a', 'b'])
+        self.assertEqual(plots[0][0]['path'], plots[1][0]['path'])
+    def test_timeout(self):
+        """Test testdrive.run.BatchPlotter falls back if no first line"""
+        with TemporaryDirectory() as tmpdir:
+            # a plotter which waits for input when not in batch mode
+            content = BATCH_PLOTTER.replace(
+                "print(json.dumps({'batch': 1}), flush=True)",
+                "sys.stdin.readline()",
+            )
+            plotter = self.plotter(tmpdir, content)
+            batch = BatchPlotter(timeout=0.5)
+            start = monotonic()
+            try:
+                self.assertEqual(batch(plotter, 'x', 'a'), ['x.png'])
+                self.assertEqual(batch(plotter, 'y', 'a'), ['y.png'])
+            finally:
+                batch.close()
+            self.assertLess(monotonic() - start, 5)
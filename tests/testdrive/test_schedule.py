@@ -0,0 +1,322 @@
+### SPDX-License-Identifier: GPL-2.0-or-later
+
+"""Test cases for testdrive.schedule"""
+
+from io import StringIO
+import json
+import threading
+from time import (monotonic, sleep)
+from unittest import TestCase
+from unittest.mock import patch
+
+from testdrive.schedule import (
+    AdaptiveLimit, Job, Resources, RetryPolicy, Scheduler, StopPolicy,
+)
+
+class TestRetryPolicy(TestCase):
+    """Tests for testdrive.schedule.RetryPolicy"""
+    def test_retry(self):
+        """Test testdrive.schedule.RetryPolicy retries per policy"""
+        policy = RetryPolicy(3)
+        self.assertTrue(policy.retry(1, {'result': 'error'}))
+        self.assertTrue(policy.retry(2, {'result': 'error'}))
+        self.assertFalse(policy.retry(3, {'result': 'error'}))
+        self.assertFalse(policy.retry(1, {'result': False}))
+        self.assertFalse(policy.retry(1, {'result': True}))
+        policy = policy.override({'on': 'failure'})
+        self.assertTrue(policy.retry(1, {'result': False}))
+        self.assertFalse(policy.retry(1, {'result': True}))
+    def test_delay(self):
+        """Test testdrive.schedule.RetryPolicy exponential backoff"""
+        policy = RetryPolicy(4, backoff=0.5)
+        self.assertEqual(
+            [policy.delay(attempt) for attempt in (1, 2, 3)],
+            [0.5, 1.0, 2.0],
+        )
+    def test_bad(self):
+        """Test testdrive.schedule.RetryPolicy rejects bad values"""
+        with self.assertRaises(ValueError):
+            RetryPolicy(0)
+        with self.assertRaises(ValueError):
+            RetryPolicy(on='success')
+        for kwargs in (
+                {'attempts': '3'},
+                {'attempts': True},
+                {'backoff': -1},
+                {'backoff': '1'},
+            ):
+            with self.assertRaises(ValueError):
+                RetryPolicy(**kwargs)
+        for dct in ({'attempt': 3}, ['attempts']):
+            with self.assertRaises(ValueError):
+                RetryPolicy().override(dct)
+
+class TestStopPolicy(TestCase):
+    """Tests for testdrive.schedule.StopPolicy"""
+    def test_consecutive_errors(self):
+        """Test testdrive.schedule.StopPolicy stops on consecutive errors"""
+        policy = StopPolicy(consecutive_errors=2)
+        for result in ('error', True, 'error'):
+            policy.record({'result': result})
+            self.assertIsNone(policy.reason())
+        policy.record({'result': 'error'})
+        self.assertEqual(
+            policy.reason(), 'stopped after 2 consecutive errors',
+        )
+    def test_failure_ratio(self):
+        """Test testdrive.schedule.StopPolicy stops on failure ratio"""
+        policy = StopPolicy(failure_ratio=0.5, min_tests=4)
+        for result in (False, False, True):
+            policy.record({'result': result})
+            self.assertIsNone(policy.reason())
+        policy.record({'result': 'error'})
+        self.assertTrue(policy.reason().startswith('stopped after 3 of 4'))
+    def test_budget(self):
+        """Test testdrive.schedule.StopPolicy stops when budget exhausted"""
+        self.assertIsNone(StopPolicy(budget=60).reason())
+        self.assertIsNotNone(StopPolicy(budget=0).reason())
+
+class TestJob(TestCase):
+    """Tests for testdrive.schedule.Job"""
+    def test_from_spec(self):
+        """Test testdrive.schedule.Job from array and object specs"""
+        job = Job.from_spec(['A/test.py', 'x', 1])
+        self.assertEqual((job.test, job.argv), ('A/test.py', ('x', 1)))
+        self.assertEqual(job.policy.attempts, 1)
+        job = Job.from_spec(
+            {'test': 'B/test.py', 'argv': ['y'], 'retry': {'attempts': 2}},
+            RetryPolicy(on='failure'),
+        )
+        self.assertEqual((job.test, job.argv), ('B/test.py', ('y',)))
+        self.assertEqual((job.policy.attempts, job.policy.on), (2, 'failure'))
+        self.assertEqual((job.env, job.cwd), (frozenset(), None))
+        job = Job.from_spec(
+            {'test': 'C/test.py', 'env': {'X': '1'}, 'cwd': 'C'},
+        )
+        self.assertEqual((job.env, job.cwd), (frozenset({('X', '1')}), 'C'))
+
+class TestScheduler(TestCase):
+    """Tests for testdrive.schedule.Scheduler"""
+    def test_retry(self):
+        """Test testdrive.schedule.Scheduler retries jobs"""
+        outcomes = {'A': ['error', False, True], 'B': [True]}
+        started = {'A': [], 'B': []}
+        def func(job):
+            started[job.test].append(monotonic())
+            return {'result': outcomes[job.test].pop(0), 'reason': None}
+        policy = RetryPolicy(3, on='failure', backoff=0.05)
+        jobs = [Job('A', policy=policy), Job('B', policy=policy)]
+        done = {job.test: job for job in Scheduler(func, jobs=2).run(jobs)}
+        self.assertEqual(sorted(done), ['A', 'B'])
+        result = done['A'].result()
+        self.assertIs(result['result'], True)
+        self.assertEqual(
+            [attempt['result'] for attempt in result['attempts']],
+            ['error', False, True],
+        )
+        result = done['B'].result()
+        self.assertIs(result['result'], True)
+        self.assertEqual(len(result['attempts']), 1)
+        # retries of A were delayed per exponential backoff
+        gaps = [b - a for (a, b) in zip(started['A'], started['A'][1:])]
+        self.assertGreaterEqual(gaps[0], 0.05)
+        self.assertGreaterEqual(gaps[1], 0.1)
+    def test_stop(self):
+        """Test testdrive.schedule.Scheduler stops starting jobs"""
+        scheduler = None
+        def func(job):
+            if job.test == 'B':
+                scheduler.stop()
+            return {'result': 'error', 'reason': None}
+        scheduler = Scheduler(func)
+        policy = RetryPolicy(3, backoff=60)
+        jobs = iter([Job('A', policy=policy), Job('B'), Job('C')])
+        done = list(scheduler.run(jobs))
+        # A was waiting to be retried when B stopped the scheduler
+        self.assertEqual([job.test for job in done], ['B', 'A'])
+        self.assertEqual(len(done[1].attempts), 1)
+        self.assertEqual([job.test for job in jobs], ['C'])
+    def test_no_retry(self):
+        """Test testdrive.schedule.Scheduler runs jobs in order"""
+        def func(job):
+            return {'result': True, 'reason': None, 'n': job.argv[0]}
+        jobs = [Job('A', (num,)) for num in range(10)]
+        done = list(Scheduler(func).run(jobs))
+        self.assertEqual([job.result()['n'] for job in done], list(range(10)))
+        self.assertNotIn('attempts', done[0].result())
+
+class TestResources(TestCase):
+    """Tests for testdrive.schedule resource scheduling"""
+    def test_job(self):
+        """Test testdrive.schedule.Job resources from spec"""
+        job = Job.from_spec(
+            {'test': 'A', 'resources': {'dut': 'exclusive', 'nic': 2}},
+        )
+        self.assertEqual(job.resources, frozenset({('dut', None), ('nic', 2)}))
+        job = Job.from_spec({'test': 'B', 'resources': ['dut']})
+        self.assertEqual(job.resources, frozenset({('dut', 1)}))
+        for resources in ({'dut': 0}, {'dut': True}, 'nic', True, [1]):
+            with self.assertRaises(ValueError):
+                Job.from_spec({'test': 'C', 'resources': resources})
+        job = Job('D', resources={'dut': 2, 'nic': 'exclusive'})
+        with self.assertRaises(ValueError):
+            Resources().check(job)
+        resources = Resources({'dut': 2, 'nic': 3})
+        resources.check(job)
+        self.assertEqual(
+            sorted(resources.required(job)), [('dut', 2), ('nic', 3)],
+        )
+        self.assertEqual(Resources.parse('gnss=3'), ('gnss', 3))
+        with self.assertRaises(ValueError):
+            Resources.parse('gnss=0')
+    def test_conflicts(self):
+        """Test testdrive.schedule.Scheduler never overcommits resources"""
+        resources = Resources({'nic': 2})
+        held = {'dut': 0, 'nic': 0}
+        peak = {'dut': 0, 'nic': 0}
+        lock = threading.Lock()
+        def func(job):
+            with lock:
+                for (name, units) in resources.required(job):
+                    held[name] += units
+                    peak[name] = max(peak[name], held[name])
+            sleep(0.01)
+            with lock:
+                for (name, units) in resources.required(job):
+                    held[name] -= units
+            return {'result': True, 'reason': None}
+        specs = (
+            ['dut'], {'nic': 1}, {'nic': 1}, {'nic': 'exclusive'},
+            ['dut', 'nic'], [], {'nic': 1}, ['dut'],
+        )
+        jobs = [Job(f'T{num}', resources=r) for (num, r) in enumerate(specs)]
+        done = list(Scheduler(func, 4, resources).run(jobs))
+        self.assertEqual(len(done), len(jobs))
+        self.assertEqual(peak, {'dut': 1, 'nic': 2})
+    def test_fair(self):
+        """Test testdrive.schedule.Scheduler backfills without starvation"""
+        started = []
+        def func(job):
+            started.append(job.test)
+            sleep(0.02 if job.test == 'A' else 0.01)
+            return {'result': True, 'reason': None}
+        jobs = [
+            Job('A', resources=['dut']),
+            Job('B', resources={'dut': 1, 'nic': 1}),
+            Job('C', resources=['nic']),
+            Job('D'),
+            Job('E', resources=['dut']),
+        ]
+        done = list(Scheduler(func, 4).run(jobs))
+        self.assertEqual(len(done), 5)
+        # C and D backfill while B waits for dut; C does not take nic from B,
+        # and E does not take dut from B
+        self.assertEqual(set(started[:2]), {'A', 'D'})
+        self.assertLess(started.index('B'), started.index('C'))
+        self.assertLess(started.index('B'), started.index('E'))
+    def test_stop(self):
+        """Test testdrive.schedule.Scheduler returns unstarted jobs"""
+        scheduler = None
+        def func(job):
+            # allow time for B to be taken, waiting for dut
+            sleep(0.05)
+            scheduler.stop()
+            return {'result': True, 'reason': None}
+        scheduler = Scheduler(func, 2)
+        jobs = iter([Job('A', resources=['dut']), Job('B', resources=['dut'])])
+        done = list(scheduler.run(jobs))
+        self.assertEqual([job.test for job in done], ['A'])
+        self.assertEqual([job.test for job in scheduler.unstarted()], ['B'])
+        self.assertEqual(list(jobs), [])
+
+class TestAdaptiveLimit(TestCase):
+    """Tests for testdrive.schedule.AdaptiveLimit"""
+    def test_aimd(self):
+        """Test testdrive.schedule.AdaptiveLimit increases and decreases"""
+        load = {'load': 0.5, 'pressure': {'cpu': 1.0}}
+        log = StringIO()
+        adaptive = AdaptiveLimit(
+            1, 8, interval=0, cooldown=0, log=log, measure=lambda: load,
+        )
+        # no increase unless the limit is reached, with jobs queued
+        self.assertEqual(adaptive.update(0), 1)
+        self.assertEqual(adaptive.update(1, queued=False), 1)
+        self.assertEqual([adaptive.update(n) for n in (1, 2, 3)], [2, 3, 4])
+        load['pressure']['cpu'] = 50.0
+        self.assertEqual(adaptive.update(4), 2)
+        load['load'] = 4.0
+        self.assertEqual([adaptive.update(2) for _ in range(3)], [1, 1, 1])
+        load.update(load=0.1, pressure={})
+        self.assertEqual([adaptive.update(n) for n in (1, 2, 3)], [2, 3, 4])
+        reasons = [
+            json.loads(line)['reason'] for line in log.getvalue().splitlines()
+        ]
+        self.assertEqual(
+            reasons, ['headroom'] * 3 + ['pressure', 'load'] + ['headroom'] * 3,
+        )
+    def test_throughput(self):
+        """Test testdrive.schedule.AdaptiveLimit decreases on throughput"""
+        clock = [0.0]
+        log = StringIO()
+        with patch('testdrive.schedule.monotonic', lambda: clock[0]):
+            adaptive = AdaptiveLimit(
+                1, 8, interval=0, cooldown=0, log=log, samples=4,
+                measure=lambda: {'load': 0.0, 'pressure': {}},
+            )
+            def complete(*times):
+                for now in times:
+                    clock[0] = now
+                    adaptive.record()
+            # 1 job per second at limit 1
+            complete(1, 2, 3, 4)
+            self.assertEqual(adaptive.update(1), 2)
+            # too few jobs completed at limit 2 to measure a rate
+            complete(6, 8)
+            self.assertEqual(adaptive.update(2), 3)
+            # 1 job per 2 seconds at limit 3
+            complete(10, 12, 14, 16)
+            self.assertEqual(adaptive.update(3), 1)
+        self.assertEqual(
+            [
+                (dct['reason'], dct['rate'])
+                for dct in map(json.loads, log.getvalue().splitlines())
+            ],
+            [('headroom', 1.0), ('headroom', None), ('throughput', 0.5)],
+        )
+    def test_cooldown(self):
+        """Test testdrive.schedule.AdaptiveLimit waits before decreasing"""
+        adaptive = AdaptiveLimit(
+            1, 8, interval=0, cooldown=60,
+            measure=lambda: {'load': 2.0, 'pressure': {}},
+        )
+        adaptive.limit = 8
+        self.assertEqual([adaptive.update(8) for _ in range(3)], [4, 4, 4])
+    def test_scheduler(self):
+        """Test testdrive.schedule.Scheduler with an adaptive limit"""
+        peak = running = 0
+        lock = threading.Lock()
+        def func(_):
+            nonlocal peak, running
+            with lock:
+                running += 1
+                peak = max(peak, running)
+            sleep(0.01)
+            with lock:
+                running -= 1
+            return {'result': True, 'reason': None}
+        adaptive = AdaptiveLimit(
+            1, 3, interval=0,
+            measure=lambda: {'load': 0.0, 'pressure': {}},
+        )
+        jobs = [Job(f'T{num}') for num in range(20)]
+        done = list(Scheduler(func, adaptive=adaptive).run(jobs))
+        self.assertEqual(len(done), 20)
+        self.assertLessEqual(peak, 3)
+        self.assertGreater(peak, 1)
+        # the limit does not grow for a single job, with none queued
+        adaptive = AdaptiveLimit(
+            1, 3, interval=0,
+            measure=lambda: {'load': 0.0, 'pressure': {}},
+        )
+        done = list(Scheduler(func, adaptive=adaptive).run([Job('T')]))
+        self.assertEqual((len(done), adaptive.limit), (1, 1))
@@ -0,0 +1,120 @@
+### SPDX-License-Identifier: GPL-2.0-or-later
+
+"""Test cases for testdrive.selection"""
+
+import gzip
+import json
+import os
+from tempfile import TemporaryDirectory
+from unittest import TestCase
+
+from testdrive.selection import (Index, Selection, failed_ids, parse_ranges)
+from testdrive.uri import UriBuilder
+
+SPECS = (
+    ['A/testimpl.py', 'x'],
+    {'test': 'B/slow/testimpl.py', 'argv': ['y']},
+    ['C/test.sh'],
+    ['A/other.py'],
+)
+TESTS = ['A/testimpl.py', 'B/slow/testimpl.py', 'C/test.sh', 'A/other.py']
+
+def write_specs(filename, specs=SPECS, opener=open):
+    """Write `specs` to `filename`, one per line."""
+    with opener(filename, 'wt', encoding='utf-8') as fid:
+        for spec in specs:
+            fid.write(json.dumps(spec) + '\n')
+
+class TestSelection(TestCase):
+    """Tests for testdrive.selection.Selection"""
+    def test_ranges(self):
+        """Test testdrive.selection.parse_ranges"""
+        self.assertEqual(
+            parse_ranges('2,4-6,-3,10-'),
+            [(2, 2), (4, 6), (1, 3), (10, None)],
+        )
+        for string in ('abc', '0', '3-2', '1-x', ''):
+            with self.assertRaises(ValueError):
+                parse_ranges(string)
+    def test_match(self):
+        """Test testdrive.selection.Selection matches per patterns and ranges"""
+        selection = Selection(include=('A/*', 're:slow'), exclude=('*/other*',))
+        self.assertEqual(
+            [selection.match(n, t) for (n, t) in enumerate(TESTS, 1)],
+            [True, True, False, False],
+        )
+        selection = Selection(ranges=parse_ranges('2-3'))
+        self.assertEqual(
+            [selection.match(n, 'A/testimpl.py') for n in (1, 2, 3, 4)],
+            [False, True, True, False],
+        )
+    def test_failed(self):
+        """Test testdrive.selection.Selection selects previously failed tests"""
+        builder = UriBuilder('https://example.com/')
+        with TemporaryDirectory() as tmpdir:
+            results = os.path.join(tmpdir, 'results.json')
+            with open(results, 'w', encoding='utf-8') as fid:
+                for (test_id, result) in (('A/', True), ('C/', 'error')):
+                    fid.write(json.dumps({
+                        'id': f'https://example.com/{test_id}',
+                        'result': result,
+                    }) + '\n')
+            ids = failed_ids(results)
+        selection = Selection(ids=ids, builder=builder)
+        self.assertFalse(selection.match(1, 'A/testimpl.py'))
+        self.assertTrue(selection.match(3, 'C/test.sh'))
+    def test_lines(self):
+        """Test testdrive.selection.Selection reads selected lines via index"""
+        selection = Selection(include=('re:^[AB]/',), ranges=((2, None),))
+        with TemporaryDirectory() as tmpdir:
+            filename = os.path.join(tmpdir, 'tests.json')
+            write_specs(filename)
+            with open(filename, encoding='utf-8') as fid:
+                lines = list(selection.lines(filename, fid))
+            self.assertTrue(os.path.isfile(f'{filename}.idx'))
+            self.assertEqual(
+                [json.loads(line) for line in lines],
+                [SPECS[1], SPECS[3]],
+            )
+            # compressed input is read line by line, without an index
+            compressed = os.path.join(tmpdir, 'tests.json.gz')
+            write_specs(compressed, opener=gzip.open)
+            with gzip.open(compressed, 'rt', encoding='utf-8') as fid:
+                self.assertEqual(list(selection.lines(compressed, fid)), lines)
+            self.assertFalse(os.path.exists(f'{compressed}.idx'))
+    def test_blank(self):
+        """Test testdrive.selection.Selection counts blank lines"""
+        selection = Selection(ranges=parse_ranges('3'))
+        with TemporaryDirectory() as tmpdir:
+            filename = os.path.join(tmpdir, 'tests.json')
+            with open(filename, 'w', encoding='utf-8') as fid:
+                fid.write(json.dumps(SPECS[0]) + '\n\n')
+                fid.write(json.dumps(SPECS[1]) + '\n')
+            for name in (filename, '-'):
+                with open(filename, encoding='utf-8') as fid:
+                    lines = list(selection.lines(name, fid))
+                self.assertEqual([json.loads(l) for l in lines], [SPECS[1]])
+
+class TestIndex(TestCase):
+    """Tests for testdrive.selection.Index"""
+    def test_rebuild(self):
+        """Test testdrive.selection.Index is rebuilt when input is modified"""
+        with TemporaryDirectory() as tmpdir:
+            filename = os.path.join(tmpdir, 'tests.json')
+            write_specs(filename)
+            index = Index.load(filename)
+            self.assertEqual(
+                [(number, test) for (number, _, test) in index.entries],
+                list(enumerate(TESTS, 1)),
+            )
+            self.assertEqual(Index.load(filename).entries, index.entries)
+            write_specs(filename, SPECS[2:])
+            index = Index.load(filename)
+            self.assertEqual(
+                [test for (_, _, test) in index.entries],
+                TESTS[2:],
+            )
+            self.assertEqual(
+                [json.loads(line) for line in index.read((1,))],
+                [SPECS[3]],
+            )
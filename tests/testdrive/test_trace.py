@@ -0,0 +1,87 @@
+### SPDX-License-Identifier: GPL-2.0-or-later
+
+"""Test cases for testdrive.trace"""
+
+import json
+import os
+from tempfile import TemporaryDirectory
+from unittest import TestCase
+from unittest.mock import patch
+
+from testdrive.trace import (NullTracer, Tracer)
+
+# perf_counter_ns() values for Tracer(), spans and summary(), in seconds
+CLOCK = (0, 0, 1, 1.5, 2, 3, 4, 6, 7, 10)
+
+def _tracer():
+    """Return a Tracer with spans recorded for concurrent test cases."""
+    tracer = Tracer()
+    with tracer.span('case', test='A'):
+        # case B runs concurrently with case A
+        with tracer.span('case', test='B'):
+            with tracer.span('build'):
+                pass
+    with tracer.span('case', test='C'):
+        pass
+    return tracer
+
+@patch(
+    'testdrive.trace.perf_counter_ns',
+    side_effect=[int(sec * 1e9) for sec in CLOCK],
+)
+class TestTracer(TestCase):
+    """Tests for testdrive.trace.Tracer"""
+    def test_span(self, _):
+        """Test testdrive.trace.Tracer records spans"""
+        events = _tracer().events()
+        self.assertEqual(events['displayTimeUnit'], 'ms')
+        self.assertEqual(
+            [
+                (e['name'], e['ts'], e['dur'], e['args'])
+                for e in events['traceEvents']
+            ],
+            [
+                ('build', 1.5e6, 0.5e6, {}),
+                ('case', 1e6, 2e6, {'test': 'B'}),
+                ('case', 0, 4e6, {'test': 'A'}),
+                ('case', 6e6, 1e6, {'test': 'C'}),
+            ],
+        )
+        for event in events['traceEvents']:
+            self.assertEqual(event['ph'], 'X')
+            self.assertEqual(event['pid'], os.getpid())
+    def test_summary(self, _):
+        """Test testdrive.trace.Tracer summarizes spans per phase"""
+        summary = {dct['phase']: dct for dct in _tracer().summary()}
+        self.assertEqual(list(summary), ['build', 'case', 'runner'])
+        self.assertEqual(summary['build'], {
+            'phase': 'build', 'count': 1,
+            'total': 0.5, 'mean': 0.5, 'max': 0.5, 'share': 0.05,
+        })
+        self.assertEqual(summary['case'], {
+            'phase': 'case', 'count': 3,
+            'total': 7.0, 'mean': round(7 / 3, 6), 'max': 4.0, 'share': 0.7,
+        })
+        # elapsed time not in any of the overlapping case spans
+        self.assertEqual(summary['runner'], {
+            'phase': 'runner', 'count': 1,
+            'total': 5.0, 'mean': 5.0, 'max': 5.0, 'share': 0.5,
+        })
+    def test_write_events(self, _):
+        """Test testdrive.trace.Tracer writes Chrome trace events"""
+        tracer = _tracer()
+        with TemporaryDirectory() as tmpdir:
+            filename = os.path.join(tmpdir, 'trace.json')
+            tracer.write_events(filename)
+            with open(filename, encoding='utf-8') as fid:
+                self.assertEqual(json.load(fid), tracer.events())
+
+class TestNullTracer(TestCase):
+    """Tests for testdrive.trace.NullTracer"""
+    def test_span(self):
+        """Test testdrive.trace.NullTracer records nothing"""
+        tracer = NullTracer()
+        with tracer.span('case', test='A'):
+            with tracer.span('build'):
+                pass
+        self.assertFalse(hasattr(tracer, 'events'))
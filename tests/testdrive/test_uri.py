@@ -2,7 +2,9 @@
 
 """Test cases for testdrive.uri"""
 
+import gc
 from unittest import TestCase
+import weakref
 
 from testdrive.uri import UriBuilder
 
@@ -163,3 +165,49 @@ class TestUrl(TestCase):
             builder.rebase(url, base2),
             'ftp://mno.pqr/stu/wibble/wobble/',
         )
+
+class TestMany(TestCase):
+    """Tests for testdrive.uri.UriBuilder building and rebasing many URIs"""
+    def test_build_many(self):
+        """Test testdrive.uri.UriBuilder builds many URIs"""
+        builder = UriBuilder('https://abc.org/def/', v=4)
+        paths = ('foo', '/bar/baz/', 'foo')
+        self.assertEqual(
+            builder.build_many(paths),
+            [builder.build(path) for path in paths],
+        )
+        self.assertEqual(
+            builder.build_many(paths),
+            [
+                'https://abc.org/def/foo/?v=4',
+                'https://abc.org/def/bar/baz/?v=4',
+                'https://abc.org/def/foo/?v=4',
+            ],
+        )
+        # a test at the top level has an empty directory
+        self.assertEqual(builder.build(''), 'https://abc.org/def/?v=4')
+    def test_rebase_many(self):
+        """Test testdrive.uri.UriBuilder rebases many URIs"""
+        builder = UriBuilder('urn:abc')
+        urns = builder.build_many(('foo', 'bar/baz'))
+        self.assertEqual(
+            builder.rebase_many(urns, 'https://target/base/'),
+            [
+                'https://target/base/foo/',
+                'https://target/base/bar/baz/',
+            ],
+        )
+        with self.assertRaises(ValueError):
+            builder.rebase_many(urns + ['urn:xyz:foo'], 'https://target/')
+    def test_memo(self):
+        """Test testdrive.uri.UriBuilder memoises per instance"""
+        builder = UriBuilder('urn:abc')
+        other = UriBuilder('urn:abc')
+        builder.build('foo')
+        builder.build('foo')
+        self.assertEqual(builder.build.cache_info().hits, 1)
+        self.assertEqual(other.build.cache_info().currsize, 0)
+        ref = weakref.ref(builder)
+        del builder
+        gc.collect()
+        self.assertIsNone(ref())
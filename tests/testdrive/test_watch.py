@@ -0,0 +1,68 @@
+### SPDX-License-Identifier: GPL-2.0-or-later
+
+"""Test cases for testdrive.watch"""
+
+import json
+import os
+from tempfile import TemporaryDirectory
+from unittest import TestCase
+
+from testdrive.junit.create import (IncrementalJUnit, junit)
+from testdrive.watch import Watch
+
+CASES = (
+    {
+        'id': 'https://github.com/redhat-partner-solutions/testdrive/A/',
+        'result': False, 'reason': 'something went wrong',
+        'timestamp': '2023-08-25T07:23:40.010000+00:00', 'duration': 0.5,
+    },
+    {
+        'id': 'https://github.com/redhat-partner-solutions/testdrive/B/',
+        'result': True, 'reason': None,
+        'timestamp': '2023-08-25T07:23:41.010000+00:00', 'duration': 1.5,
+    },
+    {
+        'id': 'https://github.com/redhat-partner-solutions/testdrive/C/',
+        'result': 'error', 'reason': 'no result',
+    },
+)
+
+class TestIncrementalJUnit(TestCase):
+    """Tests for testdrive.junit.create.IncrementalJUnit"""
+    def test_junit(self):
+        """Test testdrive.junit.create.IncrementalJUnit output matches junit"""
+        for prettify in (False, True):
+            for count in range(len(CASES) + 1):
+                builder = IncrementalJUnit(
+                    'suite', hostname='host', prettify=prettify,
+                )
+                for case in CASES[:count]:
+                    builder.add(case)
+                self.assertEqual(
+                    builder.tostring(),
+                    junit(
+                        'suite', CASES[:count], hostname='host',
+                        prettify=prettify,
+                    ),
+                )
+
+class TestWatch(TestCase):
+    """Tests for testdrive.watch.Watch"""
+    def test_partial(self):
+        """Test testdrive.watch.Watch only consumes complete lines"""
+        with TemporaryDirectory() as tmpdir:
+            filename = os.path.join(tmpdir, 'results.json')
+            output = os.path.join(tmpdir, 'junit.xml')
+            lines = [json.dumps(case) + '\n' for case in CASES]
+            with open(filename, 'w', encoding='utf-8') as fid:
+                fid.write(lines[0] + lines[1][:10])
+                fid.flush()
+                with Watch(filename, 'suite', output) as watch:
+                    self.assertEqual(watch.poll(), 1)
+                    fid.write(lines[1][10:] + lines[2])
+                    fid.flush()
+                    self.assertEqual(watch.poll(), 2)
+                    self.assertEqual(watch.poll(), 0)
+                    watch.write()
+            with open(output, encoding='utf-8') as fid:
+                self.assertEqual(fid.read(), junit('suite', CASES) + '\n')
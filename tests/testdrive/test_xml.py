@@ -0,0 +1,125 @@
+### SPDX-License-Identifier: GPL-2.0-or-later
+
+"""Test cases for testdrive.xml"""
+
+from io import BytesIO
+import os.path
+from tempfile import TemporaryDirectory
+
+from unittest import TestCase
+from unittest.mock import patch
+
+from testdrive.xml import (
+    load_schema, validate, validate_many, stream, prettify,
+)
+
+SCHEMA = os.path.join(
+    os.path.dirname(__file__),
+    '../../junit/schema/testdrive.xsd',
+)
+
+MINIMAL = os.path.join(
+    os.path.dirname(__file__),
+    '../../junit/examples/minimal.xml',
+)
+
+VALID = '''<?xml version='1.0' encoding='utf-8'?>
+<testsuites tests="0" errors="0" failures="0" skipped="0" />
+'''
+
+SUITES = '''<?xml version='1.0' encoding='utf-8'?>
+<testsuites tests="2" errors="0" failures="1" skipped="0"><testsuite name="s">\
+<testcase name="a"><failure message="m" /><system-out>{
+    "x": 1
+}</system-out></testcase><testcase name="b" /></testsuite>\
+<testsuite name="t" /></testsuites>
+'''
+
+class TestValidate(TestCase):
+    """Tests for testdrive.xml validation"""
+    def test_load_schema(self):
+        """Test testdrive.xml.load_schema compiles schema once"""
+        with (
+                patch.dict('testdrive.xml._SCHEMAS', clear=True),
+                TemporaryDirectory() as cachedir,
+                TemporaryDirectory() as other,
+            ):
+            schema = load_schema(SCHEMA, cachedir)
+            self.assertIs(load_schema(SCHEMA), schema)
+            self.assertEqual(len(os.listdir(cachedir)), 1)
+            # memory cache hit still writes the pickle file to other
+            self.assertIs(load_schema(SCHEMA, other), schema)
+            self.assertEqual(os.listdir(other), os.listdir(cachedir))
+        with (
+                patch.dict('testdrive.xml._SCHEMAS', clear=True),
+                TemporaryDirectory() as cachedir,
+            ):
+            schema = load_schema(SCHEMA, cachedir)
+            # memory cache miss loads the pickle file
+            with patch.dict('testdrive.xml._SCHEMAS', clear=True):
+                self.assertIsNot(load_schema(SCHEMA, cachedir), schema)
+    def test_validate(self):
+        """Test testdrive.xml.validate"""
+        with TemporaryDirectory() as tmpdir:
+            valid = os.path.join(tmpdir, 'valid.xml')
+            with open(valid, 'w', encoding='utf-8') as fid:
+                fid.write(VALID)
+            self.assertIs(validate(SCHEMA, valid), True)
+            self.assertIsInstance(validate(SCHEMA, MINIMAL), str)
+            # malformed or missing input is a failure, not an exception
+            malformed = os.path.join(tmpdir, 'malformed.xml')
+            with open(malformed, 'w', encoding='utf-8') as fid:
+                fid.write(VALID[:-5])
+            self.assertIsInstance(validate(SCHEMA, malformed), str)
+            missing = os.path.join(tmpdir, 'missing.xml')
+            self.assertIsInstance(validate(SCHEMA, missing), str)
+    def test_validate_many(self):
+        """Test testdrive.xml.validate_many"""
+        with TemporaryDirectory() as tmpdir:
+            valid = os.path.join(tmpdir, 'valid.xml')
+            with open(valid, 'w', encoding='utf-8') as fid:
+                fid.write(VALID)
+            malformed = os.path.join(tmpdir, 'malformed.xml')
+            with open(malformed, 'w', encoding='utf-8') as fid:
+                fid.write(VALID[:-5])
+            filenames = (valid, MINIMAL, malformed, valid)
+            for jobs in (1, 2):
+                self.assertEqual(
+                    tuple(
+                        (f, r is True)
+                        for (f, r) in validate_many(SCHEMA, filenames, jobs)
+                    ),
+                    (
+                        (valid, True), (MINIMAL, False),
+                        (malformed, False), (valid, True),
+                    ),
+                )
+    def test_stream(self):
+        """Test testdrive.xml.stream"""
+        with TemporaryDirectory() as tmpdir:
+            filename = os.path.join(tmpdir, 'suites.xml')
+            with open(filename, 'w', encoding='utf-8') as fid:
+                fid.write(SUITES)
+            pretty = (prettify(filename) + '\n').encode()
+            for depth in (1, 2, 3):
+                for batch in (1, 256):
+                    fout = BytesIO()
+                    with open(filename, 'rb') as fin:
+                        self.assertIs(
+                            stream(SCHEMA, fin, fout, False, depth, batch, 16),
+                            True,
+                        )
+                    self.assertEqual(fout.getvalue(), SUITES.encode())
+                    fout = BytesIO()
+                    with open(filename, 'rb') as fin:
+                        self.assertIs(
+                            stream(SCHEMA, fin, fout, True, depth, batch, 16),
+                            True,
+                        )
+                    self.assertEqual(fout.getvalue(), pretty)
+        with open(MINIMAL, 'rb') as fin:
+            fout = BytesIO()
+            self.assertIsInstance(stream(SCHEMA, fin, fout), str)
+            self.assertEqual(fout.getvalue(), b'')
+        with self.assertRaises(ValueError):
+            stream(SCHEMA, BytesIO(SUITES.encode()), BytesIO(), depth=0)